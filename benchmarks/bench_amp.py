@@ -0,0 +1,70 @@
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+import common
+import numpy as np
+import torch
+
+'''
+fp32 vs --amp (bfloat16 autocast on CPU): step time, peak memory and info-loss convergence.
+Each mode runs in its own process so that peak RSS is measured independently.
+'''
+
+
+def run_mode(args):
+    torch.manual_seed(args.seed)
+    step = common.make_train_step(args.batch_size, amp=args.mode == 'amp')
+    times, info_disc, info_cont = [], [], []
+    for i in range(args.num_steps):
+        start = time.perf_counter()
+        _, loss_c_disc, loss_c_cont = step()
+        times.append(time.perf_counter() - start)
+        info_disc.append(loss_c_disc.item())
+        info_cont.append(loss_c_cont.sum().item())
+    tail = max(1, args.num_steps // 5)
+    result = {'mode': args.mode,
+              'step_ms': float(np.median(times[2:]) * 1e3),
+              # ru_maxrss is in kilobytes on Linux
+              'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+              'loss_c_disc_final': float(np.mean(info_disc[-tail:])),
+              'loss_c_cont_final': float(np.mean(info_cont[-tail:]))}
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--num_steps', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mode', type=str, default=None, choices=['fp32', 'amp'])
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        run_mode(args)
+        return
+
+    results = {}
+    for mode in ['fp32', 'amp']:
+        out = subprocess.run(
+            [sys.executable, __file__, '--mode', mode,
+             '--batch_size', str(args.batch_size),
+             '--num_steps', str(args.num_steps), '--seed', str(args.seed)],
+            check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        results[mode] = json.loads(out.strip().splitlines()[-1])
+        print(results[mode])
+
+    fp32, amp = results['fp32'], results['amp']
+    print(f"step time: {fp32['step_ms']:.2f} ms -> {amp['step_ms']:.2f} ms "
+          f"({amp['step_ms'] / fp32['step_ms'] - 1:+.1%})")
+    print(f"peak RSS:  {fp32['peak_rss_mb']:.1f} MB -> {amp['peak_rss_mb']:.1f} MB "
+          f"({amp['peak_rss_mb'] - fp32['peak_rss_mb']:+.1f} MB)")
+    for key in ['loss_c_disc_final', 'loss_c_cont_final']:
+        print(f"{key}: fp32 {fp32[key]:.4f} | amp {amp[key]:.4f} "
+              f"| abs diff {abs(fp32[key] - amp[key]):.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import argparse
+import common
+import torch
+
+'''
+Step-time benchmark: training step with and without autograd anomaly detection
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    step = common.make_train_step(args.batch_size)
+    results = {}
+    for mode in [False, True]:
+        torch.autograd.set_detect_anomaly(mode)
+        results[mode] = common.time_fn(step, warmup=3, repeat=args.repeat)
+        common.print_row(f'train step, detect_anomaly={mode}', results[mode])
+    torch.autograd.set_detect_anomaly(False)
+    print(f"anomaly overhead: {results[True]['mean_ms'] / results[False]['mean_ms']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
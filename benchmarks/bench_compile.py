@@ -0,0 +1,33 @@
+import argparse
+import time
+import common
+
+'''
+Warm-step throughput of the training step: eager vs compiled G / D
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_sizes', type=str, default='64,128,256,512,1024')
+    parser.add_argument('--backend', type=str, default='compile',
+                        choices=['script', 'compile'])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+        results = {}
+        for backend in ['eager', args.backend]:
+            start = time.time()
+            step = common.make_train_step(batch_size, backend=backend)
+            setup = time.time() - start
+            stats = common.time_fn(step, warmup=2, repeat=args.repeat)
+            results[backend] = batch_size / stats['median_ms'] * 1e3
+            print(f'batch_size={batch_size:<5} {backend:<8} '
+                  f'{results[backend]:10.1f} samples/s '
+                  f'(median step {stats["median_ms"]:.2f} ms, setup+compile {setup:.1f}s)')
+        print(f"speedup: {results[args.backend] / results['eager']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
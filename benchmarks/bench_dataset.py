@@ -0,0 +1,47 @@
+import argparse
+import time
+import common
+import torch
+from config import get_root, parser as config_parser
+from data_loader import get_loader
+
+'''
+Throughput (batches/sec) of the torchvision MNIST path vs the memory-mapped tensor path
+'''
+
+
+def batches_per_sec(loader, num_batches):
+    start = time.perf_counter()
+    n = 0
+    for data, _ in loader:
+        n += 1
+        if n == num_batches:
+            break
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', type=str, default=get_root())
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--num_batches', type=int, default=200)
+    parser.add_argument('--num_worker', type=int, default=0)
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    results = {}
+    for data_mode in ['torchvision', 'tensor']:
+        config = config_parser.parse_args([
+            '--project_root', args.root, '--batch_size', str(args.batch_size),
+            '--num_worker', str(args.num_worker), '--data_mode', data_mode])
+        loader = get_loader(config, device=device)
+        # First pass builds the .npy cache / spins up workers
+        batches_per_sec(loader, 1)
+        results[data_mode] = batches_per_sec(loader, args.num_batches)
+        print(f'{data_mode:<12} {results[data_mode]:10.1f} batches/s '
+              f'(batch_size={args.batch_size}, num_worker={args.num_worker})')
+    print(f"speedup: {results['tensor'] / results['torchvision']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import copy
+import common
+import torch
+
+'''
+D update: previous three-call path vs heads='D' vs fused real/fake forward
+'''
+
+
+def d_update(D, data_real, data_fake, mode):
+    adversarial_loss = torch.nn.BCELoss()
+    B = data_real.size(0)
+    label_real = torch.full((B,), 1.0)
+    label_fake = torch.full((B,), 0.0)
+    if mode == 'previous':
+        prob_real, _, _, _ = D(data_real)
+        loss_D_real = adversarial_loss(prob_real, label_real)
+        loss_D_real.backward()
+        prob_fake_D, _, _, _ = D(data_fake)
+        loss_D_fake = adversarial_loss(prob_fake_D, label_fake)
+        loss_D_fake.backward()
+    elif mode == 'heads_D':
+        prob_real, _, _, _ = D(data_real, heads='D')
+        prob_fake_D, _, _, _ = D(data_fake, heads='D')
+        loss_D_real = adversarial_loss(prob_real, label_real)
+        loss_D_fake = adversarial_loss(prob_fake_D, label_fake)
+        (loss_D_real + loss_D_fake).backward()
+    else:
+        prob_D, _, _, _ = D(torch.cat((data_real, data_fake)), heads='D', num_splits=2)
+        loss_D_real = adversarial_loss(prob_D[:B], label_real)
+        loss_D_fake = adversarial_loss(prob_D[B:], label_fake)
+        (loss_D_real + loss_D_fake).backward()
+    return (loss_D_real + loss_D_fake).detach()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    _, D = common.build_models()
+    data_real = torch.rand(args.batch_size, 1, 28, 28)
+    data_fake = torch.rand(args.batch_size, 1, 28, 28)
+
+    reference = None
+    for mode in ['previous', 'heads_D', 'fused']:
+        model = copy.deepcopy(D)
+        loss = d_update(model, data_real, data_fake, mode)
+        grad = torch.cat([p.grad.flatten() for p in model.module_shared.parameters()])
+        if reference is None:
+            reference = (loss, grad)
+        stats = common.time_fn(
+            lambda: d_update(model, data_real, data_fake, mode),
+            warmup=3, repeat=args.repeat)
+        common.print_row(f'D update ({mode})', stats)
+        print(f'  |loss_D - previous| = {(loss - reference[0]).abs().item():.2e}, '
+              f'max |grad - previous| = {(grad - reference[1]).abs().max().item():.2e}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import argparse
+import common
+import torch
+from ema import ModelEMA
+
+'''
+EMA of G: per-tensor update loop over the state dict vs ModelEMA (one fused _foreach_lerp_),
+every step and every 4 steps, against the time of a full training step
+'''
+
+
+def state_dict_update(ema_model, model, decay):
+    # Straightforward version: one mul_ / add_ pair per parameter and buffer
+    with torch.no_grad():
+        model_state = model.state_dict()
+        for name, value in ema_model.state_dict().items():
+            if value.is_floating_point():
+                value.mul_(decay).add_(model_state[name], alpha=1 - decay)
+            else:
+                value.copy_(model_state[name])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--gpu_id', type=int, default=-1)
+    args = parser.parse_args()
+    device = f'cuda:{args.gpu_id}' if args.gpu_id >= 0 and torch.cuda.is_available() else 'cpu'
+
+    step = common.make_train_step(args.batch_size, device=device)
+    step_stats = common.time_fn(step, warmup=3, repeat=20)
+    common.print_row(f'train step B{args.batch_size}', step_stats)
+
+    G, _ = common.build_models(device=device)
+    print(f'G: {sum(p.numel() for p in G.parameters())} parameters in '
+          f'{len(list(G.parameters()))} tensors, fused lerp: {hasattr(torch, "_foreach_lerp_")}')
+    ema_model = ModelEMA(G).model
+    cases = [('state_dict loop', lambda: state_dict_update(ema_model, G, 0.999))]
+    for update_every in [1, 4]:
+        ema = ModelEMA(G, 0.999, update_every)
+        counter = iter(range(1 << 30))
+        cases.append((f'ModelEMA update_every={update_every}',
+                      lambda ema=ema, counter=counter: ema.update(next(counter))))
+    for name, fn in cases:
+        stats = common.time_fn(fn, repeat=args.repeat)
+        common.print_row(name, stats)
+        print(f'{"":<40} {100 * stats["mean_ms"] / step_stats["mean_ms"]:.2f}% of a train step')
+
+
+if __name__ == "__main__":
+    main()
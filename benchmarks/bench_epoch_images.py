@@ -0,0 +1,53 @@
+import argparse
+import tempfile
+import time
+import common
+import torch
+from latent import LatentSampler
+from utils import ImageRenderer
+from plotting import plot_generated_data
+
+'''
+Epoch-end fixed-noise rendering: per-key G calls + matplotlib vs one batched G call + save_image
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n_c_disc', type=int, default=1)
+    parser.add_argument('--dim_c_disc', type=int, default=10)
+    parser.add_argument('--dim_c_cont', type=int, default=2)
+    args = parser.parse_args()
+
+    G, _ = common.build_models(62, args.n_c_disc, args.dim_c_disc, args.dim_c_cont)
+    sampler = LatentSampler(62, args.n_c_disc, args.dim_c_disc, args.dim_c_cont)
+    keys = [(d, c) for d in range(args.n_c_disc) for c in range(args.dim_c_cont)]
+    fixed_z_dict = {key: sampler.sample(args.dim_c_disc * 10)[0] for key in keys}
+    fixed_z_all = torch.cat([fixed_z_dict[key] for key in keys])
+
+    config = argparse.Namespace(project_root=tempfile.mkdtemp(),
+                                model_name='bench', render_backend='save_image',
+                                render_worker=2)
+
+    start = time.perf_counter()
+    for key in keys:
+        plot_generated_data(config, G, fixed_z_dict[key], 0, key[0], key[1])
+    previous = time.perf_counter() - start
+
+    for backend in ['save_image', 'matplotlib']:
+        config.render_backend = backend
+        renderer = ImageRenderer(config)
+        start = time.perf_counter()
+        with torch.no_grad():
+            gen_data = G(fixed_z_all).cpu()
+        for key, imgs in zip(keys, gen_data.split(len(gen_data) // len(keys))):
+            renderer.render(imgs, 0, key[0], key[1])
+        stall = time.perf_counter() - start
+        renderer.close()
+        print(f'batched G + {backend:<10} training stall: {stall * 1e3:9.1f} ms')
+    print(f'per-key G + matplotlib   training stall: {previous * 1e3:9.1f} ms '
+          f'({len(keys)} keys)')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import common
+import torch
+import numpy as np
+from latent import LatentSampler
+from utils import NLL_gaussian, InfoLoss
+
+'''
+Info loss: previous Softmax head + per-code CrossEntropy loop + NLL_gaussian on exp(logvar)
+vs InfoLoss on logits / log-variance
+'''
+
+
+def previous_loss(logits, idx, c_cont, mu, logvar):
+    # latent_disc ended with Softmax, CrossEntropyLoss applied a second softmax
+    probs = torch.softmax(logits, dim=2)
+    categorical_loss = torch.nn.CrossEntropyLoss()
+    loss_c_disc = 0
+    for j in range(logits.size(1)):
+        loss_c_disc += categorical_loss(probs[:, j, :], idx[j, :])
+    loss_c_cont = NLL_gaussian()(c_cont, mu, torch.exp(logvar)).mean(0)
+    return loss_c_disc, loss_c_cont
+
+
+def fused_loss(logits, idx, c_cont, mu, logvar):
+    loss_c_disc, loss_c_cont = InfoLoss()(logits, idx, c_cont, mu, logvar)
+    return loss_c_disc.sum(), loss_c_cont
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--dim_c_cont', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    for n_c_disc, dim_c_disc in [(1, 10), (10, 10), (10, 50)]:
+        print(f'--- n_c_disc={n_c_disc}, dim_c_disc={dim_c_disc}, batch_size={args.batch_size}')
+        torch.manual_seed(0)
+        latent = LatentSampler(62, n_c_disc, dim_c_disc, args.dim_c_cont)
+        z, idx = latent.sample(args.batch_size)
+        c_cont = latent.c_cont(z)
+        # Confident, correct logits: the regime where the double softmax stalls
+        logits = torch.randn(args.batch_size, n_c_disc, dim_c_disc)
+        logits.scatter_(2, idx.t().unsqueeze(2), 8.0)
+        logits.requires_grad_()
+        mu = torch.rand(args.batch_size, args.dim_c_cont, requires_grad=True)
+        logvar = torch.randn(args.batch_size, args.dim_c_cont, requires_grad=True)
+
+        for name, fn in [('previous', previous_loss), ('InfoLoss', fused_loss)]:
+            def step():
+                logits.grad = mu.grad = logvar.grad = None
+                loss_c_disc, loss_c_cont = fn(logits, idx, c_cont, mu, logvar)
+                (loss_c_disc + loss_c_cont.sum()).backward()
+                return loss_c_disc, loss_c_cont
+            stats = common.time_fn(step, repeat=args.repeat)
+            loss_c_disc, loss_c_cont = step()
+            common.print_row(f'{name} forward+backward', stats)
+            # Lowest value reachable: 0 for cross entropy on logits, one-hot
+            # probabilities through a second softmax give log(e + dim - 1) - 1 per code
+            floor = n_c_disc * (np.log(np.e + dim_c_disc - 1) - 1) if name == 'previous' else 0
+            print(f'  loss_c_disc {loss_c_disc.item():.4f} (floor {floor:.4f}), '
+                  f'|grad logits| {logits.grad.norm().item():.2e}, '
+                  f'loss_c_cont {loss_c_cont.sum().item():.4f}')
+
+
+if __name__ == "__main__":
+    main()
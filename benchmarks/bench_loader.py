@@ -0,0 +1,57 @@
+import argparse
+import time
+import common
+import numpy as np
+import torch
+from config import get_root, parser as config_parser
+from data_loader import get_loader, DevicePrefetcher
+
+'''
+Data-wait time per step for the MNIST loader at several worker counts
+'''
+
+
+def measure_wait(loader, num_steps, compute_ms):
+    waits = []
+    iterator = iter(loader)
+    for _ in range(num_steps):
+        start = time.perf_counter()
+        try:
+            next(iterator)
+        except StopIteration:
+            break
+        waits.append(time.perf_counter() - start)
+        # Stand-in for the training step running on the batch
+        time.sleep(compute_ms / 1e3)
+    if hasattr(iterator, 'close'):
+        iterator.close()
+    waits = np.array(waits[1:]) * 1e3
+    return waits.mean(), np.percentile(waits, 90)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', type=str, default=get_root())
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--num_steps', type=int, default=100)
+    parser.add_argument('--compute_ms', type=float, default=5.0,
+                        help="Simulated training step time")
+    parser.add_argument('--workers', type=str, default='0,2,4,8')
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    for num_workers in [int(w) for w in args.workers.split(',')]:
+        config = config_parser.parse_args([
+            '--project_root', args.root, '--batch_size', str(args.batch_size),
+            '--num_worker', str(num_workers), '--pin_memory', 'True',
+            '--persistent_workers', 'True'])
+        loader = get_loader(config, device=device)
+        for prefetch in [False, True]:
+            source = DevicePrefetcher(loader, device) if prefetch else loader
+            mean, p90 = measure_wait(source, args.num_steps, args.compute_ms)
+            print(f'num_worker={num_workers} device_prefetch={prefetch!s:<5} '
+                  f'data wait/step: mean {mean:8.3f} ms | p90 {p90:8.3f} ms')
+
+
+if __name__ == "__main__":
+    main()
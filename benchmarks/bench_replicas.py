@@ -0,0 +1,91 @@
+import argparse
+import common
+import torch
+
+'''
+Training throughput of K models: K sequential steps vs one vmapped step (--num_replica K)
+'''
+
+
+def make_replica_step(num_replica, batch_size=128, dim_z=62, n_c_disc=1,
+                      dim_c_disc=10, dim_c_cont=2):
+    '''
+    Same step as common.make_train_step for num_replica stacked models
+    '''
+    from utils import InfoLoss
+    from latent import LatentSampler
+    from engine import stack_models
+    Gs, Ds = zip(*[common.build_models(dim_z, n_c_disc, dim_c_disc, dim_c_cont)
+                   for _ in range(num_replica)])
+    params_G, buffers_G, G_call = stack_models(list(Gs))
+    params_D, buffers_D, D_call = stack_models(list(Ds))
+    Q_heads = ('module_Q.', 'latent_disc.', 'latent_cont_mu.')
+    optim_G = torch.optim.Adam(
+        list(params_G.values()) + [p for n, p in params_D.items() if n.startswith(Q_heads)],
+        lr=0.001, betas=(0.5, 0.999))
+    optim_D = torch.optim.Adam(
+        [p for n, p in params_D.items() if n.startswith(('module_shared.', 'module_D.'))],
+        lr=0.0002, betas=(0.5, 0.999))
+    sampler = LatentSampler(dim_z, n_c_disc, dim_c_disc, dim_c_cont, 'cpu')
+    adversarial_loss = torch.nn.BCELoss()
+    info_loss = InfoLoss()
+    data_real = torch.rand(batch_size, 1, 28, 28)
+
+    def loss_D_fn(params, buffers, data_real, data_fake):
+        prob_real = D_call(params, buffers, data_real, heads='D')[0]
+        prob_fake = D_call(params, buffers, data_fake, heads='D')[0]
+        return adversarial_loss(prob_real, torch.ones_like(prob_real)) + \
+            adversarial_loss(prob_fake, torch.zeros_like(prob_fake))
+
+    def loss_info_fn(params, buffers, data_fake, z, idx):
+        prob_fake, disc_logits, mu, logvar = D_call(params, buffers, data_fake)
+        loss_G = adversarial_loss(prob_fake, torch.ones_like(prob_fake))
+        loss_c_disc, loss_c_cont = info_loss(
+            disc_logits, idx, sampler.c_cont(z), mu, logvar)
+        return loss_G + loss_c_disc.sum() + 0.1 * loss_c_cont.sum()
+
+    G_exec = torch.func.vmap(G_call)
+    loss_D_exec = torch.func.vmap(loss_D_fn, in_dims=(0, 0, None, 0))
+    loss_info_exec = torch.func.vmap(loss_info_fn)
+
+    def step():
+        z, idx = sampler.sample(num_replica * batch_size)
+        z = z.view(num_replica, batch_size, -1)
+        idx = idx.view(n_c_disc, num_replica, batch_size).transpose(0, 1)
+        optim_D.zero_grad()
+        data_fake = G_exec(params_G, buffers_G, z)
+        loss_D_exec(params_D, buffers_D, data_real, data_fake.detach()).sum().backward()
+        optim_D.step()
+        optim_G.zero_grad()
+        loss_info_exec(params_D, buffers_D, data_fake, z, idx).sum().backward()
+        optim_G.step()
+
+    return step
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--replicas', type=str, default='1,2,4,8')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f'torch {torch.__version__}, {torch.get_num_threads()} threads, '
+          f'batch size {args.batch_size} per model')
+    for K in [int(k) for k in args.replicas.split(',')]:
+        steps = [common.make_train_step(args.batch_size) for _ in range(K)]
+
+        def sequential():
+            for step in steps:
+                step()
+        stats_seq = common.time_fn(sequential, warmup=2, repeat=args.repeat)
+        stats_vmap = common.time_fn(make_replica_step(K, args.batch_size),
+                                    warmup=2, repeat=args.repeat)
+        common.print_row(f'K={K} sequential', stats_seq)
+        common.print_row(f'K={K} vmap', stats_vmap)
+        print(f"{'':<40} models/sec: sequential "
+              f"{K * 1e3 / stats_seq['median_ms']:.2f}, vmap {K * 1e3 / stats_vmap['median_ms']:.2f}")
+
+
+if __name__ == '__main__':
+    main()
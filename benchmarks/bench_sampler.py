@@ -0,0 +1,53 @@
+import argparse
+import common
+import numpy as np
+import torch
+from latent import LatentSampler
+
+'''
+Micro-benchmark: LatentSampler vs the previous Trainer._sample implementation
+'''
+
+
+def legacy_sample(batch_size, dim_z, n_c_disc, dim_c_disc, dim_c_cont, device):
+    # Previous Trainer._sample + torch.LongTensor(idx).to(device) in the loop
+    z = torch.randn(batch_size, dim_z, device=device)
+    idx = np.zeros((n_c_disc, batch_size))
+    c_disc = torch.zeros(batch_size, n_c_disc, dim_c_disc, device=device)
+    for i in range(n_c_disc):
+        idx[i] = np.random.randint(dim_c_disc, size=batch_size)
+        c_disc[torch.arange(0, batch_size), i, idx[i]] = 1.0
+    c_cond = torch.rand(batch_size, dim_c_cont, device=device) * 2 - 1
+    for i in range(n_c_disc):
+        z = torch.cat((z, c_disc[:, i, :].squeeze()), dim=1)
+    z = torch.cat((z, c_cond), dim=1)
+    target = torch.LongTensor(idx).to(device)
+    return z, target
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--dim_z', type=int, default=62)
+    parser.add_argument('--dim_c_cont', type=int, default=2)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    for n_c_disc, dim_c_disc in [(1, 10), (4, 10), (10, 10), (10, 50)]:
+        print(f'--- n_c_disc={n_c_disc}, dim_c_disc={dim_c_disc}, '
+              f'batch_size={args.batch_size}')
+        sampler = LatentSampler(args.dim_z, n_c_disc, dim_c_disc,
+                                args.dim_c_cont, args.device)
+        legacy = common.time_fn(lambda: legacy_sample(
+            args.batch_size, args.dim_z, n_c_disc, dim_c_disc,
+            args.dim_c_cont, args.device), repeat=args.repeat)
+        vectorized = common.time_fn(
+            lambda: sampler.sample(args.batch_size), repeat=args.repeat)
+        common.print_row('legacy _sample', legacy)
+        common.print_row('LatentSampler.sample', vectorized)
+        print(f"speedup: {legacy['mean_ms'] / vectorized['mean_ms']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
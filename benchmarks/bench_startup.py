@@ -0,0 +1,81 @@
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+import common
+import numpy as np
+
+'''
+Startup cost: import time of the training modules in a fresh interpreter, and which
+optional heavy modules each import pulls in. With --root (MNIST already under
+<root>/data/mnist) also the time to first step of main.py, as printed by the trainer.
+'''
+
+HEAVY = ['torchvision', 'matplotlib', 'visdom']
+
+IMPORT_CODE = '''
+import sys, time, json
+sys.path.insert(0, {src!r})
+import torch
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds': time.perf_counter() - start,
+                  'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def time_import(module, repeat):
+    # torch is imported first, it is paid by every entry point alike
+    code = IMPORT_CODE.format(src=common.SRC_DIR, module=module, heavy=HEAVY)
+    times = []
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', code]).decode()
+        result = json.loads(out.strip().splitlines()[-1])
+        times.append(result['seconds'])
+    return float(np.median(times)) * 1e3, result['loaded']
+
+
+def time_to_first_step(root, extra_args):
+    '''
+    Runs main.py until the trainer prints the time to first step, then stops it
+    '''
+    cmd = [sys.executable, os.path.join(common.SRC_DIR, 'main.py'),
+           '--project_root', root, '--download', 'False', '--use_visdom', 'False',
+           '--model_name', 'bench_startup', '--num_epoch', '1'] + extra_args
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            cwd=common.SRC_DIR)
+    seconds = None
+    try:
+        for line in proc.stdout:
+            match = re.search(r'Time to first step: ([0-9.]+)s', line.decode())
+            if match:
+                seconds = float(match.group(1))
+                break
+    finally:
+        proc.kill()
+        proc.wait()
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', type=str, default='utils,data_loader,trainer,main')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--root', type=str, default='',
+                        help="project_root with MNIST in data/mnist, enables time to first step")
+    args, extra_args = parser.parse_known_args()
+
+    print(f"{'import (after torch)':<40} {'median_ms':>10}  heavy modules loaded")
+    for module in args.modules.split(','):
+        ms, loaded = time_import(module, args.repeat)
+        print(f"{module:<40} {ms:>10.1f}  {', '.join(loaded) or '-'}")
+    if args.root:
+        seconds = time_to_first_step(args.root, extra_args)
+        print(f"{'time to first step':<40} "
+              f"{seconds * 1e3 if seconds is not None else float('nan'):>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
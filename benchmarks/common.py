@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+import numpy as np
+
+'''
+Shared helpers for benchmark scripts
+'''
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+
+def time_fn(fn, warmup=10, repeat=100):
+    '''
+    Time fn() `repeat` times after `warmup` calls, returns stats in milliseconds
+    '''
+    for _ in range(warmup):
+        fn()
+    times = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times[i] = time.perf_counter() - start
+    times *= 1e3
+    return {'mean_ms': float(times.mean()),
+            'median_ms': float(np.median(times)),
+            'p90_ms': float(np.percentile(times, 90)),
+            'min_ms': float(times.min())}
+
+
+def print_row(name, stats):
+    print(f"{name:<40} mean {stats['mean_ms']:9.4f} ms | "
+          f"median {stats['median_ms']:9.4f} ms | p90 {stats['p90_ms']:9.4f} ms")
+
+
+def build_models(dim_z=62, n_c_disc=1, dim_c_disc=10, dim_c_cont=2,
+                 device='cpu'):
+    import torch
+    from utils import weights_init_normal
+    from models.mnist.discriminator import Discriminator
+    from models.mnist.generator import Generator
+    torch.manual_seed(0)
+    G = Generator(dim_z, n_c_disc, dim_c_disc, dim_c_cont).to(device)
+    D = Discriminator(n_c_disc, dim_c_disc, dim_c_cont).to(device)
+    G.apply(weights_init_normal)
+    D.apply(weights_init_normal)
+    return G, D
+
+
+def make_train_step(batch_size=128, dim_z=62, n_c_disc=1, dim_c_disc=10,
+                    dim_c_cont=2, device='cpu', amp=False, backend='eager'):
+    '''
+    One InfoGAN step (D update, G/Q update) on synthetic data, same losses as Trainer.train.
+    The step returns the detached (loss_info, loss_c_disc, loss_c_cont) tensors.
+    '''
+    import torch
+    from utils import InfoLoss, autocast
+    from latent import LatentSampler
+    from engine import compile_module
+    G, D = build_models(dim_z, n_c_disc, dim_c_disc, dim_c_cont, device)
+    sampler = LatentSampler(dim_z, n_c_disc, dim_c_disc, dim_c_cont, device)
+    if backend != 'eager':
+        z, _ = sampler.sample(batch_size)
+        x = torch.rand(batch_size, 1, 28, 28, device=device)
+        with autocast(torch.device(device), amp):
+            G_exec, _, _ = compile_module(G, backend, [((z,), {})])
+            D_exec, _, _ = compile_module(
+                D, backend, [((x,), {'heads': 'D'}), ((x,), {})])
+    else:
+        G_exec, D_exec = G, D
+    optim_G = torch.optim.Adam(
+        list(G.parameters()) + list(D.module_Q.parameters()) +
+        list(D.latent_disc.parameters()) + list(D.latent_cont_mu.parameters()),
+        lr=0.001, betas=(0.5, 0.999))
+    optim_D = torch.optim.Adam(
+        list(D.module_shared.parameters()) + list(D.module_D.parameters()),
+        lr=0.0002, betas=(0.5, 0.999))
+    adversarial_loss = torch.nn.BCELoss()
+    info_loss = InfoLoss()
+    device = torch.device(device)
+    data_real = torch.rand(batch_size, 1, 28, 28, device=device)
+    label_real = torch.full((batch_size,), 1.0, device=device)
+    label_fake = torch.full((batch_size,), 0.0, device=device)
+
+    def step():
+        optim_D.zero_grad()
+        z, idx = sampler.sample(batch_size)
+        with autocast(device, amp):
+            data_fake = G_exec(z)
+            prob_real = D_exec(data_real, heads='D')[0]
+            prob_fake_D = D_exec(data_fake.detach(), heads='D')[0]
+        loss_D = adversarial_loss(prob_real, label_real) + \
+            adversarial_loss(prob_fake_D, label_fake)
+        loss_D.backward()
+        optim_D.step()
+
+        optim_G.zero_grad()
+        with autocast(device, amp):
+            prob_fake, disc_logits, mu, logvar = D_exec(data_fake)
+        loss_G = adversarial_loss(prob_fake, label_real)
+        loss_c_disc, loss_c_cont = info_loss(
+            disc_logits, idx, sampler.c_cont(z), mu, logvar)
+        loss_c_disc = loss_c_disc.sum()
+        loss_info = loss_G + loss_c_disc + 0.1 * loss_c_cont.sum()
+        loss_info.backward()
+        optim_G.step()
+        return loss_info.detach(), loss_c_disc.detach(), loss_c_cont.detach()
+
+    return step
\ No newline at end of file
@@ -0,0 +1,254 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import common
+import numpy as np
+import torch
+
+'''
+Benchmark suite for the training / inference hot paths, synthetic data only (no MNIST download)
+
+    python benchmarks/suite.py --out baseline.json
+    python benchmarks/suite.py --compare baseline.json --threshold 0.1
+
+Every case reports time_fn statistics in milliseconds, compare mode flags cases whose
+median got slower than the baseline by more than the threshold (exit code 1).
+The bench_*.py scripts stay as A/B experiments of individual changes,
+their workloads are tracked here through the same common helpers.
+'''
+
+BATCH_SIZES = [32, 128, 512]
+
+# name -> (setup(args) returning a zero-argument callable, runs by default)
+CASES = {}
+
+
+def case(name, default=True):
+    def register(setup):
+        CASES[name] = (setup, default)
+        return setup
+    return register
+
+
+def _forward_backward(module, inputs):
+    def run():
+        module.zero_grad()
+        outputs = module(inputs)
+        if torch.is_tensor(outputs):
+            outputs = (outputs,)
+        sum(o.sum() for o in outputs if torch.is_tensor(o)).backward()
+    return run
+
+
+def _register_batch_cases():
+    for batch_size in BATCH_SIZES:
+        @case(f'sampler/B{batch_size}')
+        def sampler(args, batch_size=batch_size):
+            from latent import LatentSampler
+            latent = LatentSampler(62, 1, 10, 2, args.device)
+            return lambda: latent.sample(batch_size)
+
+        @case(f'generator_fwd_bwd/B{batch_size}')
+        def generator(args, batch_size=batch_size):
+            G, _ = common.build_models(device=args.device)
+            z = torch.randn(batch_size, G.dim_latent, device=args.device)
+            return _forward_backward(G, z)
+
+        @case(f'discriminator_fwd_bwd/B{batch_size}')
+        def discriminator(args, batch_size=batch_size):
+            _, D = common.build_models(device=args.device)
+            x = torch.rand(batch_size, 1, 28, 28, device=args.device)
+            return _forward_backward(D, x)
+
+        @case(f'info_loss/B{batch_size}')
+        def info_loss(args, batch_size=batch_size):
+            from latent import LatentSampler
+            from utils import InfoLoss
+            latent = LatentSampler(62, 1, 10, 2, args.device)
+            z, idx = latent.sample(batch_size)
+            logits = torch.randn(batch_size, 1, 10, device=args.device, requires_grad=True)
+            mu = torch.rand(batch_size, 2, device=args.device, requires_grad=True)
+            logvar = torch.randn(batch_size, 2, device=args.device, requires_grad=True)
+            loss = InfoLoss()
+
+            def run():
+                loss_c_disc, loss_c_cont = loss(logits, idx, latent.c_cont(z), mu, logvar)
+                (loss_c_disc.sum() + loss_c_cont.sum()).backward()
+            return run
+
+
+_register_batch_cases()
+
+
+@case('train_step/B128')
+def train_step(args):
+    return common.make_train_step(128, device=args.device)
+
+
+@case('ema_update')
+def ema_update(args):
+    from ema import ModelEMA
+    G, _ = common.build_models(device=args.device)
+    ema = ModelEMA(G)
+    return lambda: ema.update(0)
+
+
+@case('train_step_replicas/K2_B128', default=False)
+def train_step_replicas(args):
+    from bench_replicas import make_replica_step
+    return make_replica_step(2, 128)
+
+
+@case('loader_tensor/B128')
+def loader_tensor(args):
+    from data_loader import TensorBatchLoader
+    rng = np.random.RandomState(0)
+    images = rng.randint(0, 256, (60000, 28, 28)).astype(np.uint8)
+    labels = rng.randint(0, 10, 60000).astype(np.uint8)
+    loader = TensorBatchLoader(images, labels, 128, args.device)
+    batches = iter(())
+
+    def run():
+        # One batch per call, a new epoch starts when the previous one is exhausted
+        nonlocal batches
+        try:
+            next(batches)
+        except StopIteration:
+            batches = iter(loader)
+            next(batches)
+    return run
+
+
+@case('epoch_images')
+def epoch_images(args):
+    import torchvision.utils as vutils
+    from latent import LatentSampler
+    G, _ = common.build_models(device=args.device)
+    latent = LatentSampler(62, 1, 10, 2, args.device)
+    # Same grid as Trainer: dim_c_disc * 10 images per (c_disc, c_cont) key
+    fixed_z_all = latent.sample(2 * 100)[0]
+    out_dir = tempfile.mkdtemp()
+
+    def run():
+        with torch.no_grad():
+            gen_data = G(fixed_z_all).cpu()
+        for k, imgs in enumerate(gen_data.split(100)):
+            vutils.save_image(imgs, os.path.join(out_dir, f'{k}.png'),
+                              nrow=10, padding=2, normalize=True)
+    return run
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=common.SRC_DIR,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        commit = None
+    return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git_commit': commit,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'torch': torch.__version__,
+            'torch_threads': torch.get_num_threads(),
+            'numpy': np.__version__,
+            'cuda': torch.cuda.get_device_name(0) if torch.cuda.is_available() else None}
+
+
+def run_suite(args):
+    results = {}
+    for name, (setup, default) in CASES.items():
+        if args.filter:
+            if not re.search(args.filter, name):
+                continue
+        elif not default:
+            continue
+        torch.manual_seed(0)
+        np.random.seed(0)
+        fn = setup(args)
+        stats = common.time_fn(fn, warmup=args.warmup, repeat=args.repeat)
+        results[name] = stats
+        common.print_row(name, stats)
+    return results
+
+
+def compare(results, baseline, threshold):
+    '''
+    Returns the names of cases whose median is slower than baseline by more than threshold
+    '''
+    regressions = []
+    print('==========')
+    print(f"{'case':<40} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, stats in results.items():
+        if name not in baseline['results']:
+            print(f"{name:<40} {'-':>10} {stats['median_ms']:>10.3f}      new")
+            continue
+        base = baseline['results'][name]['median_ms']
+        change = stats['median_ms'] / base - 1
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:<40} {base:>10.3f} {stats['median_ms']:>10.3f} {change * 100:>7.1f}%{flag}")
+    current = environment()
+    keys = [k for k in ['platform', 'cpu_count', 'torch', 'torch_threads', 'cuda']
+            if baseline['environment'].get(k) != current.get(k)]
+    if keys:
+        print(f"Environment differs from the baseline ({', '.join(keys)}), "
+              f"timings may not be comparable")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--filter', type=str, default='',
+                        help="Regex on case names, also selects cases that don't run by default")
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=0,
+                        help="torch intra-op threads (0: torch default)")
+    parser.add_argument('--out', type=str, default='',
+                        help="Write results and environment metadata as JSON")
+    parser.add_argument('--compare', type=str, default='',
+                        help="Baseline JSON written by --out")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="Relative median slowdown reported as a regression")
+    parser.add_argument('--list', action='store_true')
+    args = parser.parse_args()
+
+    if args.list:
+        for name, (_, default) in CASES.items():
+            print(name + ('' if default else '  (--filter only)'))
+        return 0
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    print(json.dumps(environment()))
+    results = run_suite(args)
+    report = {'environment': environment(), 'results': results}
+    if args.out:
+        with open(args.out, 'w') as fp:
+            json.dump(report, fp, indent=4)
+        print(f'Results written to {args.out}')
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regression(s) above {args.threshold * 100:.0f}%: '
+                  f"{', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import os
+import re
+import glob
+import queue
+import random
+import threading
+import numpy as np
+import torch
+
+'''
+Resumable Checkpoints
+'''
+
+
+def to_cpu(obj):
+    '''
+    Recursively copy tensors in nested dicts / lists to CPU.
+    CPU tensors are cloned so that later in-place updates don't leak into the snapshot.
+    '''
+    if torch.is_tensor(obj):
+        obj = obj.detach()
+        return obj.clone() if obj.device.type == 'cpu' else obj.cpu()
+    if isinstance(obj, dict):
+        return {k: to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(v) for v in obj)
+    return obj
+
+
+def get_rng_state():
+    state = {'torch': torch.get_rng_state(),
+             'numpy': np.random.get_state(),
+             'python': random.getstate()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['python'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def load_checkpoint(path, map_location='cpu'):
+    try:
+        # Checkpoints hold the argparse config and RNG states, not only tensors
+        return torch.load(path, map_location=map_location, weights_only=False)
+    except TypeError:
+        # torch<1.13 has no weights_only argument
+        return torch.load(path, map_location=map_location)
+
+
+def generator_state(checkpoint, use_ema=True):
+    '''
+    G weights of a checkpoint: the moving average when it was trained with --ema (unless
+    use_ema is False), the raw weights otherwise
+    '''
+    if use_ema and checkpoint.get('Generator_EMA') is not None:
+        return checkpoint['Generator_EMA']['model']
+    return checkpoint['Generator']
+
+
+# Config fields the saved models and data depend on, a resumed run takes them from the checkpoint
+RUN_CONFIG = ['dim_z', 'n_c_disc', 'dim_c_disc', 'dim_c_cont', 'model_variant',
+              'dataset', 'data_path', 'data_dim', 'data_channel', 'synthetic_size', 'data_shape',
+              'num_replica']
+
+
+def restore_run_config(config, saved):
+    '''
+    Overwrites the RUN_CONFIG fields of config with those of the saved config.
+    Returns [(name, given value, saved value)] of the fields that were different
+    '''
+    changed = []
+    for name in RUN_CONFIG:
+        if not hasattr(saved, name):
+            # Field added after the checkpoint was written, its default applies
+            continue
+        value = getattr(saved, name)
+        if name != 'data_shape' and getattr(config, name, None) != value:
+            changed.append((name, getattr(config, name, None), value))
+        setattr(config, name, value)
+    return changed
+
+
+def find_checkpoint(path):
+    '''
+    Returns path itself for a file, or the latest Epoch_N.pth for a checkpoint directory
+    '''
+    if os.path.isfile(path):
+        return path
+    checkpoints = list_checkpoints(path)
+    if len(checkpoints) == 0:
+        raise FileNotFoundError(f'No Epoch_N.pth checkpoint in {path}')
+    return checkpoints[-1]
+
+
+def list_checkpoints(save_dir):
+    # Sorted by epoch number
+    paths = glob.glob(os.path.join(save_dir, 'Epoch_*.pth'))
+    return sorted(paths, key=lambda p: int(re.findall(r'Epoch_(\d+)\.pth$', p)[0]))
+
+
+class CheckpointManager(object):
+    '''Writes checkpoints on a background thread, atomically, keeping the last N
+
+    save() takes a CPU snapshot on the calling thread (a memory copy), the
+    serialization and disk write happen on the worker thread.
+    '''
+
+    def __init__(self, save_dir, keep_last=0):
+        self.save_dir = save_dir
+        self.keep_last = keep_last
+        self.error = None
+        # At most one snapshot waiting while another one is written
+        self.jobs = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def save(self, state, filename):
+        if self.error is not None:
+            raise self.error
+        self.jobs.put((to_cpu(state), filename))
+        return
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            state, filename = job
+            try:
+                self._write(state, filename)
+                self._prune()
+            except Exception as e:
+                self.error = e
+
+    def _write(self, state, filename):
+        os.makedirs(self.save_dir, exist_ok=True)
+        path = os.path.join(self.save_dir, filename)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            torch.save(state, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        # Readers see either the previous file or the complete new one
+        os.replace(tmp_path, path)
+
+    def _prune(self):
+        if self.keep_last <= 0:
+            return
+        for path in list_checkpoints(self.save_dir)[:-self.keep_last]:
+            os.remove(path)
+
+    def close(self):
+        self.jobs.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return
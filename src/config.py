@@ -32,14 +32,39 @@ net_arg.add_argument('--dim_c_disc', type=int, default=10,
                      help="Number of category in c_disc")
 net_arg.add_argument('--dim_z', type=int, default=62,
                      help="Dimension of noise Z")
+net_arg.add_argument('--model_variant', type=str, default='base',
+                     choices=['light', 'base', 'wide'],
+                     help="Width of G and D: light halves, wide doubles hidden units and channels")
 # net_arg.add_argument('--', type=, default=)
 
 # Data
 data_arg = add_argument_group('Data')
-data_arg.add_argument('--dataset', type=str, default='mnist')
-data_arg.add_argument('--data_dim', type=int, default=28)
-data_arg.add_argument('--batch_size', type=str, default=128)
+data_arg.add_argument('--dataset', type=str, default='mnist',
+                      help="mnist, fashion_mnist, synthetic, folder (images under --data_path) "
+                           "or npy (uint8 array file --data_path), see data_loader.DATASETS")
+data_arg.add_argument('--data_path', type=str, default='',
+                      help="Image directory or .npy file of the folder / npy datasets")
+data_arg.add_argument('--data_dim', type=int, default=28,
+                      help="Image height and width of the folder / synthetic datasets")
+data_arg.add_argument('--data_channel', type=int, default=1,
+                      help="Image channels of the folder / synthetic datasets")
+data_arg.add_argument('--synthetic_size', type=int, default=60000,
+                      help="Number of images of the synthetic dataset")
+data_arg.add_argument('--data_mode', type=str, default='torchvision',
+                      choices=['torchvision', 'tensor'],
+                      help="tensor: memory-mapped uint8 cache, batches sliced without per-sample transforms")
+data_arg.add_argument('--download', type=str2bool, default=True,
+                      help="Fetch the dataset when it is not found under project_root/data")
+data_arg.add_argument('--batch_size', type=int, default=128)
 data_arg.add_argument('--num_worker', type=int, default=12)
+data_arg.add_argument('--pin_memory', type=str2bool, default=True)
+data_arg.add_argument('--persistent_workers', type=str2bool, default=True,
+                      help="Keep DataLoader workers alive across epochs (torch>=1.7, ignored before)")
+data_arg.add_argument('--prefetch_factor', type=int, default=2,
+                      help="Number of batches loaded in advance by each worker (torch>=1.7, ignored before)")
+data_arg.add_argument('--drop_last', type=str2bool, default=False)
+data_arg.add_argument('--device_prefetch', type=int, default=2,
+                      help="Number of batches moved to device ahead of the step (0: off)")
 # data_arg.add_argument('--', type=, default=)
 
 # Training / testing
@@ -53,17 +78,125 @@ training_arg.add_argument('--beta1', type=float, default=0.5)
 training_arg.add_argument('--beta2', type=float, default=0.999)
 training_arg.add_argument('--lambda_disc', type=float, default=1)
 training_arg.add_argument('--lambda_cont', type=float, default=0.1)
+training_arg.add_argument('--fused_D', type=str2bool, default=False,
+                          help="Run D on real and fake samples in one forward pass, "
+                               "BatchNorm keeps separate statistics for each")
+training_arg.add_argument('--amp', type=str2bool, default=False,
+                          help="Mixed precision forward passes (bfloat16 on CPU, float16 on CUDA)")
+training_arg.add_argument('--compile', type=str, default='eager',
+                          choices=['eager', 'script', 'compile'],
+                          help="Execution backend for G and D, falls back to eager on failure")
+training_arg.add_argument('--ema', type=str2bool, default=False,
+                          help="Keep an exponential moving average of G, used for images, evaluation and checkpoint export")
+training_arg.add_argument('--ema_decay', type=float, default=0.999)
+training_arg.add_argument('--ema_every', type=int, default=1,
+                          help="Update the average every N steps (with decay**N)")
+training_arg.add_argument('--ema_bn', type=str, default='copy',
+                          choices=['copy', 'ema', 'recompute'],
+                          help="BN statistics of the average: copied from G, averaged, or re-estimated before use")
+training_arg.add_argument('--ema_bn_batches', type=int, default=10,
+                          help="Batches of latents to re-estimate the BN statistics (--ema_bn recompute)")
+training_arg.add_argument('--num_replica', type=int, default=1,
+                          help="Train K independent models in one vmapped step (torch>=2.0)")
+training_arg.add_argument('--replica_lambda_disc', type=str, default='',
+                          help="Comma separated lambda_disc per replica (default: lambda_disc)")
+training_arg.add_argument('--replica_lambda_cont', type=str, default='',
+                          help="Comma separated lambda_cont per replica (default: lambda_cont)")
+
+# Distributed
+dist_arg = add_argument_group('Distributed')
+dist_arg.add_argument('--world_size', type=int, default=1,
+                      help="Number of training processes (DistributedDataParallel on gloo), batch_size is per process")
+dist_arg.add_argument('--dist_port', type=int, default=29500,
+                      help="TCP port of the rank 0 process for process group rendezvous")
+dist_arg.add_argument('--sync_bn', type=str2bool, default=False,
+                      help="Convert BatchNorm to SyncBatchNorm across processes (CUDA only)")
+# Evaluation
+eval_arg = add_argument_group('Evaluation')
+eval_arg.add_argument('--eval_step', type=int, default=0,
+                      help="Number of epochs between background evaluations, FID and code accuracy (0: off)")
+eval_arg.add_argument('--eval_samples', type=int, default=10000)
+eval_arg.add_argument('--eval_batch_size', type=int, default=1000)
+eval_arg.add_argument('--eval_thread', type=int, default=1,
+                      help="torch intra-op threads of the evaluation process")
+eval_arg.add_argument('--eval_gpu_id', type=int, default=-1,
+                      help="Device of the evaluation process, -1 for CPU")
+eval_arg.add_argument('--eval_classifier_epoch', type=int, default=2,
+                      help="Epochs of the feature classifier, trained once and cached in data/<dataset>")
+
+# Schedule control (see controller.py)
+control_arg = add_argument_group('Control')
+control_arg.add_argument('--control_smoothing', type=float, default=0.8,
+                         help="Smoothing of the running statistics across log windows (0: last window only)")
+control_arg.add_argument('--early_stop', type=str2bool, default=False,
+                         help="Stop when the monitored metric stops improving, D collapses or a loss is not finite")
+control_arg.add_argument('--early_stop_metric', type=str, default='auto',
+                         help="fid (requires --eval_step), a logged loss (I, I_d, I_c_total, G, D), "
+                              "auto: fid with evaluation, I_d otherwise (G if lambda_disc is annealed). "
+                              "Losses scaled by an annealed lambda are refused")
+control_arg.add_argument('--early_stop_patience', type=int, default=20,
+                         help="Observations without improvement: log windows, or evaluations for fid")
+control_arg.add_argument('--early_stop_min_delta', type=float, default=0.01,
+                         help="Improvement relative to the best value that resets the patience")
+control_arg.add_argument('--collapse_patience', type=int, default=10,
+                         help="Log windows of D collapse (Prob_D real > 1 - collapse_eps, fake < collapse_eps) "
+                              "before stopping (0: off)")
+control_arg.add_argument('--collapse_eps', type=float, default=0.02)
+control_arg.add_argument('--lr_schedule_G', type=str, default='constant',
+                         choices=['constant', 'cosine', 'plateau'],
+                         help="Learning rate of the G / Q optimizer: constant, cosine decay over the run, "
+                              "or reduced when the monitored metric plateaus")
+control_arg.add_argument('--lr_schedule_D', type=str, default='constant',
+                         choices=['constant', 'cosine', 'plateau'])
+control_arg.add_argument('--lr_min_factor', type=float, default=0.01,
+                         help="Final learning rate of the cosine schedule, relative to the initial one")
+control_arg.add_argument('--lr_plateau_factor', type=float, default=0.5)
+control_arg.add_argument('--lr_plateau_patience', type=int, default=5)
+control_arg.add_argument('--lambda_disc_start', type=float, default=None,
+                         help="Anneal lambda_disc linearly from this value to --lambda_disc")
+control_arg.add_argument('--lambda_cont_start', type=float, default=None,
+                         help="Anneal lambda_cont linearly from this value to --lambda_cont")
+control_arg.add_argument('--lambda_anneal_steps', type=int, default=1000)
+control_arg.add_argument('--D_every', type=int, default=1,
+                         help="Update D every N steps, its forward still runs for the logged probabilities")
+control_arg.add_argument('--adaptive_D_every', type=str2bool, default=False,
+                         help="Raise D_every while D dominates, lower it back once G catches up")
+control_arg.add_argument('--D_every_max', type=int, default=4)
+control_arg.add_argument('--D_gap_high', type=float, default=0.6,
+                         help="Prob_D real - fake gap above which D counts as dominant")
+control_arg.add_argument('--D_gap_low', type=float, default=0.2)
+
 # Misc
 misc_arg = add_argument_group('Misc')
-misc_arg.add_argument('--gpu_id', type=int, default=0)
+misc_arg.add_argument('--gpu_id', type=int, default=0,
+                      help="CUDA device index, -1 for CPU")
 misc_arg.add_argument('--log_step', type=int, default=10)
 misc_arg.add_argument('--save_step', type=int, default=10,
                       help="Number of epochs for making checkpoint")
+misc_arg.add_argument('--keep_last', type=int, default=5,
+                      help="Number of most recent checkpoints to keep (0: keep all)")
+misc_arg.add_argument('--resume', type=str, default='',
+                      help="Checkpoint file or checkpoint directory (latest Epoch_N.pth) to resume from")
 misc_arg.add_argument('--project_root', type=str, default=get_root())
 misc_arg.add_argument('--model_name', type=str, default='Vanila_InfoGAN')
 misc_arg.add_argument('--use_visdom', type=str2bool, default=True)
+misc_arg.add_argument('--render_backend', type=str, default='save_image',
+                      choices=['save_image', 'matplotlib'],
+                      help="save_image: direct PNG grid writes, matplotlib: titled figures rendered in a process pool")
+misc_arg.add_argument('--render_worker', type=int, default=2,
+                      help="Number of processes for the matplotlib render backend")
 misc_arg.add_argument('--visdom_server', type=str,
                       default='http://localhost', help="Your visdom server address")
+misc_arg.add_argument('--visdom_port', type=int, default=8097)
+misc_arg.add_argument('--debug_anomaly', type=str2bool, default=False,
+                      help="Enable autograd anomaly detection (slow, debug only)")
+misc_arg.add_argument('--nan_check_step', type=int, default=0,
+                      help="Check module outputs for NaN/Inf every N steps (0: off)")
+misc_arg.add_argument('--profile', type=str2bool, default=False,
+                      help="Time each phase of the training step, percentiles every log_step, "
+                           "saved to results/<model_name>/profile")
+misc_arg.add_argument('--profile_trace', type=str, default='',
+                      help="start:end step range recorded with torch.profiler (requires --profile)")
 
 
 def get_config():
@@ -0,0 +1,232 @@
+import os
+import json
+import numpy as np
+import torch
+from sweep import check_metric
+
+'''
+Training Schedule Controller
+
+Called like any other callback at every log_step, it keeps running statistics of the
+logged metrics (window means, exponentially smoothed across windows) and adapts the
+schedule through the policies enabled in config:
+
+    early stop       the monitored metric (FID of the background evaluation, or a loss)
+                     did not improve for early_stop_patience observations, D collapsed
+                     (Prob_D real -> 1, fake -> 0) for collapse_patience windows, or a
+                     loss is not finite
+    lr schedule      per optimizer group (G / Q and D): constant, cosine decay over the
+                     run, or reduced when the monitored metric plateaus
+    lambda anneal    lambda_disc / lambda_cont moved linearly from a start value to the
+                     configured one over lambda_anneal_steps
+    D update ratio   D is updated every D_every steps, raised while D dominates (Prob_D
+                     real - fake above D_gap_high) and lowered below D_gap_low
+
+Every decision is appended to results/<model_name>/control.jsonl, discrete ones (stop,
+plateau reduction, D_every change) are printed as well. The controller runs on rank 0,
+Trainer broadcasts its decisions to the other ranks.
+'''
+
+
+def control_enabled(config):
+    return config.early_stop or config.adaptive_D_every or \
+        config.lr_schedule_G != 'constant' or config.lr_schedule_D != 'constant' or \
+        config.lambda_disc_start is not None or config.lambda_cont_start is not None
+
+
+def make_scheduler(optimizer, kind, config, num_checks):
+    if kind == 'cosine':
+        eta_min = optimizer.param_groups[0]['lr'] * config.lr_min_factor
+        return torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, num_checks, eta_min)
+    if kind == 'plateau':
+        return torch.optim.lr_scheduler.ReduceLROnPlateau(
+            optimizer, factor=config.lr_plateau_factor, patience=config.lr_plateau_patience)
+    return None
+
+
+class ScheduleController(object):
+    '''Adapts early stopping, learning rates, lambdas and the D update ratio of a Trainer'''
+
+    def __init__(self, trainer, config):
+        self.config = config
+        self.smoothing = config.control_smoothing
+        self.log_file = os.path.join(
+            config.project_root, 'results', config.model_name, 'control.jsonl')
+        # Lambdas moved by the annealing below
+        annealed = [name for name, start in [('lambda_disc', config.lambda_disc_start),
+                                             ('lambda_cont', config.lambda_cont_start)]
+                    if start is not None]
+        self.metric = config.early_stop_metric
+        if self.metric == 'auto':
+            if config.eval_step > 0:
+                self.metric = 'fid'
+            else:
+                self.metric = 'G' if 'lambda_disc' in annealed else 'I_d'
+        if self.metric == 'fid' and config.eval_step <= 0:
+            raise ValueError('--early_stop_metric fid requires --eval_step > 0')
+        if self.metric != 'fid' and self.metric not in trainer.metrics.names:
+            raise ValueError(f'Unknown metric {self.metric}, '
+                             f'use fid or one of {trainer.metrics.names}')
+        if config.early_stop or 'plateau' in (config.lr_schedule_G, config.lr_schedule_D):
+            # A loss scaled by an annealed lambda follows the schedule, not the training
+            check_metric(self.metric, annealed, reason='annealed')
+
+        self.stats = {}
+        self.best = float('inf')
+        self.bad_count = 0
+        self.collapse_count = 0
+        self.num_eval = len(trainer.eval_results)
+        # Schedulers step once per log window, the cosine one ends at the last window
+        num_steps = config.num_epoch * len(trainer.data_loader)
+        self.num_checks = max(1, (num_steps - 1) // config.log_step + 1)
+        self.schedulers = {}
+        for name, optimizer, kind in [('G', trainer.optim_G, config.lr_schedule_G),
+                                      ('D', trainer.optim_D, config.lr_schedule_D)]:
+            scheduler = make_scheduler(optimizer, kind, config, self.num_checks)
+            if scheduler is not None:
+                self.schedulers[name] = (optimizer, scheduler)
+        self.anneal = {name: (getattr(config, f'{name}_start'), getattr(config, name))
+                       for name in annealed}
+        for name, (start, _) in self.anneal.items():
+            setattr(trainer, name, start)
+
+    def __call__(self, trainer, epoch, step, values):
+        record = {'epoch': epoch + 1, 'step': step}
+        for name, value in values.items():
+            mean = float(np.mean(value))
+            if not np.isfinite(mean):
+                if self.config.early_stop:
+                    self._stop(trainer, record, f'{name} is not finite')
+                return
+            previous = self.stats.get(name, mean)
+            self.stats[name] = self.smoothing * previous + (1 - self.smoothing) * mean
+
+        self._anneal_lambdas(trainer, step, record)
+        self._update_D_every(trainer, record)
+        observation = self._observe(trainer)
+        self._step_schedulers(observation, record)
+        if self.config.early_stop:
+            self._check_stop(trainer, observation, record)
+        return
+
+    def _anneal_lambdas(self, trainer, step, record):
+        fraction = min(1.0, step / max(1, self.config.lambda_anneal_steps))
+        for name, (start, end) in self.anneal.items():
+            value = start + (end - start) * fraction
+            if value != getattr(trainer, name):
+                setattr(trainer, name, value)
+                self._log(dict(record, action='anneal', name=name, value=value))
+        return
+
+    def _update_D_every(self, trainer, record):
+        if not self.config.adaptive_D_every:
+            return
+        gap = self.stats['P_d_real'] - self.stats['P_d_fake']
+        D_every = trainer.D_every
+        if gap > self.config.D_gap_high and D_every < self.config.D_every_max:
+            D_every += 1
+        elif gap < self.config.D_gap_low and D_every > self.config.D_every:
+            D_every -= 1
+        if D_every != trainer.D_every:
+            trainer.D_every = D_every
+            self._log(dict(record, action='D_every', value=D_every, gap=gap), verbose=True)
+        return
+
+    def _observe(self, trainer):
+        '''
+        Returns the new value of the monitored metric, None if there is none since the last call
+        '''
+        if self.metric != 'fid':
+            return self.stats[self.metric]
+        results = trainer.eval_results[self.num_eval:]
+        self.num_eval = len(trainer.eval_results)
+        return results[-1]['fid'] if results else None
+
+    def _step_schedulers(self, observation, record):
+        for name, (optimizer, scheduler) in self.schedulers.items():
+            lr = optimizer.param_groups[0]['lr']
+            plateau = isinstance(scheduler, torch.optim.lr_scheduler.ReduceLROnPlateau)
+            if plateau:
+                if observation is None:
+                    continue
+                scheduler.step(observation)
+            else:
+                scheduler.step()
+            new_lr = optimizer.param_groups[0]['lr']
+            if new_lr != lr:
+                # Plateau reductions are rare and worth a line, cosine moves every window
+                self._log(dict(record, action=f'lr_{name}', value=new_lr,
+                               metric=self.metric, observation=observation),
+                          verbose=plateau)
+        return
+
+    def _check_stop(self, trainer, observation, record):
+        eps = self.config.collapse_eps
+        if self.stats['P_d_real'] > 1 - eps and self.stats['P_d_fake'] < eps:
+            self.collapse_count += 1
+        else:
+            self.collapse_count = 0
+        if 0 < self.config.collapse_patience <= self.collapse_count:
+            self._stop(trainer, record, f'D collapsed for {self.collapse_count} log windows '
+                       f"(Prob_D real {self.stats['P_d_real']:.4f}, "
+                       f"fake {self.stats['P_d_fake']:.4f})")
+            return
+
+        if observation is None:
+            return
+        if not np.isfinite(self.best) or \
+                observation < self.best - self.config.early_stop_min_delta * abs(self.best):
+            self.best = observation
+            self.bad_count = 0
+        else:
+            self.bad_count += 1
+        if self.bad_count >= self.config.early_stop_patience:
+            self._stop(trainer, record, f'{self.metric} did not improve on {self.best:.4f} '
+                       f'for {self.bad_count} observations')
+        return
+
+    def _stop(self, trainer, record, reason):
+        trainer.stop_training = True
+        self._log(dict(record, action='stop', reason=reason), verbose=True)
+        return
+
+    def _log(self, record, verbose=False):
+        if verbose:
+            details = ', '.join(f'{k}: {v}' for k, v in record.items()
+                                if k not in ('epoch', 'step', 'action'))
+            print(f"[Control] step {record['step']}: {record['action']} ({details})")
+        os.makedirs(os.path.dirname(self.log_file), exist_ok=True)
+        with open(self.log_file, 'a') as fp:
+            fp.write(json.dumps(record) + '\n')
+        return
+
+    def state_dict(self, trainer):
+        return {'metric': self.metric, 'stats': self.stats, 'best': self.best,
+                'bad_count': self.bad_count, 'collapse_count': self.collapse_count,
+                'D_every': trainer.D_every,
+                'lambdas': {name: getattr(trainer, name) for name in self.anneal},
+                'schedulers': {name: (type(scheduler).__name__, scheduler.state_dict())
+                               for name, (_, scheduler) in self.schedulers.items()}}
+
+    def load_state_dict(self, trainer, state):
+        '''
+        Restores the parts of the state whose policy is the same in the resumed run
+        '''
+        self.stats = state['stats']
+        if state['metric'] == self.metric:
+            self.best = state['best']
+            self.bad_count = state['bad_count']
+        self.collapse_count = state['collapse_count']
+        if self.config.adaptive_D_every:
+            trainer.D_every = state['D_every']
+        for name, value in state['lambdas'].items():
+            if name in self.anneal:
+                setattr(trainer, name, value)
+        for name, (kind, scheduler_state) in state['schedulers'].items():
+            if name in self.schedulers and type(self.schedulers[name][1]).__name__ == kind:
+                scheduler = self.schedulers[name][1]
+                scheduler.load_state_dict(scheduler_state)
+                if kind == 'CosineAnnealingLR':
+                    # Decay over the --num_epoch of the resumed run
+                    scheduler.T_max = self.num_checks
+        return
@@ -1,26 +1,438 @@
 import torch
 import os
-import torchvision.transforms as transforms
-from torch.utils.data import DataLoader
-from torchvision import datasets
+import gzip
+import queue
+import inspect
+import threading
+import numpy as np
+from torch.utils.data.distributed import DistributedSampler
 
+# torchvision is imported only by the paths that use it, the tensor path never does
 
-def get_loader(batch_size, root):
-    # Configure data loader
-    # os.makedirs("../data", exist_ok=True)
-    # transforms.Normalize([0.5], [0.5])
-    data_dir = os.path.join(root, 'data/mnist')
-    os.makedirs(data_dir, exist_ok=True)
-    dataloader = torch.utils.data.DataLoader(
-        datasets.MNIST(
+
+def get_loader(config, device='cpu', rank=0, world_size=1):
+    '''
+    Training loader of config.dataset. torchvision data_mode: per-sample Dataset and
+    DataLoader workers, tensor data_mode: whole batches sliced out of uint8 arrays
+    '''
+    spec = get_dataset(config.dataset)
+    if config.data_mode == 'tensor':
+        images, labels = load_dataset(config)
+        return TensorBatchLoader(images, labels, config.batch_size, device,
+                                 shuffle=True, drop_last=config.drop_last,
+                                 rank=rank, world_size=world_size)
+    elif config.data_mode != 'torchvision':
+        raise NotImplementedError
+
+    # Worker options are only accepted by DataLoader when workers are used (torch>=1.7)
+    worker_kwargs = {}
+    if config.num_worker > 0 and _loader_accepts('persistent_workers'):
+        worker_kwargs['persistent_workers'] = config.persistent_workers
+        worker_kwargs['prefetch_factor'] = config.prefetch_factor
+
+    if spec.torchvision_name is not None:
+        import torchvision.transforms as transforms
+        from torchvision import datasets
+        data_dir = dataset_dir(config)
+        fetch_idx(data_dir, spec.torchvision_name, train=True, download=config.download)
+        dataset = getattr(datasets, spec.torchvision_name)(
             data_dir,
             train=True,
-            download=True,
+            # fetch_idx already fetched the raw files, download only lets torchvision
+            # extract / process them in place (no network access once they exist)
+            download=config.download,
             transform=transforms.Compose(
                 [transforms.ToTensor()]
             ),
-        ),
-        batch_size=batch_size,
-        shuffle=True,
+        )
+    else:
+        dataset = ArrayDataset(*load_dataset(config))
+
+    # Each process of a distributed run reads its own shard
+    sampler = None
+    if world_size > 1:
+        sampler = DistributedSampler(
+            dataset, num_replicas=world_size, rank=rank, shuffle=True)
+
+    dataloader = torch.utils.data.DataLoader(
+        dataset,
+        batch_size=config.batch_size,
+        shuffle=sampler is None,
+        sampler=sampler,
+        num_workers=config.num_worker,
+        pin_memory=config.pin_memory and torch.cuda.is_available(),
+        drop_last=config.drop_last,
+        **worker_kwargs
     )
     return dataloader
+
+
+# Dataset Registry
+
+DATASETS = {}
+
+
+class DatasetSpec(object):
+    '''Registry entry of a dataset
+
+    load(config, data_dir, train) returns uint8 images [N, H, W] or [N, C, H, W] and labels [N],
+    shape(config) the [C, H, W] of the images without loading them (None: read from the arrays).
+    Datasets with a torchvision_name use that torchvision class in the torchvision data_mode.
+    from_path: the data comes from --data_path, caches go to one directory per source.
+    variant(config): suffix of the directory name for data generated from arguments,
+    one directory per shape and size.
+    '''
+
+    def __init__(self, name, load, shape=None, torchvision_name=None, model='infogan',
+                 from_path=False, variant=None):
+        self.name = name
+        self.load = load
+        self.shape = shape
+        self.torchvision_name = torchvision_name
+        self.model = model
+        self.from_path = from_path
+        self.variant = variant
+
+
+def register_dataset(name, **kwargs):
+    def register(load):
+        DATASETS[name] = DatasetSpec(name, load, **kwargs)
+        return load
+    return register
+
+
+def get_dataset(name):
+    if name not in DATASETS:
+        raise ValueError(f"Unknown dataset '{name}', available: {', '.join(DATASETS)}")
+    return DATASETS[name]
+
+
+def dataset_dir(config):
+    '''
+    Directory of downloads and caches (decoded arrays, evaluation classifier) of config.dataset
+    '''
+    spec = get_dataset(config.dataset)
+    name = spec.name
+    if spec.from_path:
+        name += '_' + os.path.basename(os.path.normpath(config.data_path))
+    if spec.variant is not None:
+        name += '_' + spec.variant(config)
+    data_dir = os.path.join(config.project_root, 'data', name)
+    os.makedirs(data_dir, exist_ok=True)
+    return data_dir
+
+
+def load_dataset(config, train=True):
+    return get_dataset(config.dataset).load(config, dataset_dir(config), train)
+
+
+def image_shape(images):
+    # [N, H, W] -> (1, H, W), [N, C, H, W] -> (C, H, W)
+    return (1,) + tuple(images.shape[1:]) if images.ndim == 3 else tuple(images.shape[1:])
+
+
+def get_data_shape(config):
+    '''
+    [C, H, W] of the images of config.dataset, as recorded in the config once known
+    '''
+    if getattr(config, 'data_shape', None):
+        return tuple(config.data_shape)
+    spec = get_dataset(getattr(config, 'dataset', 'mnist'))
+    if spec.shape is not None:
+        return tuple(spec.shape(config))
+    return image_shape(load_dataset(config)[0])
+
+
+def _square_shape(config):
+    return (config.data_channel, config.data_dim, config.data_dim)
+
+
+@register_dataset('mnist', shape=lambda config: (1, 28, 28), torchvision_name='MNIST')
+def load_mnist(config, data_dir, train):
+    return load_idx_cache(data_dir, 'MNIST', train, config.download)
+
+
+@register_dataset('fashion_mnist', shape=lambda config: (1, 28, 28),
+                  torchvision_name='FashionMNIST')
+def load_fashion_mnist(config, data_dir, train):
+    return load_idx_cache(data_dir, 'FashionMNIST', train, config.download)
+
+
+def _synthetic_variant(config):
+    return 'x'.join(str(v) for v in _square_shape(config)) + f'_n{config.synthetic_size}'
+
+
+@register_dataset('synthetic', shape=_square_shape, variant=_synthetic_variant)
+def load_synthetic(config, data_dir, train):
+    '''
+    Seeded uniform noise images with random labels, for throughput runs without any download
+    '''
+    rng = np.random.RandomState(0 if train else 1)
+    num_images = config.synthetic_size
+    images = rng.randint(0, 256, (num_images,) + _square_shape(config), dtype=np.uint8)
+    labels = rng.randint(0, 10, num_images, dtype=np.uint8)
+    return images, labels
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff', '.webp')
+
+
+@register_dataset('folder', shape=_square_shape, from_path=True)
+def load_folder(config, data_dir, train):
+    '''
+    Images under --data_path, the label is the index of the top-level sub-directory
+    (like ImageFolder, 0 for images directly in data_path). Resized to data_dim x data_dim
+    and decoded once into uint8 .npy caches in data_dir, delete them after changing the images.
+    '''
+    channel, height, width = _square_shape(config)
+    if channel not in (1, 3):
+        raise ValueError(f'--data_channel must be 1 (grayscale) or 3 (RGB), got {channel}')
+    image_cache = os.path.join(data_dir, f'images_{channel}x{height}x{width}_uint8.npy')
+    label_cache = os.path.join(data_dir, f'labels_{channel}x{height}x{width}_uint8.npy')
+
+    if not (os.path.exists(image_cache) and os.path.exists(label_cache)):
+        from PIL import Image
+        if not os.path.isdir(config.data_path):
+            raise FileNotFoundError(f'--data_path {config.data_path} is not a directory')
+        classes = sorted(d for d in os.listdir(config.data_path)
+                         if os.path.isdir(os.path.join(config.data_path, d)))
+        files = []
+        for root, dirs, names in os.walk(config.data_path):
+            dirs.sort()
+            files += [os.path.join(root, name) for name in sorted(names)
+                      if name.lower().endswith(IMAGE_EXTENSIONS)]
+        if not files:
+            raise FileNotFoundError(f'No images found under {config.data_path}')
+
+        images = np.lib.format.open_memmap(image_cache + '.tmp.npy', mode='w+', dtype=np.uint8,
+                                           shape=(len(files), channel, height, width))
+        labels = np.zeros(len(files), dtype=np.uint8)
+        for i, path in enumerate(files):
+            with Image.open(path) as image:
+                image = image.convert('L' if channel == 1 else 'RGB').resize(
+                    (width, height), Image.BILINEAR)
+            array = np.asarray(image)
+            images[i] = array[None] if channel == 1 else array.transpose(2, 0, 1)
+            top = os.path.relpath(path, config.data_path).split(os.sep)[0]
+            labels[i] = classes.index(top) if top in classes else 0
+        images.flush()
+        del images
+        # Same as the IDX caches: no broken cache after an interrupted decode
+        os.replace(image_cache + '.tmp.npy', image_cache)
+        np.save(label_cache + '.tmp.npy', labels)
+        os.replace(label_cache + '.tmp.npy', label_cache)
+
+    return np.load(image_cache, mmap_mode='r'), np.load(label_cache, mmap_mode='r')
+
+
+@register_dataset('npy', from_path=True)
+def load_npy(config, data_dir, train):
+    '''
+    uint8 images [N, H, W] or [N, C, H, W] in the .npy file --data_path (e.g. a shard written
+    by sample.py), labels from <data_path>_labels.npy if present, memory-mapped
+    '''
+    images = np.load(config.data_path, mmap_mode='r')
+    if images.dtype != np.uint8 or images.ndim not in (3, 4):
+        raise ValueError(f'{config.data_path}: expected uint8 images [N, H, W] or [N, C, H, W], '
+                         f'got {images.dtype} {images.shape}')
+    label_path = os.path.splitext(config.data_path)[0] + '_labels.npy'
+    if os.path.exists(label_path):
+        labels = np.load(label_path, mmap_mode='r')
+    else:
+        labels = np.zeros(len(images), dtype=np.uint8)
+    return images, labels
+
+
+class ArrayDataset(torch.utils.data.Dataset):
+    '''Per-sample access to uint8 arrays for the DataLoader, same output as ToTensor()'''
+
+    def __init__(self, images, labels):
+        self.images = images
+        self.labels = labels
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, index):
+        image = torch.from_numpy(np.array(self.images[index]))
+        if image.dim() == 2:
+            image = image.unsqueeze(0)
+        return image.float().div_(255), int(self.labels[index])
+
+
+def _read_idx(path):
+    # IDX format: magic(2 zero bytes, dtype, ndim), ndim big-endian int32 sizes, data
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        buf = f.read()
+    ndim = buf[3]
+    shape = tuple(int(d) for d in np.frombuffer(buf, dtype='>i4', count=ndim, offset=4))
+    return np.frombuffer(buf, dtype=np.uint8, offset=4 + 4 * ndim).reshape(shape)
+
+
+def _loader_accepts(name):
+    return name in inspect.signature(torch.utils.data.DataLoader.__init__).parameters
+
+
+def _find_raw(raw_dir, name):
+    for fname in [name, name + '.gz']:
+        path = os.path.join(raw_dir, fname)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def fetch_idx(data_dir, name='MNIST', train=True, download=True):
+    '''
+    Make sure the raw IDX files of a split of the torchvision dataset `name` (MNIST,
+    FashionMNIST) are in data_dir/<name>/raw.
+    Only touches the network when they are missing and download is set.
+    '''
+    split = 'train' if train else 't10k'
+    raw_dir = os.path.join(data_dir, name, 'raw')
+    if _find_raw(raw_dir, f'{split}-images-idx3-ubyte') is not None and \
+            _find_raw(raw_dir, f'{split}-labels-idx1-ubyte') is not None:
+        return
+    if not download:
+        raise FileNotFoundError(
+            f'{name} {split} files not found in {raw_dir}, run with --download True to fetch them')
+    from torchvision import datasets
+    getattr(datasets, name)(data_dir, train=train, download=True)
+    return
+
+
+def load_idx_cache(data_dir, name='MNIST', train=True, download=True):
+    '''
+    Decode the IDX files of MNIST-like datasets once into uint8 .npy caches and memory-map them.
+    Returns images [N, 28, 28] and labels [N] as read-only uint8 memmaps.
+    '''
+    split = 'train' if train else 't10k'
+    image_cache = os.path.join(data_dir, f'{split}_images_uint8.npy')
+    label_cache = os.path.join(data_dir, f'{split}_labels_uint8.npy')
+
+    if not (os.path.exists(image_cache) and os.path.exists(label_cache)):
+        raw_dir = os.path.join(data_dir, name, 'raw')
+        fetch_idx(data_dir, name, train=train, download=download)
+        image_raw = _find_raw(raw_dir, f'{split}-images-idx3-ubyte')
+        label_raw = _find_raw(raw_dir, f'{split}-labels-idx1-ubyte')
+        # Write to a temp file first so an interrupted decode leaves no broken cache
+        for raw, cache in [(image_raw, image_cache), (label_raw, label_cache)]:
+            np.save(cache + '.tmp.npy', _read_idx(raw))
+            os.replace(cache + '.tmp.npy', cache)
+
+    return np.load(image_cache, mmap_mode='r'), np.load(label_cache, mmap_mode='r')
+
+
+class TensorBatchLoader(object):
+    '''Yields whole batches by index slicing a uint8 array, converted to float on device'''
+
+    def __init__(self, images, labels, batch_size, device='cpu', shuffle=True,
+                 drop_last=False, rank=0, world_size=1):
+        self.images = images
+        self.labels = labels
+        self.batch_size = batch_size
+        self.device = torch.device(device)
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+        # Every rank gets the same number of samples, the remainder is dropped
+        self.num_samples = len(images) // world_size
+
+    def set_epoch(self, epoch):
+        # Same permutation on every rank, reshuffled each epoch (like DistributedSampler)
+        self.epoch = epoch
+
+    def __len__(self):
+        if self.drop_last:
+            return self.num_samples // self.batch_size
+        return (self.num_samples + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        if self.shuffle and self.world_size > 1:
+            generator = torch.Generator()
+            generator.manual_seed(self.epoch)
+            order = torch.randperm(len(self.images), generator=generator).numpy()
+        elif self.shuffle:
+            order = torch.randperm(len(self.images)).numpy()
+        else:
+            order = np.arange(len(self.images))
+        order = order[self.rank:self.num_samples * self.world_size:self.world_size]
+        for i in range(len(self)):
+            # Sorted indices keep the memmap reads mostly sequential
+            idx = np.sort(order[i * self.batch_size:(i + 1) * self.batch_size])
+            images = torch.from_numpy(self.images[idx]).to(self.device)
+            labels = torch.from_numpy(self.labels[idx]).to(self.device)
+            # [B, (C,) H, W] uint8 -> [B, C, H, W] float in [0, 1], same as ToTensor()
+            if images.dim() == 3:
+                images = images.unsqueeze(1)
+            data = images.float().div_(255)
+            yield data, labels.long()
+
+
+class DevicePrefetcher(object):
+    '''Moves the next batches to device on a background thread while the current step runs'''
+
+    _END = object()
+
+    def __init__(self, loader, device, depth=2):
+        self.loader = loader
+        self.device = device
+        self.depth = depth
+
+    def __len__(self):
+        return len(self.loader)
+
+    def set_epoch(self, epoch):
+        set_loader_epoch(self.loader, epoch)
+
+    def __iter__(self):
+        batches = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+
+        def put(item):
+            # Give up when the consumer stopped iterating (break / exception)
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def worker():
+            try:
+                for batch in self.loader:
+                    batch = [t.to(self.device, non_blocking=True) for t in batch]
+                    if not put(batch):
+                        return
+            except Exception as e:
+                put(e)
+                return
+            put(self._END)
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is self._END:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+
+
+def set_loader_epoch(loader, epoch):
+    '''
+    Reshuffle the distributed shards of loader for epoch (no-op for other loaders)
+    '''
+    sampler = getattr(loader, 'sampler', None)
+    if isinstance(sampler, DistributedSampler):
+        sampler.set_epoch(epoch)
+    elif hasattr(loader, 'set_epoch'):
+        loader.set_epoch(epoch)
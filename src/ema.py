@@ -0,0 +1,97 @@
+import copy
+import torch
+
+'''
+Exponential Moving Average of Model Weights
+'''
+
+
+class ModelEMA(object):
+    '''Shadow copy of a model whose parameters track an exponential moving average
+
+        ema_param <- ema_param + (1 - decay) * (param - ema_param)
+
+    applied to all parameters with one fused multi-tensor lerp_ (torch._foreach_lerp_,
+    per-tensor lerp_ on older torch). With update_every=N the update runs on every N-th
+    step with decay**N, the same average at 1/N of the cost. The decay ramps up as
+    min(decay, (1 + n) / (10 + n)) over the first updates, so that the average is not
+    dominated by the initialization.
+
+    BatchNorm buffers (bn_mode):
+        copy        running statistics of the live model, copied on every update
+        ema         running statistics averaged like the parameters
+        recompute   re-estimated for the averaged weights by refresh_bn() before use
+    The copy is kept in eval mode and never receives gradients.
+    '''
+
+    def __init__(self, model, decay=0.999, update_every=1, bn_mode='copy'):
+        self.model = copy.deepcopy(model).eval()
+        for param in self.model.parameters():
+            param.requires_grad_(False)
+        self.decay = decay
+        self.update_every = update_every
+        self.bn_mode = bn_mode
+        self.num_updates = 0
+        self.params = list(model.parameters())
+        self.ema_params = list(self.model.parameters())
+        # Floating point buffers are BN running statistics, num_batches_tracked is copied
+        self.buffers = list(model.buffers())
+        self.ema_buffers = list(self.model.buffers())
+        self.foreach = hasattr(torch, '_foreach_lerp_')
+
+    def update(self, step):
+        if step % self.update_every != 0:
+            return
+        self.num_updates += 1
+        decay = min(self.decay, (1 + self.num_updates) / (10 + self.num_updates))
+        weight = 1 - decay ** self.update_every
+        with torch.no_grad():
+            self._lerp(self.ema_params, self.params, weight)
+            if self.bn_mode == 'ema':
+                floating = [(e, b) for e, b in zip(self.ema_buffers, self.buffers)
+                            if e.is_floating_point()]
+                self._lerp([e for e, _ in floating], [b for _, b in floating], weight)
+            if self.bn_mode != 'recompute':
+                for ema_buffer, buffer in zip(self.ema_buffers, self.buffers):
+                    if self.bn_mode == 'copy' or not ema_buffer.is_floating_point():
+                        ema_buffer.copy_(buffer)
+        return
+
+    def _lerp(self, ema_tensors, tensors, weight):
+        if not ema_tensors:
+            return
+        if self.foreach:
+            torch._foreach_lerp_(ema_tensors, tensors, weight)
+        else:
+            for ema_tensor, tensor in zip(ema_tensors, tensors):
+                ema_tensor.lerp_(tensor, weight)
+
+    def refresh_bn(self, sample_fn, num_batches):
+        '''
+        bn_mode recompute: re-estimate the BN running statistics of the averaged weights
+        from num_batches inputs of sample_fn() (cumulative average), no-op otherwise
+        '''
+        if self.bn_mode != 'recompute':
+            return
+        norms = [m for m in self.model.modules()
+                 if isinstance(m, torch.nn.modules.batchnorm._BatchNorm)]
+        momentum = [m.momentum for m in norms]
+        for m in norms:
+            m.reset_running_stats()
+            m.momentum = None
+        self.model.train()
+        with torch.no_grad():
+            for _ in range(num_batches):
+                self.model(sample_fn())
+        self.model.eval()
+        for m, value in zip(norms, momentum):
+            m.momentum = value
+        return
+
+    def state_dict(self):
+        return {'model': self.model.state_dict(), 'num_updates': self.num_updates}
+
+    def load_state_dict(self, state):
+        self.model.load_state_dict(state['model'])
+        self.num_updates = state['num_updates']
+        return
@@ -0,0 +1,70 @@
+import copy
+import time
+import torch
+
+'''
+Execution Engine for Generator / Discriminator
+'''
+
+BACKENDS = ['eager', 'script', 'compile']
+
+
+def compile_module(module, backend, warmup_calls=()):
+    '''
+    Returns (callable, backend actually used, compile time in seconds).
+
+    backend: 'eager' (module itself), 'script' (torch.jit.script) or
+    'compile' (torch.compile, torch>=2.0). Compilation is lazy for torch.compile,
+    so each (args, kwargs) in warmup_calls is run once (forward and backward) to
+    move compilation out of the timed training steps. Module buffers
+    (BatchNorm running stats) are restored after the warmup.
+    If compilation fails, the eager module is returned.
+    '''
+    if backend == 'eager':
+        return module, 'eager', 0.0
+
+    start = time.time()
+    buffers = [b.detach().clone() for b in module.buffers()]
+    try:
+        if backend == 'script':
+            compiled = torch.jit.script(module)
+        elif backend == 'compile':
+            if not hasattr(torch, 'compile'):
+                raise RuntimeError('torch.compile requires torch>=2.0')
+            compiled = torch.compile(module)
+        else:
+            raise NotImplementedError
+
+        for args, kwargs in warmup_calls:
+            outputs = compiled(*args, **kwargs)
+            if torch.is_tensor(outputs):
+                outputs = (outputs,)
+            loss = sum(o.float().sum() for o in outputs if torch.is_tensor(o))
+            loss.backward()
+    except Exception as e:
+        message = next((l for l in str(e).splitlines() if l.strip()), '')
+        print(f'[{module.__class__.__name__}] {backend} failed, falling back to eager: '
+              f'{e.__class__.__name__}: {message}')
+        compiled, backend = module, 'eager'
+    finally:
+        module.zero_grad()
+        with torch.no_grad():
+            for b, saved in zip(module.buffers(), buffers):
+                b.copy_(saved)
+
+    return compiled, backend, time.time() - start
+
+
+def stack_models(models):
+    '''
+    Stack the parameters / buffers of identical modules along a new leading dim.
+    Returns (params, buffers, call) where call(params, buffers, *args, **kwargs)
+    runs one replica statelessly, to be mapped over replicas with torch.func.vmap
+    '''
+    params, buffers = torch.func.stack_module_state(models)
+    # Only the structure of the base module is used, its storage is never touched
+    base = copy.deepcopy(models[0]).to('meta')
+
+    def call(params, buffers, *args, **kwargs):
+        return torch.func.functional_call(base, (params, buffers), args, kwargs)
+    return params, buffers, call
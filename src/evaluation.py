@@ -0,0 +1,307 @@
+import os
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from latent import LatentSampler
+from utils import get_device
+from checkpoint import to_cpu, find_checkpoint, load_checkpoint, generator_state
+from data_loader import load_dataset, dataset_dir, image_shape, get_data_shape, TensorBatchLoader
+from models import create_models
+
+'''
+Quantitative Evaluation of Generators
+
+    fid            Frechet distance between Gaussians fitted to the features of a small
+                   classifier of the dataset labels on generated and real images (FID with
+                   a domain specific feature extractor instead of Inception, not comparable
+                   to published FID numbers; for unlabeled data the features are those of
+                   the untrained network)
+    mi_acc_j       accuracy of the latent_disc head recovering the j-th sampled discrete
+                   code, a lower bound proxy of the mutual information term
+    purity_j       fraction of samples whose classifier label is the majority label of
+                   their j-th discrete category (1.0: every category is one class)
+
+The classifier and the real feature statistics are built once and cached in the data
+directory, keyed on the image shape and the number of images. During training, Evaluator runs on snapshots of G / D in a background process.
+'''
+
+
+class FeatureClassifier(nn.Module):
+    '''Small image classifier, the penultimate activations are the features'''
+
+    def __init__(self, data_shape=(1, 28, 28), num_class=10, dim_feature=128):
+        super(FeatureClassifier, self).__init__()
+        self.features = nn.Sequential(
+            nn.Conv2d(data_shape[0], 32, kernel_size=3, padding=1),
+            nn.ReLU(inplace=True),
+            nn.MaxPool2d(2),
+            nn.Conv2d(32, 64, kernel_size=3, padding=1),
+            nn.ReLU(inplace=True),
+            # 14 x 14 -> 7 x 7 for MNIST, any resolution ends up at 7 x 7
+            nn.AdaptiveMaxPool2d((7, 7)),
+            nn.Flatten(),
+            nn.Linear(64*7*7, dim_feature),
+            nn.ReLU(inplace=True),
+        )
+        self.fc = nn.Linear(dim_feature, num_class)
+
+    def forward(self, x):
+        features = self.features(x)
+        return self.fc(features), features
+
+
+def _save_atomic(save_fn, path):
+    # Concurrent runs (e.g. sweep trials) may build the same cache, last rename wins
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    save_fn(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def cache_path(config, images, name):
+    # One file per dataset content, e.g. eval_classifier_1x28x28_n60000.pth
+    stem, ext = os.path.splitext(name)
+    shape = 'x'.join(str(v) for v in image_shape(images))
+    return os.path.join(dataset_dir(config), f'{stem}_{shape}_n{len(images)}{ext}')
+
+
+def load_classifier(config, device, num_epoch=2, batch_size=256):
+    '''
+    Loads the eval_classifier cache of the dataset directory, trains and saves it on the
+    training split first if missing
+    '''
+    images, labels = load_dataset(config)
+    path = cache_path(config, images, 'eval_classifier.pth')
+    data_shape = image_shape(images)
+    if os.path.exists(path):
+        state = torch.load(path, map_location='cpu')
+        model = FeatureClassifier(data_shape, state['num_class'])
+        model.load_state_dict(state['model'])
+        return model.to(device).eval()
+
+    start_time = time.time()
+    model = FeatureClassifier(data_shape, int(labels.max()) + 1)
+    model.to(device).train()
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    loader = TensorBatchLoader(images, labels, batch_size, device)
+    for epoch in range(num_epoch):
+        correct = 0
+        for data, label in loader:
+            logits, _ = model(data)
+            loss = F.cross_entropy(logits, label)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            correct += (logits.argmax(1) == label).sum().item()
+        print(f'Evaluation classifier epoch {epoch+1}/{num_epoch}: '
+              f'train accuracy {correct / len(images):.4f}')
+    state = {'model': model.state_dict(), 'num_class': model.fc.out_features}
+    _save_atomic(lambda p: torch.save(state, p), path)
+    print(f'Evaluation classifier trained in {time.time() - start_time:.1f}s, saved to {path}')
+    return model.eval()
+
+
+def load_real_stats(config, classifier, device, batch_size=1000):
+    '''
+    Feature mean and covariance of the training split, cached in the eval_real_stats file of
+    the dataset directory. The cache is rebuilt when the classifier file is newer.
+    '''
+    images, labels = load_dataset(config)
+    path = cache_path(config, images, 'eval_real_stats.npz')
+    classifier_path = cache_path(config, images, 'eval_classifier.pth')
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(classifier_path):
+        stats = np.load(path)
+        return stats['mu'], stats['sigma']
+
+    loader = TensorBatchLoader(images, labels, batch_size, device, shuffle=False)
+    features = []
+    with torch.no_grad():
+        for data, _ in loader:
+            features.append(classifier(data)[1].cpu())
+    mu, sigma = gaussian_stats(torch.cat(features).numpy())
+    _save_atomic(lambda p: _save_stats(p, mu, sigma), path)
+    return mu, sigma
+
+
+def _save_stats(path, mu, sigma):
+    # A file object, np.savez would append .npz to the temporary name
+    with open(path, 'wb') as fp:
+        np.savez(fp, mu=mu, sigma=sigma)
+
+
+def gaussian_stats(features):
+    features = features.astype(np.float64)
+    return features.mean(0), np.cov(features, rowvar=False)
+
+
+def frechet_distance(mu1, sigma1, mu2, sigma2):
+    '''
+    |mu1 - mu2|^2 + tr(sigma1 + sigma2 - 2 sqrt(sigma1 sigma2))
+    sqrt(sigma1 sigma2) has the eigenvalues of the symmetric sqrt(sigma1) sigma2 sqrt(sigma1),
+    so eigh is enough (no scipy.linalg.sqrtm)
+    '''
+    eigval, eigvec = np.linalg.eigh(sigma1)
+    sqrt_sigma1 = (eigvec * np.sqrt(np.clip(eigval, 0, None))) @ eigvec.T
+    product = sqrt_sigma1 @ sigma2 @ sqrt_sigma1
+    trace_sqrt = np.sqrt(np.clip(np.linalg.eigvalsh(product), 0, None)).sum()
+    diff = mu1 - mu2
+    return float(diff @ diff + np.trace(sigma1) + np.trace(sigma2) - 2 * trace_sqrt)
+
+
+def evaluate(G, D, classifier, latent, real_stats, num_samples, batch_size):
+    '''
+    Generates num_samples images in batches of batch_size and returns a dict of metrics
+    '''
+    n_c_disc, dim_c_disc = latent.n_c_disc, latent.dim_c_disc
+    features = []
+    correct = torch.zeros(n_c_disc)
+    # counts[j, category, label] for the purity of each discrete code
+    counts = torch.zeros(n_c_disc, dim_c_disc, classifier.fc.out_features)
+    with torch.no_grad():
+        for start in range(0, num_samples, batch_size):
+            z, idx = latent.sample(min(batch_size, num_samples - start))
+            data_fake = G(z)
+            logits, feature = classifier(data_fake)
+            _, disc_logits, _, _ = D(data_fake)
+            features.append(feature.cpu())
+            correct += (disc_logits.argmax(2) == idx.t()).float().sum(0).cpu()
+            label = logits.argmax(1)
+            for j in range(n_c_disc):
+                counts[j].index_put_((idx[j].cpu(), label.cpu()),
+                                     torch.ones(len(label)), accumulate=True)
+
+    mu, sigma = gaussian_stats(torch.cat(features).numpy())
+    metrics = {'fid': frechet_distance(mu, sigma, *real_stats),
+               'mi_acc': float(correct.mean() / num_samples)}
+    for j in range(n_c_disc):
+        metrics[f'mi_acc_{j+1}'] = float(correct[j] / num_samples)
+        metrics[f'purity_{j+1}'] = float(counts[j].max(1)[0].sum() / num_samples)
+    return metrics
+
+
+def build_models(config, G_state, D_state, device):
+    G, D = create_models(config, get_data_shape(config))
+    G.load_state_dict(G_state)
+    D.load_state_dict(D_state)
+    return G.to(device).eval(), D.to(device).eval()
+
+
+# Classifier and real statistics of the worker process, keyed by data directory
+_CACHE = {}
+
+
+def _init_worker(num_thread):
+    torch.set_num_threads(num_thread)
+
+
+def evaluate_snapshot(config, G_state, D_state, epoch, step):
+    '''
+    Runs in the evaluation process on CPU copies of the model states
+    '''
+    start_time = time.time()
+    device = get_device(config.eval_gpu_id)
+    data_dir = dataset_dir(config)
+    if data_dir not in _CACHE:
+        classifier = load_classifier(config, device, config.eval_classifier_epoch)
+        _CACHE[data_dir] = (classifier, load_real_stats(
+            config, classifier, device, config.eval_batch_size))
+    classifier, real_stats = _CACHE[data_dir]
+    G, D = build_models(config, G_state, D_state, device)
+    latent = LatentSampler(config.dim_z, config.n_c_disc, config.dim_c_disc,
+                           config.dim_c_cont, device)
+    metrics = evaluate(G, D, classifier, latent, real_stats,
+                       config.eval_samples, config.eval_batch_size)
+    metrics.update({'epoch': epoch, 'step': step, 'time': time.time() - start_time})
+    return metrics
+
+
+class Evaluator(object):
+    '''Evaluates snapshots of G / D in a background process, training never waits on it
+
+    submit() copies the model states to CPU and returns immediately, finished results are
+    picked up by collect() and appended to results/<model_name>/eval.jsonl.
+    '''
+
+    def __init__(self, config, max_pending=2):
+        self.config = config
+        self.max_pending = max_pending
+        self.result_file = os.path.join(
+            config.project_root, 'results', config.model_name, 'eval.jsonl')
+        self.futures = []
+        # spawn: forking a process that already runs torch threads is unsafe
+        self.pool = ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker, initargs=(config.eval_thread,))
+
+    def submit(self, G, D, epoch, step):
+        if len(self.futures) >= self.max_pending:
+            print(f'Evaluation of epoch {epoch} skipped, {len(self.futures)} still pending')
+            return
+        self.futures.append(self.pool.submit(
+            evaluate_snapshot, self.config, to_cpu(G.state_dict()),
+            to_cpu(D.state_dict()), epoch, step))
+        return
+
+    def collect(self, block=False):
+        '''
+        Returns the results finished since the last call (all pending ones if block)
+        '''
+        results = []
+        pending = []
+        for future in self.futures:
+            if block or future.done():
+                results.append(future.result())
+            else:
+                pending.append(future)
+        self.futures = pending
+        if results:
+            os.makedirs(os.path.dirname(self.result_file), exist_ok=True)
+            with open(self.result_file, 'a') as fp:
+                for result in results:
+                    fp.write(json.dumps(result) + '\n')
+        return results
+
+    def close(self):
+        results = self.collect(block=True)
+        self.pool.shutdown()
+        return results
+
+
+def format_metrics(metrics):
+    return ', '.join(f'{k}: {v:.4f}' for k, v in metrics.items()
+                     if k not in ('epoch', 'step', 'time'))
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', type=str, required=True,
+                        help="Epoch_N.pth or a checkpoint directory (latest checkpoint)")
+    parser.add_argument('--num_samples', type=int, default=10000)
+    parser.add_argument('--batch_size', type=int, default=1000)
+    parser.add_argument('--project_root', type=str, default='',
+                        help="Root of the data directory (default: the one of the checkpoint)")
+    parser.add_argument('--raw_weights', action='store_true',
+                        help="Evaluate the trained G weights instead of their moving average (--ema)")
+    parser.add_argument('--gpu_id', type=int, default=-1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    checkpoint = load_checkpoint(find_checkpoint(args.checkpoint))
+    config = checkpoint['configuations']
+    config.project_root = args.project_root or config.project_root
+    config.eval_gpu_id = args.gpu_id
+    config.eval_samples = args.num_samples
+    config.eval_batch_size = args.batch_size
+    config.eval_classifier_epoch = getattr(config, 'eval_classifier_epoch', 2)
+    config.download = getattr(config, 'download', True)
+    G_state = generator_state(checkpoint, not args.raw_weights)
+    metrics = evaluate_snapshot(config, G_state, checkpoint['Discriminator'],
+                                checkpoint['epoch'], checkpoint['step'])
+    print(f"Epoch {metrics['epoch']}, step {metrics['step']}: {format_metrics(metrics)}")
@@ -0,0 +1,56 @@
+import torch
+
+'''
+Latent Code Sampler
+'''
+
+
+class LatentSampler(object):
+    '''Draws z, categorical codes and continuous codes in one batched call
+
+    Layout of a sampled latent vector (same as the Generator input):
+        [ z (dim_z) | c_disc_1 (dim_c_disc) | ... | c_disc_n | c_cont (dim_c_cont) ]
+    '''
+
+    def __init__(self, dim_z, n_c_disc, dim_c_disc, dim_c_cont, device='cpu'):
+        self.dim_z = dim_z
+        self.n_c_disc = n_c_disc
+        self.dim_c_disc = dim_c_disc
+        self.dim_c_cont = dim_c_cont
+        self.device = torch.device(device)
+        self.dim_latent = dim_z + n_c_disc * dim_c_disc + dim_c_cont
+        self.start_c_disc = dim_z
+        self.start_c_cont = dim_z + n_c_disc * dim_c_disc
+
+    def sample(self, batch_size, out=None):
+        '''
+        Returns latent z of shape [batch_size, dim_latent] and the categorical
+        targets idx of shape [n_c_disc, batch_size] (int64), both on self.device.
+        If `out` is given, it is filled in place instead of allocating a new buffer.
+        '''
+        if out is None:
+            out = torch.empty(batch_size, self.dim_latent, device=self.device)
+
+        # Sample Z from N(0,1)
+        # (normal_ on a strided column slice falls back to a slow serial path,
+        #  so draw into a contiguous block and copy it into the buffer)
+        out[:, :self.start_c_disc].copy_(
+            torch.randn(batch_size, self.dim_z, device=self.device))
+
+        # Sample discrete latent code from Cat(K=dim_c_disc)
+        idx = torch.randint(self.dim_c_disc, (self.n_c_disc, batch_size),
+                            device=self.device)
+        c_disc = out[:, self.start_c_disc:self.start_c_cont].view(
+            batch_size, self.n_c_disc, self.dim_c_disc)
+        c_disc.zero_()
+        c_disc.scatter_(2, idx.t().unsqueeze(2), 1.0)
+
+        # Sample continuous latent code from Unif(-1,1)
+        out[:, self.start_c_cont:].uniform_(-1, 1)
+
+        return out, idx
+
+    def c_cont(self, z):
+        return z[:, self.start_c_cont:]
+
+    __call__ = sample
@@ -1,18 +1,68 @@
+import time
+# Before the heavy imports, the trainer reports the time to first step from here
+LAUNCH_TIME = time.time()
+import os
 import torch
-from utils import save_config
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from utils import save_config, get_device
 from trainer import Trainer
 from config import get_config
-from data_loader import get_loader
+from data_loader import get_loader, get_data_shape, DevicePrefetcher
+from checkpoint import find_checkpoint, load_checkpoint, restore_run_config
 
 
-def main(config):
-    save_config(config)
-    data_loader = get_loader(config.batch_size, config.project_root)
-    trainer = Trainer(config, data_loader)
+def main(config, rank=0, world_size=1):
+    checkpoint = None
+    if config.resume:
+        checkpoint = load_checkpoint(find_checkpoint(config.resume))
+        # Keep writing results of the resumed run to the same directory
+        config.model_name = checkpoint['configuations'].model_name
+        # Models and data are rebuilt as in the saved run
+        changed = restore_run_config(config, checkpoint['configuations'])
+        if rank == 0:
+            for name, given, saved in changed:
+                print(f'Resume: --{name} {given} replaced by {saved} of the checkpoint')
+    # Recorded in config.json and checkpoints, models are rebuilt from it
+    config.data_shape = list(get_data_shape(config))
+    if rank == 0:
+        save_config(config)
+    # One device per process, rank r uses gpu_id + r
+    device = get_device(config.gpu_id + rank if config.gpu_id >= 0 else -1)
+    data_loader = get_loader(config, device=device, rank=rank, world_size=world_size)
+    if config.device_prefetch > 0:
+        data_loader = DevicePrefetcher(data_loader, device,
+                                       depth=config.device_prefetch)
+    if config.num_replica > 1:
+        from replicas import ReplicaTrainer
+        trainer = ReplicaTrainer(config, data_loader)
+    else:
+        trainer = Trainer(config, data_loader)
+    trainer.launch_time = LAUNCH_TIME
+    if checkpoint is not None:
+        trainer.resume(checkpoint)
     trainer.train()
     return
 
 
+def main_worker(rank, config):
+    '''
+    Entry point of one process of a distributed run (started by mp.spawn)
+    '''
+    dist.init_process_group('gloo', init_method=f'tcp://127.0.0.1:{config.dist_port}',
+                            rank=rank, world_size=config.world_size)
+    # Processes share the host, split the intra-op threads between them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // config.world_size))
+    try:
+        main(config, rank, config.world_size)
+    finally:
+        dist.destroy_process_group()
+    return
+
+
 if __name__ == "__main__":
     config, unparsed = get_config()
-    main(config)
+    if config.world_size > 1:
+        mp.spawn(main_worker, args=(config,), nprocs=config.world_size)
+    else:
+        main(config)
@@ -0,0 +1,41 @@
+'''
+Model Registry
+
+    G, D = create_models(config, data_shape)
+
+Builders are registered by name and called with the data shape [C, H, W] and the width
+multiplier of --model_variant. Every dataset names its model (see data_loader.DATASETS).
+'''
+
+# --model_variant -> width multiplier of hidden units and channels
+VARIANTS = {'light': 0.5, 'base': 1.0, 'wide': 2.0}
+
+MODELS = {}
+
+
+def register_model(name):
+    def register(builder):
+        MODELS[name] = builder
+        return builder
+    return register
+
+
+@register_model('infogan')
+def build_infogan(data_shape, dim_z, n_c_disc, dim_c_disc, dim_c_cont, width):
+    from models.mnist.generator import Generator
+    from models.mnist.discriminator import Discriminator
+    G = Generator(dim_z, n_c_disc, dim_c_disc, dim_c_cont, data_shape, width)
+    D = Discriminator(n_c_disc, dim_c_disc, dim_c_cont, data_shape, width)
+    return G, D
+
+
+def create_models(config, data_shape):
+    '''
+    Returns untrained G and D for the model of config.dataset and config.model_variant
+    (checkpoints of older versions have neither, they default to mnist / base)
+    '''
+    from data_loader import get_dataset
+    model = get_dataset(getattr(config, 'dataset', 'mnist')).model
+    width = VARIANTS[getattr(config, 'model_variant', 'base')]
+    return MODELS[model](tuple(data_shape), config.dim_z, config.n_c_disc,
+                         config.dim_c_disc, config.dim_c_cont, width)
@@ -0,0 +1,18 @@
+def resample_steps(data_shape):
+    '''
+    Number of stride-2 (de)convolutions between data_shape [C, H, W] and the smallest
+    feature map. H and W must be multiples of 4: two steps, then halve H and W while
+    both are even and larger than 8 (12 -> 3, 16 -> 4, 28 -> 7, 64 -> 8)
+    '''
+    _, height, width = data_shape
+    if height % 4 != 0 or width % 4 != 0:
+        raise ValueError(f'Data shape {tuple(data_shape)} is not supported, '
+                         f'height and width must be multiples of 4')
+    height //= 4
+    width //= 4
+    steps = 2
+    while height % 2 == 0 and width % 2 == 0 and max(height, width) > 8:
+        height //= 2
+        width //= 2
+        steps += 1
+    return steps
@@ -1,48 +1,68 @@
 import torch
 import torch.nn as nn
-import torch.nn.functional as F
+import contextlib
+from models.mnist import resample_steps
 '''
 Discriminator Model Definition
 '''
 
 
 class Discriminator(nn.Module):
-    '''Shared Part of Discriminator and Recognition Model'''
+    '''Shared Part of Discriminator and Recognition Model
 
-    def __init__(self, n_c_disc, dim_c_disc, dim_c_cont):
+    Built for any data_shape [C, H, W] with H, W multiples of 4, width scales the
+    hidden units and channels. For the default shape and width, layers and parameter
+    names are those of the paper model.
+    '''
+
+    def __init__(self, n_c_disc, dim_c_disc, dim_c_cont,
+                 data_shape=(1, 28, 28), width=1.0):
         super(Discriminator, self).__init__()
         self.dim_c_disc = dim_c_disc
         self.dim_c_cont = dim_c_cont
         self.n_c_disc = n_c_disc
-        # Shared layers
-        self.module_shared = nn.Sequential(
-            nn.Conv2d(in_channels=1,
-                      out_channels=64,
-                      kernel_size=4,
-                      stride=2,
-                      padding=1),
-            nn.LeakyReLU(negative_slope=0.1, inplace=True),
-            nn.Conv2d(in_channels=64,
-                      out_channels=128,
+        num_down = resample_steps(data_shape)
+        channel, height, width_px = data_shape
+        dim_channel = int(64 * width)
+        dim_hidden = int(1024 * width)
+
+        # Shared layers: [C, H, W] -> [64, H/2, W/2] -> [128, H/4, W/4] -> ... -> 1024
+        layers = [
+            nn.Conv2d(in_channels=channel,
+                      out_channels=dim_channel,
                       kernel_size=4,
                       stride=2,
                       padding=1),
-            nn.BatchNorm2d(128),
             nn.LeakyReLU(negative_slope=0.1, inplace=True),
-            Reshape(-1, 128*7*7),
-            nn.Linear(in_features=128*7*7, out_features=1024),
-            nn.BatchNorm1d(1024),
+        ]
+        for _ in range(num_down - 1):
+            layers += [
+                nn.Conv2d(in_channels=dim_channel,
+                          out_channels=dim_channel * 2,
+                          kernel_size=4,
+                          stride=2,
+                          padding=1),
+                nn.BatchNorm2d(dim_channel * 2),
+                nn.LeakyReLU(negative_slope=0.1, inplace=True),
+            ]
+            dim_channel *= 2
+        dim_flat = dim_channel * (height >> num_down) * (width_px >> num_down)
+        layers += [
+            Reshape(-1, dim_flat),
+            nn.Linear(in_features=dim_flat, out_features=dim_hidden),
+            nn.BatchNorm1d(dim_hidden),
             nn.LeakyReLU(negative_slope=0.1, inplace=True),
-        )
+        ]
+        self.module_shared = nn.Sequential(*layers)
 
         # Layer for Disciminating
         self.module_D = nn.Sequential(
-            nn.Linear(in_features=1024, out_features=1),
+            nn.Linear(in_features=dim_hidden, out_features=1),
             nn.Sigmoid()
         )
 
         self.module_Q = nn.Sequential(
-            nn.Linear(in_features=1024, out_features=128),
+            nn.Linear(in_features=dim_hidden, out_features=128),
             nn.BatchNorm1d(128),
             nn.LeakyReLU(negative_slope=0.1, inplace=True),
         )
@@ -51,7 +71,6 @@ class Discriminator(nn.Module):
             nn.Linear(
                 in_features=128, out_features=self.n_c_disc*self.dim_c_disc),
             Reshape(-1, self.n_c_disc, self.dim_c_disc),
-            nn.Softmax(dim=2)
         )
 
         self.latent_cont_mu = nn.Linear(
@@ -60,15 +79,41 @@ class Discriminator(nn.Module):
         self.latent_cont_var = nn.Linear(
             in_features=128, out_features=self.dim_c_cont)
 
-    def forward(self, z):
-        out = self.module_shared(z)
-        probability = self.module_D(out)
-        probability = probability.squeeze()
-        internal_Q = self.module_Q(out)
-        c_disc_logits = self.latent_disc(internal_Q)
-        c_cont_mu = self.latent_cont_mu(internal_Q)
-        c_cont_var = torch.exp(self.latent_cont_var(internal_Q))
-        return probability, c_disc_logits, c_cont_mu, c_cont_var
+    def forward(self, z, heads='all', num_splits: int = 1):
+        '''
+        Returns probability, c_disc logits [B, n_c_disc, dim_c_disc] (unnormalized),
+        c_cont mu and c_cont log-variance.
+        heads='D' computes the adversarial output only, Q outputs are returned as None.
+        num_splits > 1: z stacks that many batches (e.g. [real; fake]) that share the
+        convolutions, BatchNorm normalizes each of them on its own like separate calls
+        '''
+        out = z
+        for layer in self.module_shared:
+            if num_splits > 1 and isinstance(layer, nn.modules.batchnorm._BatchNorm):
+                out = torch.cat([layer(chunk) for chunk in out.chunk(num_splits)])
+            else:
+                out = layer(out)
+
+        # Heads are small, keep them in fp32 under autocast so that
+        # Sigmoid and the losses on the Q outputs do not saturate in low precision
+        with full_precision(out.device.type):
+            out = out.float()
+            probability = self.module_D(out)
+            probability = probability.squeeze()
+            if heads == 'D':
+                return probability, None, None, None
+            internal_Q = self.module_Q(out)
+            c_disc_logits = self.latent_disc(internal_Q)
+            c_cont_mu = self.latent_cont_mu(internal_Q)
+            c_cont_logvar = self.latent_cont_var(internal_Q)
+        return probability, c_disc_logits, c_cont_mu, c_cont_logvar
+
+
+def full_precision(device_type):
+    # Disable autocast where available (torch>=1.10), no-op otherwise
+    if hasattr(torch, 'autocast'):
+        return torch.autocast(device_type=device_type, enabled=False)
+    return contextlib.ExitStack()
 
 
 class Reshape(nn.Module):
@@ -1,6 +1,7 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from models.mnist import resample_steps
 
 '''
 Generator Model Definition
@@ -8,43 +9,57 @@ Generator Model Definition
 
 
 class Generator(nn.Module):
-    def __init__(self, dim_z, n_c_disc, dim_c_disc, dim_c_cont):
+    '''InfoGAN MNIST generator, built for any data_shape [C, H, W] with H, W multiples of 4.
+    width scales the number of hidden units and channels (light / wide variants).
+    For the default shape and width, layers and parameter names are those of the paper model.
+    '''
+
+    def __init__(self, dim_z, n_c_disc, dim_c_disc, dim_c_cont,
+                 data_shape=(1, 28, 28), width=1.0):
         super(Generator, self).__init__()
         self.dim_latent = dim_z + n_c_disc * dim_c_disc + dim_c_cont
+        self.num_up = resample_steps(data_shape)
+        channel, height, width_px = data_shape
+        dim_hidden = int(1024 * width)
+        dim_channel = int(64 * width) * 2 ** (self.num_up - 1)
+        self.init_shape = (dim_channel, height >> self.num_up, width_px >> self.num_up)
+
         self.fc1 = nn.Linear(in_features=self.dim_latent,
-                             out_features=1024,
+                             out_features=dim_hidden,
                              bias=False)
-        self.bn1 = nn.BatchNorm1d(num_features=1024)
-        self.fc2 = nn.Linear(in_features=1024,
-                             out_features=7*7*128,
+        self.bn1 = nn.BatchNorm1d(num_features=dim_hidden)
+        self.fc2 = nn.Linear(in_features=dim_hidden,
+                             out_features=dim_channel * self.init_shape[1] * self.init_shape[2],
                              bias=False)
-        self.bn2 = nn.BatchNorm1d(7*7*128)
-        self.upconv3 = nn.ConvTranspose2d(in_channels=128,
-                                          out_channels=64,
-                                          kernel_size=4,
-                                          stride=2,
-                                          padding=1)
-        self.bn3 = nn.BatchNorm2d(64)
-        self.upconv4 = nn.ConvTranspose2d(in_channels=64,
-                                          out_channels=1,
-                                          kernel_size=4,
-                                          stride=2,
-                                          padding=1)
+        self.bn2 = nn.BatchNorm1d(self.fc2.out_features)
+        # upconv3, bn3, upconv4, ... each doubles H and W, the last one outputs the data channels
+        for i in range(3, 3 + self.num_up):
+            last = i == 2 + self.num_up
+            out_channel = channel if last else dim_channel // 2
+            setattr(self, f'upconv{i}', nn.ConvTranspose2d(in_channels=dim_channel,
+                                                           out_channels=out_channel,
+                                                           kernel_size=4,
+                                                           stride=2,
+                                                           padding=1))
+            if not last:
+                setattr(self, f'bn{i}', nn.BatchNorm2d(out_channel))
+            dim_channel = out_channel
 
     def forward(self, z):
         # Layer 1: [-1, dim_latent] -> [-1, 1024]
         z = F.relu(self.bn1(self.fc1(z)))
 
-        # Layer 2: [-1, 1024] -> [-1, 7*7*128]
+        # Layer 2: [-1, 1024] -> [-1, 128*7*7]
         z = F.relu(self.bn2(self.fc2(z)))
 
-        # Shape Change: [-1, 7*7*128] -> [-1, 128, 7, 7]
-        z = z.view(-1, 128, 7, 7)
+        # Shape Change: [-1, 128*7*7] -> [-1, 128, 7, 7]
+        z = z.view(-1, *self.init_shape)
 
-        # Layer 3: [-1, 128, 7, 7] -> [-1, 64, 14, 14]
-        z = F.relu(self.bn3(self.upconv3(z)))
+        # Layer 3: [-1, 128, 7, 7] -> [-1, 64, 14, 14] (one layer per extra doubling)
+        for i in range(3, 2 + self.num_up):
+            z = F.relu(getattr(self, f'bn{i}')(getattr(self, f'upconv{i}')(z)))
 
         # Layer 4: [-1, 64, 14, 14] -> [-1, 1, 28, 28]
-        img = torch.sigmoid(self.upconv4(z))
+        img = torch.sigmoid(getattr(self, f'upconv{2 + self.num_up}')(z))
 
         return img
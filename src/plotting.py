@@ -0,0 +1,38 @@
+import os
+import numpy as np
+import torch
+import matplotlib.pyplot as plt
+import torchvision.utils as vutils
+from utils import generated_data_title
+
+'''
+Matplotlib Figures of Generated Data
+
+Imported on demand (render_backend matplotlib, render workers), so that
+training startup does not pay for matplotlib.
+'''
+
+
+def plot_generated_data(config, generator, z, epoch, idx_c_d, idx_c_c):
+    with torch.no_grad():
+        gen_data = generator(z).detach().cpu()
+    title = generated_data_title(config, epoch, idx_c_d, idx_c_c)
+    save_generated_figure(config.project_root, config.model_name,
+                          gen_data, title, idx_c_d, idx_c_c)
+    return gen_data, title
+
+
+def save_generated_figure(project_root, model_name, gen_data, title, idx_c_d, idx_c_c):
+    plt.figure(figsize=(10, 10))
+    plt.title(title, fontsize=25)
+    plt.xticks([])
+    plt.yticks([])
+    plt.xlabel(f'Continuous Code Index = {idx_c_c}', fontsize=20)
+    plt.ylabel(f'Discrete Code Index = {idx_c_d}', fontsize=20)
+    plt.imshow(np.transpose(vutils.make_grid(
+        gen_data, nrow=10, padding=2, normalize=True), (1, 2, 0)))
+    result_dir = os.path.join(project_root, 'results', model_name, 'images')
+    os.makedirs(result_dir, exist_ok=True)
+    plt.savefig(os.path.join(result_dir, title+'.png'))
+    plt.close('all')
+    return
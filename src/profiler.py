@@ -0,0 +1,171 @@
+import os
+import csv
+import json
+import time
+import numpy as np
+import torch
+
+'''
+Step-Time Profiler for the Training Loop
+'''
+
+
+class StepProfiler(object):
+    '''Splits every training step into phases timed with marks
+
+        profiler.begin(step)      # time since the previous step ended -> 'data'
+        ...
+        profiler.mark('h2d')      # time since the previous mark -> 'h2d'
+        ...
+        profiler.end()
+
+    Percentiles of each phase are reported per window (summary) and written to
+    profile.json / profile.csv on close. On CUDA every mark synchronizes the
+    device so that kernels are attributed to the phase that launched them,
+    which removes overlap between phases: use it to find the hot phase, not to
+    measure the final throughput.
+
+    trace_steps=(start, end) records a torch.profiler trace of steps
+    [start, end) to trace_steps_<start>-<end>.json (chrome://tracing).
+    '''
+
+    def __init__(self, enabled, device, out_dir, trace_steps=None):
+        self.enabled = enabled
+        self.sync = enabled and torch.device(device).type == 'cuda'
+        self.out_dir = out_dir
+        self.trace_steps = trace_steps
+        self.trace = None
+        self.window = {}
+        self.records = []
+        self.step = None
+        self.num_steps = 0
+        self.last = None
+        # Phases timed with record(), not part of the step time
+        self.outside = set()
+
+    def begin(self, step):
+        if not self.enabled:
+            return
+        self._trace(step)
+        now = self._now()
+        if self.last is not None:
+            self._add('data', now - self.last)
+        self.step = step
+        self.last = now
+        return
+
+    def mark(self, phase):
+        if not self.enabled:
+            return
+        now = self._now()
+        self._add(phase, now - self.last)
+        self.last = now
+        return
+
+    def end(self):
+        if not self.enabled:
+            return
+        self.num_steps += 1
+        if self.trace is not None:
+            self.trace.step()
+        return
+
+    def record(self, phase, seconds):
+        # Phases outside of steps, e.g. epoch-end image generation,
+        # the time until the next step begins is not counted as data wait
+        if self.enabled:
+            self._add(phase, seconds)
+            self.outside.add(phase)
+            self.last = None
+        return
+
+    def _now(self):
+        if self.sync:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def _add(self, phase, seconds):
+        self.window.setdefault(phase, []).append(seconds)
+
+    def _trace(self, step):
+        if self.trace_steps is None:
+            return
+        start, end = self.trace_steps
+        if step == start and self.trace is None:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.sync:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.trace = torch.profiler.profile(activities=activities, record_shapes=True)
+            self.trace.__enter__()
+        elif step == end and self.trace is not None:
+            self._stop_trace()
+
+    def _stop_trace(self):
+        self.trace.__exit__(None, None, None)
+        os.makedirs(self.out_dir, exist_ok=True)
+        start, end = self.trace_steps
+        path = os.path.join(self.out_dir, f'trace_steps_{start}-{end}.json')
+        self.trace.export_chrome_trace(path)
+        print(f'Profiler trace of steps [{start}, {end}) written to {path}')
+        self.trace = None
+        self.trace_steps = None
+
+    def summary(self):
+        '''
+        Percentiles in milliseconds of each phase since the last summary, printed and kept for export
+        '''
+        if not self.enabled or not self.window:
+            return None
+        steps = self.num_steps
+        total = sum(np.sum(v) for v in self.window.values())
+        step_time = sum(np.sum(v) for phase, v in self.window.items()
+                        if phase not in self.outside) / max(steps, 1)
+        record = {'step': self.step, 'num_steps': steps, 'step_ms': step_time * 1e3,
+                  'phases': {}}
+        print(f'Step time profile ({steps} steps, {step_time * 1e3:.2f} ms/step):')
+        for phase, values in self.window.items():
+            values = np.array(values) * 1e3
+            stats = {'count': len(values),
+                     'mean_ms': float(values.mean()),
+                     'p50_ms': float(np.percentile(values, 50)),
+                     'p90_ms': float(np.percentile(values, 90)),
+                     'p99_ms': float(np.percentile(values, 99)),
+                     'share': float(values.sum() / 1e3 / total)}
+            record['phases'][phase] = stats
+            print(f"  {phase:<12} p50 {stats['p50_ms']:8.3f} ms | p90 {stats['p90_ms']:8.3f} ms"
+                  f" | p99 {stats['p99_ms']:8.3f} ms | {stats['share'] * 100:5.1f}%")
+        self.records.append(record)
+        self.window = {}
+        self.num_steps = 0
+        # Printing the summary is not data wait of the next step
+        if self.last is not None:
+            self.last = self._now()
+        return record
+
+    def close(self):
+        if not self.enabled:
+            return
+        if self.trace is not None:
+            self._stop_trace()
+        self.summary()
+        if not self.records:
+            return
+        os.makedirs(self.out_dir, exist_ok=True)
+        with open(os.path.join(self.out_dir, 'profile.json'), 'w') as fp:
+            json.dump(self.records, fp, indent=4)
+        columns = ['count', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'share']
+        with open(os.path.join(self.out_dir, 'profile.csv'), 'w', newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(['step', 'phase'] + columns)
+            for record in self.records:
+                for phase, stats in record['phases'].items():
+                    writer.writerow([record['step'], phase] + [stats[c] for c in columns])
+        return
+
+
+def parse_step_range(text):
+    # '100:110' -> (100, 110), '' -> None
+    if not text:
+        return None
+    start, end = [int(v) for v in text.split(':')]
+    return start, end
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import threading
+import collections
+import numpy as np
+from utils import VisdomPlotter
+
+'''
+Background Visdom Publisher
+'''
+
+
+class VisdomPublisher(object):
+    '''Queues plot events to a worker thread so training never waits on the Visdom server
+
+    Pending line updates for the same (var_name, split_name) are merged into one
+    request. When the queue is full the oldest image event (then the oldest event)
+    is dropped. While the server is unreachable, events are appended to a JSON
+    lines file instead, which can be pushed later with `replay_events`.
+    '''
+
+    def __init__(self, config, max_queue=256, retry_interval=30.0):
+        self.config = config
+        self.max_queue = max_queue
+        self.retry_interval = retry_interval
+        self.event_file = os.path.join(
+            config.project_root, 'results', config.model_name, 'visdom_events.jsonl')
+        self.num_dropped = 0
+
+        self.plotter = None
+        self.online = False
+        self.last_connect = None
+        self.events = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # Same interface as VisdomPlotter, called from the training loop
+    def plot_line(self, var_name, split_name, title_name, x, y):
+        event = {'type': 'line', 'var_name': var_name, 'split_name': split_name,
+                 'title_name': title_name, 'x': list(x), 'y': list(y)}
+        self._put(event)
+
+    def plot_image_grid(self, var_name, imgs, caption):
+        event = {'type': 'image_grid', 'var_name': var_name, 'caption': caption,
+                 'imgs': np.asarray(imgs)}
+        self._put(event)
+
+    def _put(self, event):
+        with self.cond:
+            if self.closed:
+                return
+            if event['type'] == 'line':
+                # Coalesce with a pending update of the same line
+                for pending in self.events:
+                    if pending['type'] == 'line' and pending['var_name'] == event['var_name'] \
+                            and pending['split_name'] == event['split_name']:
+                        pending['x'].extend(event['x'])
+                        pending['y'].extend(event['y'])
+                        return
+            if len(self.events) >= self.max_queue:
+                self._drop_one()
+            self.events.append(event)
+            self.cond.notify()
+
+    def _drop_one(self):
+        for i, pending in enumerate(self.events):
+            if pending['type'] == 'image_grid':
+                del self.events[i]
+                break
+        else:
+            self.events.popleft()
+        self.num_dropped += 1
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.events and not self.closed:
+                    self.cond.wait()
+                if not self.events and self.closed:
+                    return
+                event = self.events.popleft()
+            self._publish(event)
+
+    def _connect(self):
+        self.last_connect = time.time()
+        try:
+            if self.plotter is None:
+                # Sends the configuration text, raises if the server is unreachable
+                self.plotter = VisdomPlotter(self.config)
+            self.online = self.plotter.viz.check_connection()
+        except Exception:
+            self.online = False
+        return self.online
+
+    def _publish(self, event):
+        if not self.online and (self.last_connect is None or
+                                time.time() - self.last_connect > self.retry_interval):
+            self._connect()
+        if self.online:
+            try:
+                self._send(self.plotter, event)
+                return
+            except Exception:
+                self.online = False
+        self._write_offline(event)
+
+    @staticmethod
+    def _send(plotter, event):
+        if event['type'] == 'line':
+            plotter.plot_line(event['var_name'], event['split_name'],
+                              event['title_name'], event['x'], event['y'])
+        else:
+            plotter.plot_image_grid(
+                event['var_name'], event['imgs'], event['caption'])
+
+    def _write_offline(self, event):
+        record = dict(event)
+        if record['type'] == 'line':
+            record['x'] = [float(v) for v in record['x']]
+            record['y'] = [float(v) for v in record['y']]
+        else:
+            record['imgs'] = record['imgs'].tolist()
+        os.makedirs(os.path.dirname(self.event_file), exist_ok=True)
+        with open(self.event_file, 'a') as fp:
+            fp.write(json.dumps(record) + '\n')
+
+    def close(self, timeout=10.0):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join(timeout)
+        if self.num_dropped > 0:
+            print(f'VisdomPublisher dropped {self.num_dropped} events under backpressure')
+        return
+
+
+def replay_events(event_file, plotter):
+    '''
+    Push events written while the server was unreachable to a VisdomPlotter
+    '''
+    with open(event_file) as fp:
+        for line in fp:
+            event = json.loads(line)
+            if event['type'] == 'image_grid':
+                event['imgs'] = np.array(event['imgs'], dtype=np.float32)
+            VisdomPublisher._send(plotter, event)
+    return
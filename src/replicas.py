@@ -0,0 +1,310 @@
+import os
+import copy
+import time
+import datetime
+import torch
+from utils import ImageRenderer, autocast, save_config
+from trainer import Trainer
+from engine import stack_models
+from checkpoint import CheckpointManager, get_rng_state
+from controller import control_enabled
+
+'''
+Vectorized Multi-Replica Training (torch.func, torch>=2.0)
+'''
+
+
+def parse_replica_values(text, default, num_replica):
+    # '0.05,0.1,0.2,0.4' -> one value per replica, empty -> default for all
+    if not text:
+        return [default] * num_replica
+    values = [float(v) for v in text.split(',')]
+    if len(values) != num_replica:
+        raise ValueError(f'Expected {num_replica} comma separated values, got {text}')
+    return values
+
+
+def replica_optimizer_state(state_dict, k):
+    '''
+    Optimizer state of replica k, loadable by the optimizer of a single-model Trainer.
+    Stacked parameters keep the order of Trainer.build_optimizers.
+    '''
+    state = {i: {name: v[k] if torch.is_tensor(v) and v.dim() > 0 else v
+                 for name, v in s.items()}
+             for i, s in state_dict['state'].items()}
+    return {'state': state, 'param_groups': state_dict['param_groups']}
+
+
+class ReplicaTrainer(Trainer):
+    '''Trains num_replica independent InfoGANs with one vmapped forward / backward per step
+
+    Replicas differ by initialization and latent samples, and optionally by
+    lambda_disc / lambda_cont. They share the real batch and the optimizer
+    settings: Adam is elementwise, so one Adam over the stacked parameters
+    updates each replica exactly like its own Adam would.
+    Every replica writes the results of a regular run to results/<model_name>_r<k>,
+    its checkpoints can be resumed or sampled from like any other.
+    '''
+
+    def __init__(self, config, data_loader):
+        if not hasattr(torch, 'func'):
+            raise NotImplementedError('--num_replica requires torch>=2.0')
+        self.num_replica = config.num_replica
+        lambda_disc = parse_replica_values(
+            config.replica_lambda_disc, config.lambda_disc, self.num_replica)
+        lambda_cont = parse_replica_values(
+            config.replica_lambda_cont, config.lambda_cont, self.num_replica)
+        self.replica_configs = []
+        for k in range(self.num_replica):
+            replica_config = copy.copy(config)
+            replica_config.model_name = f'{config.model_name}_r{k}'
+            replica_config.lambda_disc = lambda_disc[k]
+            replica_config.lambda_cont = lambda_cont[k]
+            replica_config.num_replica = 1
+            self.replica_configs.append(replica_config)
+
+        if config.use_visdom:
+            print('Visdom is not used with --num_replica, losses are printed only')
+        if config.eval_step > 0:
+            print('Evaluation is not run with --num_replica, use evaluation.py on the checkpoints')
+        if config.ema:
+            print('--ema is not used with --num_replica')
+        config = copy.copy(config)
+        config.use_visdom = False
+        config.eval_step = 0
+        config.ema = False
+        super(ReplicaTrainer, self).__init__(config, data_loader)
+        if self.distributed:
+            raise NotImplementedError('--num_replica runs in a single process')
+
+        self.replica_lambda_disc = torch.tensor(lambda_disc, device=self.device)
+        self.replica_lambda_cont = torch.tensor(lambda_cont, device=self.device)
+        self.renderers = [ImageRenderer(c) for c in self.replica_configs]
+        for replica_config in self.replica_configs:
+            save_config(replica_config)
+
+    def _set_checkpoints(self, config):
+        self.checkpoints = [CheckpointManager(
+            os.path.join(self.project_root, f'results/{c.model_name}/checkpoint'),
+            config.keep_last) for c in self.replica_configs]
+
+    def _set_debug(self):
+        torch.autograd.set_detect_anomaly(self.debug_anomaly)
+        # Forward hooks don't fire under functional_call
+        self.nan_checker = None
+        if self.nan_check_step > 0:
+            print('--nan_check_step is not used with --num_replica')
+
+    def _set_controller(self, config):
+        # Window statistics are per replica, a schedule would have to be too
+        self.controller = None
+        if control_enabled(config) or config.D_every > 1:
+            print('Schedule control (early stop, lr / lambda schedules, D_every) '
+                  'is not used with --num_replica')
+
+    def build_models(self):
+        G_replicas, D_replicas = [], []
+        for _ in range(self.num_replica):
+            super(ReplicaTrainer, self).build_models()
+            G_replicas.append(self.G)
+            D_replicas.append(self.D)
+        # Per replica modules, only used to export checkpoints and render images
+        self.G_replicas, self.D_replicas = G_replicas, D_replicas
+        self.params_G, self.buffers_G, self.G_call = stack_models(G_replicas)
+        self.params_D, self.buffers_D, self.D_call = stack_models(D_replicas)
+        return
+
+    def build_optimizers(self):
+        # Same groups as Trainer.build_optimizers, in the same order
+        Q_heads = ('module_Q.', 'latent_disc.', 'latent_cont_mu.')
+        params_G = list(self.params_G.values()) + \
+            [p for name, p in self.params_D.items() if name.startswith(Q_heads)]
+        params_D = [p for name, p in self.params_D.items()
+                    if name.startswith(('module_shared.', 'module_D.'))]
+        self.optim_G = self.set_optimizer([params_G], lr=self.lr_G)
+        self.optim_D = self.set_optimizer([params_D], lr=self.lr_D)
+        return
+
+    def _set_engine(self):
+        if self.compile != 'eager':
+            print('--compile is not used with --num_replica, running eager')
+        vmap = torch.func.vmap
+        self.G_exec = vmap(self.G_call)
+        # Real data is shared by all replicas (in_dims None)
+        self.loss_D_exec = vmap(self._replica_loss_D, in_dims=(0, 0, None, 0))
+        self.loss_info_exec = vmap(self._replica_loss_info)
+
+    def _replica_loss_D(self, params, buffers, data_real, data_fake):
+        if self.fused_D:
+            prob_D, _, _, _ = self.D_call(
+                params, buffers, torch.cat((data_real, data_fake.type_as(data_real))),
+                heads='D', num_splits=2)
+            prob_real = prob_D[:self.batch_size]
+            prob_fake = prob_D[self.batch_size:]
+        else:
+            prob_real, _, _, _ = self.D_call(params, buffers, data_real, heads='D')
+            prob_fake, _, _, _ = self.D_call(params, buffers, data_fake, heads='D')
+        return self._loss_D(prob_real, prob_fake), prob_real.mean(), prob_fake.mean()
+
+    def _replica_loss_info(self, params, buffers, data_fake, z, idx,
+                           lambda_disc, lambda_cont):
+        prob_fake, disc_logits, mu, logvar = self.D_call(params, buffers, data_fake)
+        loss_info, loss_G, loss_c_disc, loss_c_cont = self._loss_info(
+            prob_fake, disc_logits, mu, logvar, z, idx, lambda_disc, lambda_cont)
+        return loss_info, loss_G, loss_c_disc, loss_c_cont, prob_fake.mean()
+
+    def train_step(self, data_real):
+        '''
+        One D update and one G/Q update for all replicas.
+        Returns the metrics of each replica, stacked [K, len(self.metrics.names)]
+        '''
+        K = self.num_replica
+        # Independent latent samples per replica: z [K, B, dim_latent], idx [K, n_c_disc, B]
+        z, idx = self._sample(K * self.batch_size)
+        z = z.view(K, self.batch_size, -1)
+        idx = idx.view(self.n_c_disc, K, self.batch_size).transpose(0, 1)
+
+        # Update Discriminator
+        self.optim_D.zero_grad()
+        with autocast(self.device, self.amp):
+            data_fake = self.G_exec(self.params_G, self.buffers_G, z)
+            loss_D, prob_real, prob_fake_D = self.loss_D_exec(
+                self.params_D, self.buffers_D, data_real, data_fake.detach())
+        # Replicas share no parameters, the sum backpropagates each loss to its own replica
+        self._backward(loss_D.sum())
+        self._step(self.optim_D)
+
+        # Update Generator and Q
+        self.optim_G.zero_grad()
+        with autocast(self.device, self.amp):
+            loss_info, loss_G, loss_c_disc, loss_c_cont, prob_fake = self.loss_info_exec(
+                self.params_D, self.buffers_D, data_fake, z, idx,
+                self.replica_lambda_disc, self.replica_lambda_cont)
+        self._backward(loss_info.sum())
+        self._step(self.optim_G)
+        if self.scaler is not None:
+            self.scaler.update()
+
+        # Same order as self.metrics.names
+        return torch.cat([torch.stack([loss_G, loss_D, loss_info, loss_c_disc.sum(1), prob_real,
+                                       prob_fake_D, prob_fake, loss_c_cont.sum(1)], 1),
+                          loss_c_cont, loss_c_disc], 1).detach()
+
+    def _unstack(self):
+        # Copy the stacked state back into the per replica modules
+        with torch.no_grad():
+            for k in range(self.num_replica):
+                for modules, params, buffers in [
+                        (self.G_replicas, self.params_G, self.buffers_G),
+                        (self.D_replicas, self.params_D, self.buffers_D)]:
+                    state = {name: t[k] for name, t in list(params.items()) + list(buffers.items())}
+                    modules[k].load_state_dict(state)
+        return
+
+    def save_model(self, epoch):
+        optim_G = self.optim_G.state_dict()
+        optim_D = self.optim_D.state_dict()
+        for k in range(self.num_replica):
+            self.checkpoints[k].save({
+                'Generator': self.G_replicas[k].state_dict(),
+                'Discriminator': self.D_replicas[k].state_dict(),
+                'configuations': self.replica_configs[k],
+                'optim_G': replica_optimizer_state(optim_G, k),
+                'optim_D': replica_optimizer_state(optim_D, k),
+                'epoch': epoch,
+                'step': self.step,
+                'fixed_z_dict': self.fixed_z_dict,
+                'rng_state': get_rng_state(),
+            }, f'Epoch_{epoch}.pth')
+        return
+
+    def resume(self, checkpoint):
+        raise NotImplementedError(
+            'Resume each replica from its own checkpoint without --num_replica')
+
+    def train(self):
+        if self.fixed_z_dict is None:
+            self.fixed_z_dict = self._sample_fixed_noise()
+        fixed_keys = list(self.fixed_z_dict.keys())
+        fixed_z_all = torch.cat([self.fixed_z_dict[key]
+                                 for key in fixed_keys]).to(self.device)
+
+        start_time = time.time()
+        num_steps = len(self.data_loader)
+        step = self.step
+        window = []
+        for epoch in range(self.start_epoch, self.num_epoch):
+            step_epoch = 0
+            for i, (data, _) in enumerate(self.data_loader, 0):
+                self.profiler.begin(step)
+                if (data.size()[0] != self.batch_size):
+                    self.batch_size = data.size()[0]
+                data_real = data.to(self.device)
+                self.profiler.mark('h2d')
+                window.append(self.train_step(data_real))
+                self.profiler.mark('step')
+
+                # Print log info, one transfer for all replicas and steps of the window
+                if (step % self.log_step == 0):
+                    metrics = torch.stack(window).cpu().numpy()
+                    window = []
+                    print('==========')
+                    print(f'Model Name: {self.model_name} ({self.num_replica} replicas)')
+                    print('Epoch [%d/%d], Step [%d/%d], Elapsed Time: %s'
+                          % (epoch + 1, self.num_epoch, step_epoch, num_steps,
+                             datetime.timedelta(seconds=time.time()-start_time)))
+                    print('Replica  Loss D  Loss Info  Loss_Disc  Loss_Cont  Loss_Gen  '
+                          'Prob_real_D  Prob_fake_D')
+                    names = self.metrics.names
+                    last = metrics[-1]
+                    for k in range(self.num_replica):
+                        print('%7d  %6.4f  %9.4f  %9.4f  %9.4f  %8.4f  %11.4f  %11.4f'
+                              % (k, last[k, names.index('D')], last[k, names.index('I')],
+                                 last[k, names.index('I_d')], last[k, names.index('I_c_total')],
+                                 last[k, names.index('G')], last[k, names.index('P_d_real')],
+                                 last[k, names.index('P_d_fake')]))
+
+                    # values[name] holds the window mean of each replica
+                    values = {name: metrics[:, :, j].mean(0)
+                              for j, name in enumerate(names)}
+                    for callback in self.callbacks:
+                        callback(self, epoch, step, values)
+
+                self.profiler.mark('logging')
+                self.profiler.end()
+                if (step % self.log_step == 0):
+                    self.profiler.summary()
+                self._report_startup()
+
+                step += 1
+                step_epoch += 1
+                self.step = step
+                if self.stop_training:
+                    break
+
+            if self.stop_training:
+                print(f'Training stopped at epoch {epoch+1}, step {step}')
+
+            # Generate and save fixed noise images of each replica
+            epoch_end_time = time.time()
+            self._unstack()
+            for k in range(self.num_replica):
+                gen_data_all = self._generate_fixed(self.G_replicas[k], fixed_z_all)
+                for key, imgs in zip(fixed_keys, gen_data_all.split(
+                        len(gen_data_all) // len(fixed_keys))):
+                    self.renderers[k].render(imgs, epoch, key[0], key[1])
+
+            # Save checkpoint
+            if (epoch + 1) % self.save_step == 0 or epoch + 1 == self.num_epoch \
+                    or self.stop_training:
+                self.save_model(epoch+1)
+            self.profiler.record('epoch_end', time.time() - epoch_end_time)
+            if self.stop_training:
+                break
+
+        for renderer, checkpoints in zip(self.renderers, self.checkpoints):
+            renderer.close()
+            checkpoints.close()
+        self.renderer.close()
+        self.profiler.close()
+        return
@@ -0,0 +1,239 @@
+import os
+import time
+import argparse
+import threading
+import numpy as np
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from latent import LatentSampler
+from checkpoint import find_checkpoint, load_checkpoint, generator_state
+from data_loader import get_data_shape
+from models import create_models
+
+'''
+Batch Inference / Sampling from trained Generators
+'''
+
+
+class Sampler(object):
+    '''Loads a Generator from an Epoch_N.pth checkpoint (or the latest one in a directory) once and generates in large chunks'''
+
+    def __init__(self, checkpoint_path, device='cpu', use_ema=True):
+        checkpoint = load_checkpoint(find_checkpoint(checkpoint_path))
+        config = checkpoint['configuations']
+        self.device = torch.device(device)
+        self.n_c_disc = config.n_c_disc
+        self.dim_c_disc = config.dim_c_disc
+        self.dim_c_cont = config.dim_c_cont
+        self.G = create_models(config, get_data_shape(config))[0]
+        self.G.load_state_dict(generator_state(checkpoint, use_ema))
+        self.G.to(self.device).eval()
+        self.latent = LatentSampler(config.dim_z, config.n_c_disc,
+                                    config.dim_c_disc, config.dim_c_cont, self.device)
+
+    def check_codes(self, c_disc=None, c_cont=None):
+        '''
+        Raises ValueError unless c_disc / c_cont fit the codes of the Generator
+        '''
+        if c_disc is not None:
+            if len(c_disc) != self.n_c_disc:
+                raise ValueError(f'Got {len(c_disc)} discrete codes, the Generator has '
+                                 f'n_c_disc={self.n_c_disc}')
+            for i, value in enumerate(c_disc):
+                if value is not None and not 0 <= value < self.dim_c_disc:
+                    raise ValueError(f'Category {value} of discrete code {i+1} is out of range, '
+                                     f'dim_c_disc={self.dim_c_disc} (0 to {self.dim_c_disc-1})')
+        if c_cont is not None and len(c_cont) != self.dim_c_cont:
+            raise ValueError(f'Got {len(c_cont)} continuous codes, the Generator has '
+                             f'dim_c_cont={self.dim_c_cont}')
+        return
+
+    def sample_latent(self, batch_size, c_disc=None, c_cont=None):
+        '''
+        c_disc: list of n_c_disc category indices, c_cont: list of dim_c_cont values.
+        None (for the whole list or one entry) keeps the randomly sampled code.
+        Returns z, c_disc indices [B, n_c_disc] and c_cont values [B, dim_c_cont]
+        '''
+        self.check_codes(c_disc, c_cont)
+        z, idx = self.latent.sample(batch_size)
+        c_disc_z = z[:, self.latent.start_c_disc:self.latent.start_c_cont].view(
+            batch_size, self.n_c_disc, self.dim_c_disc)
+        for i, value in enumerate(c_disc or []):
+            if value is not None:
+                idx[i] = value
+                c_disc_z[:, i] = 0
+                c_disc_z[:, i, value] = 1
+        c_cont_z = self.latent.c_cont(z)
+        for i, value in enumerate(c_cont or []):
+            if value is not None:
+                c_cont_z[:, i] = value
+        return z, idx.t(), c_cont_z
+
+    def generate(self, num_images, chunk_size=4096, c_disc=None, c_cont=None):
+        '''
+        Yields (images uint8 [B, C, H, W], c_disc [B, n_c_disc], c_cont [B, dim_c_cont])
+        as numpy arrays, chunk by chunk
+        '''
+        inference_mode = getattr(torch, 'inference_mode', torch.no_grad)
+        with inference_mode():
+            for start in range(0, num_images, chunk_size):
+                batch_size = min(chunk_size, num_images - start)
+                z, idx, codes = self.sample_latent(batch_size, c_disc, c_cont)
+                # Quantize on device, only uint8 crosses to the host
+                images = self.G(z).mul_(255).round_().to(torch.uint8)
+                yield images.cpu().numpy(), idx.cpu().numpy(), codes.cpu().numpy()
+
+
+class NpyShardWriter(object):
+    '''Streams images and codes into fixed-size memory-mapped .npy shards'''
+
+    def __init__(self, out_dir, num_images, shard_size):
+        self.out_dir = out_dir
+        self.num_images = num_images
+        self.shard_size = shard_size
+        os.makedirs(out_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.shards = {}
+        self.written = {}
+
+    def _shard(self, index, images, c_disc, c_cont):
+        with self.lock:
+            if index not in self.shards:
+                size = min(self.shard_size, self.num_images - index * self.shard_size)
+                self.shards[index] = {
+                    name: np.lib.format.open_memmap(
+                        os.path.join(self.out_dir, f'{name}_{index:05d}.npy'), mode='w+',
+                        dtype=array.dtype, shape=(size,) + array.shape[1:])
+                    for name, array in [('images', images), ('c_disc', c_disc), ('c_cont', c_cont)]}
+                self.written[index] = 0
+            return self.shards[index]
+
+    def write(self, offset, images, c_disc, c_cont):
+        # A chunk can span several shards, chunks of one shard are written concurrently
+        done = 0
+        while done < len(images):
+            index, start = divmod(offset + done, self.shard_size)
+            shard = self._shard(index, images, c_disc, c_cont)
+            n = min(len(images) - done, len(shard['images']) - start)
+            shard['images'][start:start+n] = images[done:done+n]
+            shard['c_disc'][start:start+n] = c_disc[done:done+n]
+            shard['c_cont'][start:start+n] = c_cont[done:done+n]
+            done += n
+            with self.lock:
+                self.written[index] += n
+                if self.written[index] == len(shard['images']):
+                    self._close_shard(index)
+        return
+
+    def _close_shard(self, index):
+        for array in self.shards.pop(index).values():
+            array.flush()
+
+    def close(self):
+        with self.lock:
+            for index in list(self.shards.keys()):
+                self._close_shard(index)
+
+
+class PNGWriter(object):
+    '''Writes one PNG per image, codes of all images go to codes.csv'''
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        os.makedirs(out_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.codes = open(os.path.join(out_dir, 'codes.csv'), 'w')
+
+    def write(self, offset, images, c_disc, c_cont):
+        from PIL import Image
+        # PNG encoding releases the GIL, so a thread pool scales here
+        for i in range(len(images)):
+            image = images[i].transpose(1, 2, 0)
+            if image.shape[2] == 1:
+                image = image[:, :, 0]
+            Image.fromarray(image).save(
+                os.path.join(self.out_dir, f'{offset + i:08d}.png'))
+        lines = [','.join([f'{offset + i:08d}'] + [str(v) for v in c_disc[i]] +
+                          [f'{v:.6f}' for v in c_cont[i]]) for i in range(len(images))]
+        with self.lock:
+            self.codes.write('\n'.join(lines) + '\n')
+        return
+
+    def close(self):
+        self.codes.close()
+
+
+def run(sampler, writer, num_images, chunk_size, num_writer,
+        c_disc=None, c_cont=None):
+    '''
+    Generate on the calling thread while a pool of writer threads stores finished chunks
+    '''
+    start_time = time.time()
+    pending = []
+    offset = 0
+    with ThreadPoolExecutor(max_workers=num_writer) as pool:
+        for images, idx, codes in sampler.generate(num_images, chunk_size, c_disc, c_cont):
+            # Bound the number of chunks held in memory
+            while len(pending) >= 2 * num_writer:
+                pending.pop(0).result()
+            pending.append(pool.submit(writer.write, offset, images, idx, codes))
+            offset += len(images)
+        for future in pending:
+            future.result()
+    writer.close()
+    elapsed = time.time() - start_time
+    print(f'Generated {num_images} images in {elapsed:.1f}s '
+          f'({num_images / elapsed:.1f} images/sec)')
+    return
+
+
+def parse_codes(text, cast):
+    # '3,r,1' -> [3, None, 1], 'r' keeps the random code at that position
+    if not text:
+        return None
+    try:
+        return [None if v in ('r', '') else cast(v) for v in text.split(',')]
+    except ValueError:
+        raise ValueError(f"Invalid codes '{text}', expected comma separated "
+                         f"{cast.__name__} values or r")
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', type=str, required=True)
+    parser.add_argument('--out_dir', type=str, required=True)
+    parser.add_argument('--num_images', type=int, default=60000)
+    parser.add_argument('--chunk_size', type=int, default=4096)
+    parser.add_argument('--format', type=str, default='npy', choices=['npy', 'png'])
+    parser.add_argument('--shard_size', type=int, default=100000,
+                        help="Images per .npy shard")
+    parser.add_argument('--num_writer', type=int, default=4)
+    parser.add_argument('--c_disc', type=str, default='',
+                        help="Comma separated category per discrete code, r: random")
+    parser.add_argument('--c_cont', type=str, default='',
+                        help="Comma separated value per continuous code, r: random")
+    parser.add_argument('--raw_weights', action='store_true',
+                        help="Use the trained G weights instead of their moving average (--ema)")
+    parser.add_argument('--gpu_id', type=int, default=-1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.gpu_id >= 0 and torch.cuda.is_available():
+        device = torch.device(args.gpu_id)
+    else:
+        device = torch.device('cpu')
+    sampler = Sampler(args.checkpoint, device, not args.raw_weights)
+    # Checked before any output is written
+    try:
+        c_disc = parse_codes(args.c_disc, int)
+        c_cont = parse_codes(args.c_cont, float)
+        sampler.check_codes(c_disc, c_cont)
+    except ValueError as e:
+        raise SystemExit(f'sample.py: error: {e}')
+    if args.format == 'npy':
+        writer = NpyShardWriter(args.out_dir, args.num_images, args.shard_size)
+    else:
+        writer = PNGWriter(args.out_dir)
+    run(sampler, writer, args.num_images, args.chunk_size, args.num_writer, c_disc, c_cont)
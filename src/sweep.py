@@ -0,0 +1,270 @@
+import os
+import csv
+import json
+import time
+import random
+import argparse
+import itertools
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from config import parser as config_parser
+from data_loader import load_dataset, TensorBatchLoader
+
+'''
+Hyperparameter Sweep Runner
+
+Spec (JSON):
+{
+    "method": "grid" | "random",
+    "num_trials": 20,                  (random only)
+    "seed": 0,
+    "params": {
+        "lambda_cont": [0.05, 0.1, 0.2],                 (choice)
+        "lr_G": {"low": 1e-4, "high": 1e-2, "log": true},  (random only)
+        "dim_z": {"low": 32, "high": 128, "int": true}     (random only)
+    }
+}
+Every trial is a config.py configuration: base arguments from the command line,
+overridden by the sampled parameters.
+'''
+
+# Shared by all trials of a worker process, set by _init_worker
+_dataset = {}
+
+# Logged losses scaled by a hyperparameter (Trainer._loss_info), they can't rank trials
+# that differ in it: a smaller lambda gives a smaller loss whatever the samples look like
+WEIGHTED_METRICS = {'I': ('lambda_disc', 'lambda_cont'),
+                    'I_d': ('lambda_disc',), 'I_c': ('lambda_cont',)}
+
+
+def check_metric(metric, params, reason='swept'):
+    '''
+    Raises ValueError if metric is scaled by one of the swept (or otherwise varying) params
+    '''
+    prefix = metric if metric in WEIGHTED_METRICS else metric.rsplit('_', 1)[0]
+    for name in WEIGHTED_METRICS.get(prefix, ()):
+        if name in params:
+            raise ValueError(f'Metric {metric} is scaled by {name}, which is {reason}, '
+                             f'use an unweighted metric such as G')
+    return
+
+
+def expand_spec(spec):
+    '''
+    Returns a list of {param: value} dicts, one per trial
+    '''
+    params = spec['params']
+    if spec.get('method', 'grid') == 'grid':
+        for name, values in params.items():
+            if not isinstance(values, list):
+                raise ValueError(f'Grid search needs a list of values for {name}')
+        names = list(params.keys())
+        return [dict(zip(names, values))
+                for values in itertools.product(*[params[n] for n in names])]
+
+    rng = random.Random(spec.get('seed', 0))
+    trials = []
+    for _ in range(spec['num_trials']):
+        trial = {}
+        for name, values in params.items():
+            if isinstance(values, list):
+                trial[name] = rng.choice(values)
+            elif values.get('int', False):
+                trial[name] = rng.randint(values['low'], values['high'])
+            elif values.get('log', False):
+                trial[name] = float(np.exp(rng.uniform(
+                    np.log(values['low']), np.log(values['high']))))
+            else:
+                trial[name] = rng.uniform(values['low'], values['high'])
+        trials.append(trial)
+    return trials
+
+
+class MedianStopper(object):
+    '''Median stopping rule: stop a trial whose metric is worse than the median
+    of the other trials at the same report, after min_reports reports.
+
+    Reports of all trials live in a Manager dict shared by the worker processes.
+    '''
+
+    def __init__(self, reports, trial_id, metric, min_reports):
+        self.reports = reports
+        self.trial_id = trial_id
+        self.metric = metric
+        self.min_reports = min_reports
+        self.history = []
+
+    def __call__(self, trainer, epoch, step, values):
+        value = float(np.mean(values[self.metric]))
+        if not np.isfinite(value):
+            print(f'[Trial {self.trial_id}] {self.metric} is not finite, stopping')
+            trainer.stop_training = True
+            return
+        self.history.append(value)
+        self.reports[self.trial_id] = list(self.history)
+
+        n = len(self.history)
+        if n < self.min_reports:
+            return
+        # Trials running behind or stopped early don't take part at this report
+        others = [h[n - 1] for k, h in self.reports.items()
+                  if k != self.trial_id and len(h) >= n]
+        if len(others) > 0 and value > np.median(others):
+            print(f'[Trial {self.trial_id}] {self.metric} {value:.4f} > median '
+                  f'{np.median(others):.4f} of {len(others)} trials, stopping')
+            trainer.stop_training = True
+        return
+
+
+class FinalMetrics(object):
+    '''Keeps the mean of each metric over the last log window'''
+
+    def __init__(self):
+        self.values = {}
+
+    def __call__(self, trainer, epoch, step, values):
+        self.values = {name: float(np.mean(v)) for name, v in values.items()}
+        self.values['epoch'] = epoch + 1
+        self.values['step'] = step
+        return
+
+
+def _init_worker(images, labels, num_threads):
+    # images / labels are shared memory tensors, passed by handle, not copied
+    torch.set_num_threads(num_threads)
+    _dataset['images'] = images.numpy()
+    _dataset['labels'] = labels.numpy()
+
+
+def run_trial(trial_id, base_args, params, sweep_name, median_stop, reports):
+    from trainer import Trainer
+
+    config = config_parser.parse_args(base_args)
+    for name, value in params.items():
+        setattr(config, name, value)
+    config.model_name = f'{sweep_name}_trial_{trial_id:03d}'
+    config.use_visdom = False
+
+    torch.manual_seed(trial_id)
+    device = torch.device(config.gpu_id) if config.gpu_id >= 0 and \
+        torch.cuda.is_available() else torch.device('cpu')
+    data_loader = TensorBatchLoader(_dataset['images'], _dataset['labels'],
+                                    config.batch_size, device,
+                                    shuffle=True, drop_last=config.drop_last)
+
+    start_time = time.time()
+    trainer = Trainer(config, data_loader)
+    final = FinalMetrics()
+    trainer.add_callback(final)
+    if median_stop is not None:
+        trainer.add_callback(MedianStopper(reports, trial_id, **median_stop))
+    trainer.train()
+
+    result = {'trial': trial_id}
+    result.update(params)
+    result.update(final.values)
+    result['stopped'] = trainer.stop_training
+    result['time'] = time.time() - start_time
+    return result
+
+
+def write_results(results, path):
+    columns = []
+    for result in results:
+        columns += [k for k in result.keys() if k not in columns]
+    with open(path, 'w', newline='') as fp:
+        writer = csv.DictWriter(fp, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(results)
+    return
+
+
+def print_results(results, metric, params):
+    print('==========')
+    print(f"{'trial':>5} " + ' '.join(f'{p:>12}' for p in params) +
+          f" {metric:>10} {'epoch':>5} {'stopped':>7} {'time(s)':>8}")
+    for result in sorted(results, key=lambda r: r.get(metric, float('inf'))):
+        print(f"{result['trial']:>5} " +
+              ' '.join(f'{result[p]:>12.5g}' for p in params) +
+              f" {result.get(metric, float('nan')):>10.4f} {result.get('epoch', 0):>5}"
+              f" {str(result['stopped']):>7} {result['time']:>8.1f}")
+    return
+
+
+def run_sweep(spec, base_args, num_process, num_threads, sweep_name,
+              median_stop=None, metric='G'):
+    check_metric(metric, spec['params'])
+    trials = expand_spec(spec)
+    config = config_parser.parse_args(base_args)
+
+    # Decode once, every worker maps the same shared memory block
+    images, labels = load_dataset(config)
+    images = torch.from_numpy(np.array(images)).share_memory_()
+    labels = torch.from_numpy(np.array(labels)).share_memory_()
+
+    print(f'Sweep {sweep_name}: {len(trials)} trials on {num_process} processes '
+          f'x {num_threads} threads')
+    start_time = time.time()
+    results = []
+    # spawn: forking a process that already runs torch threads is unsafe
+    context = mp.get_context('spawn')
+    with context.Manager() as manager:
+        reports = manager.dict()
+        with ProcessPoolExecutor(max_workers=num_process, mp_context=context,
+                                 initializer=_init_worker,
+                                 initargs=(images, labels, num_threads)) as pool:
+            futures = {pool.submit(run_trial, i, base_args, params, sweep_name,
+                                   median_stop, reports): i
+                       for i, params in enumerate(trials)}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    print(f'[Trial {futures[future]}] failed: {e.__class__.__name__}: {e}')
+                    results.append({'trial': futures[future], 'stopped': True,
+                                    'time': float('nan'), **trials[futures[future]]})
+    results.sort(key=lambda r: r['trial'])
+
+    save_dir = os.path.join(config.project_root, 'results', sweep_name)
+    os.makedirs(save_dir, exist_ok=True)
+    write_results(results, os.path.join(save_dir, 'results.csv'))
+    with open(os.path.join(save_dir, 'spec.json'), 'w') as fp:
+        json.dump({'spec': spec, 'base_args': base_args}, fp, indent=4)
+    print_results(results, metric, list(spec['params'].keys()))
+    print(f'Sweep wall-clock: {time.time() - start_time:.1f}s, '
+          f"results in {os.path.join(save_dir, 'results.csv')}")
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description='Unknown arguments are passed to every trial as config.py arguments')
+    parser.add_argument('--spec', type=str, required=True,
+                        help="JSON sweep spec file")
+    parser.add_argument('--num_process', type=int, default=0,
+                        help="Concurrent trials (0: number of cores / num_thread)")
+    parser.add_argument('--num_thread', type=int, default=1,
+                        help="Intra-op threads per trial")
+    parser.add_argument('--sweep_name', type=str, default='sweep')
+    parser.add_argument('--metric', type=str, default='G',
+                        help="Metric name (lower is better) for the results table and median stopping, "
+                             "must not be scaled by a swept parameter (I, I_d, I_c: lambda_*)")
+    parser.add_argument('--median_stop', type=str, default='false',
+                        help="Stop trials worse than the median of the others (true / false)")
+    parser.add_argument('--min_reports', type=int, default=5,
+                        help="Log steps reported before a trial can be stopped")
+    return parser.parse_known_args()
+
+
+if __name__ == "__main__":
+    args, base_args = get_args()
+    with open(args.spec) as fp:
+        spec = json.load(fp)
+    num_process = args.num_process or max(1, (os.cpu_count() or 1) // args.num_thread)
+    median_stop = None
+    if args.median_stop.lower() in ('true', '1'):
+        median_stop = {'metric': args.metric, 'min_reports': args.min_reports}
+    run_sweep(spec, base_args, num_process, args.num_thread,
+              args.sweep_name + str(time.time())[-4:], median_stop, args.metric)
@@ -1,16 +1,21 @@
 import os
 import torch
-import numpy as np
 import time
 import datetime
 import itertools
-import torchvision.utils as vutils
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
 from utils import *
-# from models.mnist.discriminator import Discriminator
-# from models.mnist.generator import Generator
-from models.mnist_modified.discriminator import Discriminator
-from models.mnist_modified.generator import Generator
-torch.autograd.set_detect_anomaly(True)
+from latent import LatentSampler
+from publisher import VisdomPublisher
+from engine import compile_module
+from checkpoint import CheckpointManager, get_rng_state, set_rng_state
+from data_loader import set_loader_epoch, get_data_shape
+from profiler import StepProfiler, parse_step_range
+from models import create_models
+from traversal import grid_latents
+from ema import ModelEMA
+from controller import ScheduleController, control_enabled
 
 
 class Trainer:
@@ -30,24 +35,249 @@ class Trainer:
         self.num_epoch = config.num_epoch
         self.lambda_disc = config.lambda_disc
         self.lambda_cont = config.lambda_cont
+        self.D_every = config.D_every
         self.log_step = config.log_step
+        self.save_step = config.save_step
         self.project_root = config.project_root
         self.model_name = config.model_name
         self.use_visdom = config.use_visdom
+        self.fused_D = config.fused_D
+        self.amp = config.amp
+        self.compile = config.compile
+        self.debug_anomaly = config.debug_anomaly
+        self.nan_check_step = config.nan_check_step
+        self.sync_bn = config.sync_bn
+        self.data_shape = get_data_shape(config)
+
+        # Set when launched with --world_size > 1 (see main.main_worker)
+        self.distributed = dist.is_available() and dist.is_initialized()
+        self.rank = dist.get_rank() if self.distributed else 0
+        self.world_size = dist.get_world_size() if self.distributed else 1
+        # Logging, plots, images and checkpoints come from rank 0 only
+        self.is_main = self.rank == 0
+        self.use_visdom = self.use_visdom and self.is_main
 
         self.data_loader = data_loader
-        self.img_list = {}
+        self.animations = {}
+        self.renderer = ImageRenderer(config)
+        self.start_epoch = 0
+        self.step = 0
+        self.fixed_z_dict = None
+        # Called with (trainer, epoch, step, metric values) at every log_step,
+        # a callback ends training by setting trainer.stop_training
+        self.callbacks = []
+        self.stop_training = False
+        # Process start time (set by main), time to first step is printed once
+        self.launch_time = None
+        # Results of the background evaluations collected so far (see evaluation.py)
+        self.eval_results = []
         self._set_device(self.gpu_id)
+        self._set_sampler()
+        self._set_losses()
         self.build_models()
+        self.build_optimizers()
+        self._set_ema(config)
+        self._set_checkpoints(config)
+        self._set_debug()
+        self._set_metrics()
+        self._set_profiler(config)
+        self._set_evaluator(config)
+        self._set_controller(config)
+        self._set_amp()
+        self._set_engine()
         if self.use_visdom:
             self._set_plotter(config)
             self._set_logger()
 
     def _set_device(self, gpu_id):
-        self.device = torch.device(gpu_id)
+        # One device per process, rank r uses gpu_id + r
+        self.device = get_device(gpu_id + self.rank if gpu_id >= 0 else gpu_id)
+
+    def _report_startup(self):
+        if self.launch_time is not None and self.is_main:
+            print(f'Time to first step: {time.time() - self.launch_time:.2f}s')
+        self.launch_time = None
+        return
+
+    def _set_checkpoints(self, config):
+        save_dir = os.path.join(
+            self.project_root, f'results/{self.model_name}/checkpoint')
+        self.checkpoints = CheckpointManager(save_dir, config.keep_last)
+
+    def _set_debug(self):
+        # Anomaly detection records a stack trace for every op, debug runs only
+        torch.autograd.set_detect_anomaly(self.debug_anomaly)
+        self.nan_checker = None
+        if self.nan_check_step > 0:
+            self.nan_checker = NonFiniteChecker(self.nan_check_step)
+            self.nan_checker.register(self.G, 'G')
+            self.nan_checker.register(self.D, 'D')
+
+    def _set_profiler(self, config):
+        # Timing marks are no-ops unless --profile is set
+        self.profiler = StepProfiler(
+            config.profile and self.is_main, self.device,
+            os.path.join(self.project_root, f'results/{self.model_name}/profile'),
+            parse_step_range(config.profile_trace) if self.is_main else None)
+
+    def _set_ema(self, config):
+        # Rank 0 renders, evaluates and saves, the other ranks don't need the average
+        self.ema = None
+        if config.ema and self.is_main:
+            self.ema = ModelEMA(self.G, config.ema_decay, config.ema_every, config.ema_bn)
+
+    def _G_export(self):
+        '''
+        G used for images and evaluation: the average if there is one, with BN statistics ready
+        '''
+        if self.ema is None:
+            return self.G
+        self.ema.refresh_bn(lambda: self._sample()[0], self.config.ema_bn_batches)
+        return self.ema.model
+
+    def _generate_fixed(self, G, z):
+        # Eval mode: BatchNorm uses its running statistics, images of one key don't depend
+        # on the other keys of the stacked batch and the statistics are left untouched
+        training = G.training
+        G.eval()
+        with torch.no_grad():
+            images = G(z).cpu()
+        G.train(training)
+        return images
+
+    def _set_evaluator(self, config):
+        # Only imported when used, evaluation runs in its own process
+        self.evaluator = None
+        if config.eval_step > 0 and self.is_main:
+            from evaluation import Evaluator
+            self.evaluator = Evaluator(config)
+
+    def _collect_evaluations(self, block=False):
+        if self.evaluator is None:
+            return
+        from evaluation import format_metrics
+        results = self.evaluator.close() if block else self.evaluator.collect()
+        for result in results:
+            print(f"Evaluation of epoch {result['epoch']} (step {result['step']}, "
+                  f"{result['time']:.1f}s): {format_metrics(result)}")
+            if self.use_visdom:
+                self.plotter.plot_line('FID', 'fid', 'Evaluation FID',
+                                       [result['step']], [result['fid']])
+                self.plotter.plot_line('MI accuracy', 'mi_acc', 'Evaluation c_disc accuracy',
+                                       [result['step']], [result['mi_acc']])
+        self.eval_results.extend(results)
+        return
+
+    def _set_controller(self, config):
+        # Runs as a callback on rank 0, decisions reach the other ranks in _sync_control
+        self.controller = None
+        if control_enabled(config) and self.is_main:
+            self.controller = ScheduleController(self, config)
+            self.add_callback(self.controller)
+
+    def _set_amp(self):
+        # bfloat16 has the fp32 exponent range, loss scaling is only needed for float16
+        self.scaler = None
+        if self.amp and self.device.type == 'cuda':
+            self.scaler = torch.cuda.amp.GradScaler()
+
+    def _set_engine(self):
+        # G_exec / D_exec run the hot loop, self.G / self.D hold parameters and state
+        self.G_exec, self.D_exec = self.G, self.D
+        if self.distributed:
+            # Gradients are averaged across processes during backward.
+            # D is called with heads='D' (Q heads unused) in the D update
+            device_ids = [self.device] if self.device.type == 'cuda' else None
+            self.G_exec = DistributedDataParallel(self.G, device_ids=device_ids)
+            self.D_exec = DistributedDataParallel(
+                self.D, device_ids=device_ids, find_unused_parameters=True)
+        if self.compile == 'eager':
+            return
+        z, _ = self.sampler.sample(self.batch_size)
+        self.G.eval()
+        with torch.no_grad():
+            x = self.G(z)
+        self.G.train()
+        # The D update calls of the training loop, then the G / Q update call
+        D_calls = [((torch.cat((x, x)),), {'heads': 'D', 'num_splits': 2})] if self.fused_D \
+            else [((x,), {'heads': 'D'})]
+        with autocast(self.device, self.amp):
+            self.G_exec, backend_G, time_G = compile_module(
+                self.G_exec, self.compile, [((z,), {})])
+            self.D_exec, backend_D, time_D = compile_module(
+                self.D_exec, self.compile, D_calls + [((x,), {})])
+        if self.is_main:
+            print(f'Compile time (excluded from step time): G ({backend_G}) {time_G:.2f}s, '
+                  f'D ({backend_D}) {time_D:.2f}s')
+
+    def _set_losses(self):
+        self.adversarial_loss = torch.nn.BCELoss()
+        self.info_loss = InfoLoss()
+
+    def _loss_D(self, prob_real, prob_fake):
+        label_real = torch.ones_like(prob_real)
+        label_fake = torch.zeros_like(prob_fake)
+        loss_D_real = self.adversarial_loss(prob_real, label_real)
+        loss_D_fake = self.adversarial_loss(prob_fake, label_fake)
+        return loss_D_real + loss_D_fake
+
+    def _loss_info(self, prob_fake, disc_logits, mu, logvar, z, idx, lambda_disc, lambda_cont):
+        '''
+        Returns loss_info, loss_G, loss_c_disc [n_c_disc] and loss_c_cont [dim_c_cont]
+        '''
+        loss_G = self.adversarial_loss(prob_fake, torch.ones_like(prob_fake))
+
+        # Calculate loss for all discrete and continuous latent codes at once
+        loss_c_disc, loss_c_cont = self.info_loss(
+            disc_logits, idx, self.sampler.c_cont(z), mu, logvar)
+        loss_c_disc = loss_c_disc * lambda_disc
+        loss_c_cont = loss_c_cont * lambda_cont
+
+        loss_info = loss_G + loss_c_disc.sum() + loss_c_cont.sum()
+        return loss_info, loss_G, loss_c_disc, loss_c_cont
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+        return
+
+    def _sync_control(self):
+        # Callbacks run on rank 0, every rank has to leave the loop at the same step
+        # and train with the same schedule
+        if self.distributed:
+            state = torch.tensor([float(self.stop_training), self.D_every, self.lambda_disc,
+                                  self.lambda_cont, self.optim_G.param_groups[0]['lr'],
+                                  self.optim_D.param_groups[0]['lr']], dtype=torch.float64)
+            dist.broadcast(state, 0)
+            stop_training, D_every, self.lambda_disc, self.lambda_cont, lr_G, lr_D = \
+                state.tolist()
+            self.stop_training = bool(stop_training)
+            self.D_every = int(D_every)
+            for optimizer, lr in [(self.optim_G, lr_G), (self.optim_D, lr_D)]:
+                for group in optimizer.param_groups:
+                    group['lr'] = lr
+        return
+
+    def _backward(self, loss):
+        if self.scaler is not None:
+            loss = self.scaler.scale(loss)
+        loss.backward()
+
+    def _step(self, optimizer):
+        if self.scaler is not None:
+            self.scaler.step(optimizer)
+        else:
+            optimizer.step()
+
+    def _set_metrics(self):
+        # Order matches the tensors passed to self.metrics.write in train
+        names = ['G', 'D', 'I', 'I_d', 'P_d_real', 'P_d_fake', 'P_g_fake',
+                 'I_c_total'] + [f'I_c_{i+1}' for i in range(self.dim_c_cont)] + \
+            [f'I_d_{j+1}' for j in range(self.n_c_disc)]
+        self.metrics = MetricAccumulator(names)
 
     def _set_plotter(self, config):
-        self.plotter = VisdomPlotter(config)
+        # Plot events are sent from a background thread, never from the training loop
+        self.plotter = VisdomPublisher(config)
 
     def _set_logger(self):
         self.logger = Logger()
@@ -56,6 +286,10 @@ class Trainer:
         self.logger.create_target('Loss_D', 'D', 'Discriminator Loss')
         self.logger.create_target('Loss_Info', 'I', 'Info(G+L_d+L_c) Loss')
         self.logger.create_target('Loss_Disc', 'I_d', 'Discrete Code Loss')
+        if self.n_c_disc > 1:
+            for j in range(self.n_c_disc):
+                self.logger.create_target(
+                    'Loss_Disc', f'I_d_{j+1}', 'Discrete Code Loss')
         self.logger.create_target(
             'Prob_D', 'P_d_real', 'Prob of D for real / fake sample')
         self.logger.create_target(
@@ -68,87 +302,66 @@ class Trainer:
 
         return
 
-    def _sample(self):
-        # Sample Z from N(0,1)
-        z = torch.randn(self.batch_size, self.dim_z, device=self.device)
-
-        # Sample discrete latent code from Cat(K=dim_c_disc)
-        idx = np.zeros((self.n_c_disc, self.batch_size))
-        c_disc = torch.zeros(self.batch_size, self.n_c_disc,
-                             self.dim_c_disc, device=self.device)
-        for i in range(self.n_c_disc):
-            idx[i] = np.random.randint(self.dim_c_disc, size=self.batch_size)
-            c_disc[torch.arange(0, self.batch_size), i, idx[i]] = 1.0
-
-        # Sample continuous latent code from Unif(-1,1)
-        c_cond = torch.rand(self.batch_size, self.dim_c_cont,
-                            device=self.device) * 2 - 1
-
-        # Concat z, c_disc, c_cond
-        for i in range(self.n_c_disc):
-            z = torch.cat((z, c_disc[:, i, :].squeeze()), dim=1)
-        z = torch.cat((z, c_cond), dim=1)
-
-        return z, idx
+    def _set_sampler(self):
+        self.sampler = LatentSampler(self.dim_z, self.n_c_disc, self.dim_c_disc,
+                                     self.dim_c_cont, self.device)
+        # Reused by every _sample call, z is consumed within the training step
+        self.latent_buffer = None
+
+    def _sample(self, batch_size=None):
+        # Sample z, c_disc, c_cont in one batched call on self.device
+        if batch_size is None:
+            batch_size = self.batch_size
+        if self.latent_buffer is None or len(self.latent_buffer) < batch_size:
+            self.latent_buffer = torch.empty(
+                batch_size, self.sampler.dim_latent, device=self.device)
+        # The smaller last batch of an epoch uses the leading rows
+        return self.sampler.sample(batch_size, out=self.latent_buffer[:batch_size])
 
     def _sample_fixed_noise(self):
-        # Sample Z from N(0,1)
+        '''
+        One grid per (discrete code i, continuous code k): rows are the categories of code i,
+        columns 10 values of code k over [-1, 1], other codes at category 0 / value 0.
+        Every image has its own noise, shared across grids.
+        '''
         fixed_z = torch.randn(self.dim_c_disc*10, self.dim_z)
-
-        # For each discrete variable, fix other discrete variable to 0 and random sample other variables.
-        idx = np.arange(self.dim_c_disc).repeat(10)
-
-        c_disc_list = []
-        for i in range(self.n_c_disc):
-            zero_template = torch.zeros(
-                self.dim_c_disc*10, self.n_c_disc, self.dim_c_disc)
-            # Set all the other discrete variable to Zero([1,0,...,0])
-            for ii in range(self.n_c_disc):
-                if (i == ii):
-                    pass
-                else:
-                    zero_template[:, ii, 0] = 1.0
-            for j in range(len(idx)):
-                zero_template[np.arange(self.dim_c_disc*10), i, idx] = 1.0
-            c_disc_list.append(zero_template)
-
-        # Random sample continuous variables
-        c_rand = torch.rand(self.dim_c_disc * 10, self.dim_c_cont) * 2 - 1
         c_range = torch.linspace(start=-1, end=1, steps=10)
-
-        c_range_list = []
-        for i in range(self.dim_c_disc):
-            c_range_list.append(c_range)
-        c_range = torch.cat(c_range_list, dim=0)
-
-        c_cont_list = []
-        for i in range(self.dim_c_cont):
-            c_zero = torch.zeros(self.dim_c_disc * 10, self.dim_c_cont)
-            c_zero[:, i] = c_range
-            c_cont_list.append(c_zero)
-
         fixed_z_dict = {}
-        for idx_c_disc in range(len(c_disc_list)):
-            for idx_c_cont in range(len(c_cont_list)):
-                z = fixed_z.clone()
-                for j in range(self.n_c_disc):
-                    z = torch.cat(
-                        (z, c_disc_list[idx_c_disc][:, j, :].squeeze()), dim=1)
-                z = torch.cat((z, c_cont_list[idx_c_cont]), dim=1)
-                fixed_z_dict[(idx_c_disc, idx_c_cont)] = z
+        for idx_c_disc in range(self.n_c_disc):
+            for idx_c_cont in range(self.dim_c_cont):
+                fixed_z_dict[(idx_c_disc, idx_c_cont)] = grid_latents(
+                    self.sampler, [('disc', idx_c_disc, None), ('cont', idx_c_cont, c_range)],
+                    fixed_z)[0]
         return fixed_z_dict
 
     def build_models(self):
         # Initiate Models
-        self.G = Generator(self.dim_z, self.n_c_disc, self.dim_c_disc,
-                           self.dim_c_cont).to(self.device)
-        self.D = Discriminator(self.n_c_disc, self.dim_c_disc,
-                               self.dim_c_cont).to(self.device)
+        # Architecture of config.dataset / config.model_variant, sized for the data shape
+        self.G, self.D = create_models(self.config, self.data_shape)
+        self.G.to(self.device)
+        self.D.to(self.device)
 
         # Initialize
         self.G.apply(weights_init_normal)
         self.D.apply(weights_init_normal)
 
+        if self.sync_bn and self.distributed:
+            if self.device.type == 'cuda':
+                # Before the optimizers are built, they hold the converted parameters
+                self.G = torch.nn.SyncBatchNorm.convert_sync_batchnorm(self.G)
+                self.D = torch.nn.SyncBatchNorm.convert_sync_batchnorm(self.D)
+            elif self.is_main:
+                print('SyncBatchNorm requires CUDA, keeping per-process BatchNorm')
+
+        return
+
+    def build_optimizers(self):
+        # Set opitmizers
+        self.optim_G = self.set_optimizer([self.G.parameters(), self.D.module_Q.parameters(
+        ), self.D.latent_disc.parameters(), self.D.latent_cont_mu.parameters()], lr=self.lr_G)
+        self.optim_D = self.set_optimizer(
+            [self.D.module_shared.parameters(), self.D.module_D.parameters()], lr=self.lr_D)
+
         return
 
     def set_optimizer(self, param_list, lr):
@@ -160,160 +373,262 @@ class Trainer:
         else:
             raise NotImplementedError
 
-    def save_model(self, epoch):
-        save_dir = os.path.join(
-            self.project_root, f'results/{self.model_name}/checkpoint')
-        os.makedirs(save_dir, exist_ok=True)
+    def _get_animation(self, idx_c_disc, idx_c_cont):
+        key = (idx_c_disc, idx_c_cont)
+        if key not in self.animations:
+            save_dir = os.path.join(
+                self.project_root, f'results/{self.model_name}/gifs')
+            self.animations[key] = AnimationWriter(
+                f'{save_dir}/{self.model_name}-Cd_{idx_c_disc+1}-Cc_{idx_c_cont+1}.gif')
+        return self.animations[key]
 
-        # Save network weights.
-        torch.save({
+    def save_model(self, epoch):
+        # Snapshot is copied to CPU here, serialized and written on a background thread
+        self.checkpoints.save({
             'Generator': self.G.state_dict(),
             'Discriminator': self.D.state_dict(),
-            'configuations': self.config
-        }, f'{save_dir}/Epoch_{epoch}.pth')
+            'Generator_EMA': self.ema.state_dict() if self.ema is not None else None,
+            'controller': self.controller.state_dict(self)
+            if self.controller is not None else None,
+            'configuations': self.config,
+            'optim_G': self.optim_G.state_dict(),
+            'optim_D': self.optim_D.state_dict(),
+            'epoch': epoch,
+            'step': self.step,
+            'fixed_z_dict': self.fixed_z_dict,
+            'rng_state': get_rng_state(),
+        }, f'Epoch_{epoch}.pth')
 
         return
 
-    def train(self):
-        # Set opitmizers
-        optim_G = self.set_optimizer([self.G.parameters(), self.D.module_Q.parameters(
-        ), self.D.latent_disc.parameters(), self.D.latent_cont_mu.parameters()], lr=self.lr_G)
-        optim_D = self.set_optimizer(
-            [self.D.module_shared.parameters(), self.D.module_D.parameters()], lr=self.lr_D)
-
-        # Loss functions
-        adversarial_loss = torch.nn.BCELoss()
-        categorical_loss = torch.nn.CrossEntropyLoss()
-        continuous_loss = NLL_gaussian()
+    def resume(self, checkpoint):
+        '''
+        Restore models, optimizers, counters, fixed noise and RNG states
+        from a checkpoint saved by save_model
+        '''
+        self.G.load_state_dict(checkpoint['Generator'])
+        self.D.load_state_dict(checkpoint['Discriminator'])
+        self.optim_G.load_state_dict(checkpoint['optim_G'])
+        self.optim_D.load_state_dict(checkpoint['optim_D'])
+        self.start_epoch = checkpoint['epoch']
+        self.step = checkpoint['step']
+        self.fixed_z_dict = checkpoint['fixed_z_dict']
+        if self.ema is not None:
+            if checkpoint.get('Generator_EMA') is not None:
+                self.ema.load_state_dict(checkpoint['Generator_EMA'])
+            else:
+                # Start the average from the resumed weights
+                self._set_ema(self.config)
+        if self.controller is not None and checkpoint.get('controller') is not None:
+            self.controller.load_state_dict(self, checkpoint['controller'])
+        set_rng_state(checkpoint['rng_state'])
+        if self.distributed:
+            # Ranks must not draw identical latent codes
+            torch.manual_seed(torch.initial_seed() + self.rank)
+        if self.is_main:
+            print(f'Resumed from epoch {self.start_epoch}, step {self.step}')
+        return
 
-        # Sample fixed latent codes for comparison
-        fixed_z_dict = self._sample_fixed_noise()
+    def train(self):
+        optim_G = self.optim_G
+        optim_D = self.optim_D
+
+        # Sample fixed latent codes for comparison (restored on resume)
+        if self.fixed_z_dict is None:
+            self.fixed_z_dict = self._sample_fixed_noise()
+        fixed_z_dict = self.fixed_z_dict
+        # Stacked once so every epoch renders all keys with a single G forward
+        fixed_keys = list(fixed_z_dict.keys())
+        fixed_z_all = torch.cat([fixed_z_dict[key]
+                                 for key in fixed_keys]).to(self.device)
 
         start_time = time.time()
         num_steps = len(self.data_loader)
-        step = 0
-        log_target = {}
-        for epoch in range(self.num_epoch):
+        step = self.step
+        for epoch in range(self.start_epoch, self.num_epoch):
             epoch_start_time = time.time()
             step_epoch = 0
+            set_loader_epoch(self.data_loader, epoch)
             for i, (data, _) in enumerate(self.data_loader, 0):
+                self.profiler.begin(step)
 
                 if (data.size()[0] != self.batch_size):
                     self.batch_size = data.size()[0]
 
                 data_real = data.to(self.device)
+                self.profiler.mark('h2d')
+                if self.nan_checker is not None:
+                    self.nan_checker.set_step(step)
 
                 # Update Discriminator
                 # Reset optimizer
                 optim_D.zero_grad()
 
-                # Calculate Loss D(real)
-                prob_real, _, _, _ = self.D(data_real)
-                label_real = torch.full(
-                    (self.batch_size,), 1, device=self.device)
-                loss_D_real = adversarial_loss(prob_real, label_real)
-
-                # Calculate gradient -> grad accums to module_shared / modue_D
-                loss_D_real.backward()
-
-                # calculate Loss D(fake)
                 # Sample noise, latent codes
                 z, idx = self._sample()
-                data_fake = self.G(z)
-                prob_fake_D, _, _, _ = self.D(data_fake.detach())
-                label_fake = torch.full(
-                    (self.batch_size,), 0, device=self.device)
-                loss_D_fake = adversarial_loss(prob_fake_D, label_fake)
-
-                # Calculate gradient -> grad accums to module_shared / modue_D
-                loss_D_fake.backward()
-                loss_D = loss_D_real + loss_D_fake
-
-                # Update Parameters for D
-                optim_D.step()
+                self.profiler.mark('sample')
+                # D is updated every D_every steps (see controller.py), the forward
+                # always runs for the logged probabilities
+                update_D = step % self.D_every == 0
+                with autocast(self.device, self.amp):
+                    data_fake = self.G_exec(z)
+
+                # Only the adversarial head is needed for the D update
+                with autocast(self.device, self.amp), torch.set_grad_enabled(update_D):
+                    if self.fused_D:
+                        # Single D forward over [real; fake], BatchNorm statistics per half
+                        prob_D, _, _, _ = self.D_exec(
+                            torch.cat((data_real, data_fake.detach().type_as(data_real))),
+                            heads='D', num_splits=2)
+                        prob_real = prob_D[:self.batch_size]
+                        prob_fake_D = prob_D[self.batch_size:]
+                    else:
+                        prob_real, _, _, _ = self.D_exec(data_real, heads='D')
+                        prob_fake_D, _, _, _ = self.D_exec(
+                            data_fake.detach(), heads='D')
+
+                # Calculate Loss D(real), D(fake)
+                loss_D = self._loss_D(prob_real, prob_fake_D)
+                self.profiler.mark('D_forward')
+
+                if update_D:
+                    # Calculate gradient -> grad accums to module_shared / modue_D
+                    self._backward(loss_D)
+                    self.profiler.mark('D_backward')
+
+                    # Update Parameters for D
+                    self._step(optim_D)
+                    self.profiler.mark('D_step')
 
                 # Update Generator and Q
                 # Reset Optimizer
                 optim_G.zero_grad()
 
                 # Calculate loss for generator
-                prob_fake, disc_logits, mu, var = self.D(data_fake)
-                loss_G = adversarial_loss(prob_fake, label_real)
-
-                # Calculate loss for discrete latent code
-                target = torch.LongTensor(idx).to(self.device)
-                loss_c_disc = 0
-                for j in range(self.n_c_disc):
-                    loss_c_disc += categorical_loss(
-                        disc_logits[:, j, :], target[j, :])
-                loss_c_disc = loss_c_disc * self.lambda_disc
-
-                # Calculate loss for continuous latent code
-                loss_c_cont = continuous_loss(
-                    z[:, self.dim_z+self.n_c_disc*self.dim_c_disc:], mu, var).mean(0)
-
-                loss_c_cont = loss_c_cont * self.lambda_cont
-
-                loss_info = loss_G + loss_c_disc + loss_c_cont.sum()
-                loss_info.backward()
-                optim_G.step()
-
-                # write data to log target
-                if self.use_visdom:
-                    self.logger.write('s', step)
-                    self.logger.write('G', loss_G.item())
-                    self.logger.write('D', loss_D.item())
-                    self.logger.write('I', loss_info.item())
-                    self.logger.write('I_d', loss_c_disc.item())
-                    self.logger.write('P_d_real', prob_real.mean().item())
-                    self.logger.write('P_d_fake', prob_fake_D.mean().item())
-                    self.logger.write('I_c_total', loss_c_cont.sum().item())
-                    for c in range(self.dim_c_cont):
-                        self.logger.write(f'I_c_{c+1}', loss_c_cont[c].item())
+                with autocast(self.device, self.amp):
+                    prob_fake, disc_logits, mu, logvar = self.D_exec(data_fake)
+                loss_info, loss_G, loss_c_disc, loss_c_cont = self._loss_info(
+                    prob_fake, disc_logits, mu, logvar, z, idx,
+                    self.lambda_disc, self.lambda_cont)
+                self.profiler.mark('G_forward')
+                self._backward(loss_info)
+                self.profiler.mark('G_backward')
+                self._step(optim_G)
+                if self.scaler is not None:
+                    self.scaler.update()
+                self.profiler.mark('G_step')
+                if self.ema is not None:
+                    self.ema.update(step)
+                    self.profiler.mark('ema')
+
+                # Keep metrics on device, reduced with one transfer per log_step
+                if self.is_main:
+                    self.metrics.write(step, loss_G, loss_D, loss_info, loss_c_disc.sum(),
+                                       prob_real.mean(), prob_fake_D.mean(),
+                                       prob_fake.mean(), loss_c_cont.sum(), loss_c_cont,
+                                       loss_c_disc)
 
                 # Print log info
-                if (step % self.log_step == 0):
+                if (step % self.log_step == 0) and self.is_main:
+                    steps, values = self.metrics.flush()
                     if self.use_visdom:
+                        self.logger.write_batch('s', steps)
+                        for split_name in self.logger.log_target.keys():
+                            if split_name != 's':
+                                self.logger.write_batch(
+                                    split_name, values[split_name])
                         self.logger.pour_to_plotter(self.plotter)
                         self.logger.clear_data()
 
+                    last = {name: values[name][-1] for name in values}
                     print('==========')
                     print(f'Model Name: {self.model_name}')
                     print('Epoch [%d/%d], Step [%d/%d], Elapsed Time: %s \nLoss D : %.4f, Loss Info: %.4f\nLoss_Disc: %.4f Loss_Cont: %.4f Loss_Gen: %.4f'
-                          % (epoch + 1, self.num_epoch, step_epoch, num_steps, datetime.timedelta(seconds=time.time()-start_time), loss_D, loss_info.item(), loss_c_disc.item(), loss_c_cont.sum().item(), loss_G.item()))
-                    for c in range(len(loss_c_cont)):
+                          % (epoch + 1, self.num_epoch, step_epoch, num_steps, datetime.timedelta(seconds=time.time()-start_time), last['D'], last['I'], last['I_d'], last['I_c_total'], last['G']))
+                    if self.n_c_disc > 1:
+                        for c in range(self.n_c_disc):
+                            print('Loss of %dth discrete latent code: %.4f' %
+                                  (c+1, last[f'I_d_{c+1}']))
+                    for c in range(self.dim_c_cont):
                         print('Loss of %dth continuous latent code: %.4f' %
-                              (c+1, loss_c_cont[c].item()))
+                              (c+1, last[f'I_c_{c+1}']))
                     print(
-                        f'Prob_real_D:{prob_real.mean()}, Prob_fake_D:{prob_fake_D.mean()}, Prob_fake_G:{prob_fake.mean()}')
+                        f"Prob_real_D:{last['P_d_real']}, Prob_fake_D:{last['P_d_fake']}, Prob_fake_G:{last['P_g_fake']}")
+
+                    self._collect_evaluations()
+                    for callback in self.callbacks:
+                        callback(self, epoch, step, values)
+
+                if (step % self.log_step == 0):
+                    self._sync_control()
+                self.profiler.mark('logging')
+                self.profiler.end()
+                if (step % self.log_step == 0):
+                    self.profiler.summary()
+                self._report_startup()
 
                 step += 1
                 step_epoch += 1
+                self.step = step
+                if self.stop_training:
+                    break
+
+            if self.stop_training and self.is_main:
+                print(f'Training stopped at epoch {epoch+1}, step {step}')
+            if not self.is_main:
+                if self.stop_training:
+                    break
+                continue
+
+            epoch_end_time = time.time()
+            print('Epoch [%d/%d] finished, Epoch Time: %s'
+                  % (epoch + 1, self.num_epoch,
+                     datetime.timedelta(seconds=epoch_end_time-epoch_start_time)))
+
+            # Generate images from all fixed inputs at once
+            # Deferred until the first epoch end, torchvision is slow to import
+            from torchvision.utils import make_grid
+            G_export = self._G_export()
+            gen_data_all = self._generate_fixed(G_export, fixed_z_all)
+            gen_data_list = gen_data_all.split(
+                len(gen_data_all) // len(fixed_keys))
 
             # Plot and Log generated images
-            for key in fixed_z_dict.keys():
-                fixed_z = fixed_z_dict[key].to(self.device)
+            for key, imgs in zip(fixed_keys, gen_data_list):
                 idx_c_disc = key[0]
                 idx_c_cont = key[1]
 
-                # Generate and plot images from fixed inputs
-                imgs, title = plot_generated_data(
-                    self.config, self.G, fixed_z, epoch, idx_c_disc, idx_c_cont)
+                # Save images (asynchronously for the matplotlib backend)
+                title = self.renderer.render(
+                    imgs, epoch, idx_c_disc, idx_c_cont)
 
-                # collect images for animation
-                self.img_list[(epoch, key[0], key[1])] = vutils.make_grid(
-                    imgs, nrow=10, padding=2, normalize=True)
+                # Append a frame to the animation of this code pair
+                self._get_animation(idx_c_disc, idx_c_cont).append(
+                    make_grid(imgs, nrow=10, padding=2, normalize=True),
+                    f'Epoch: {epoch+1}')
 
                 # Log Image
                 if self.use_visdom:
                     self.plotter.plot_image_grid(title, imgs, title)
 
             # Save checkpoint
-            self.save_model(epoch+1)
+            if (epoch + 1) % self.save_step == 0 or epoch + 1 == self.num_epoch \
+                    or self.stop_training:
+                self.save_model(epoch+1)
+            if self.evaluator is not None and ((epoch + 1) % self.config.eval_step == 0
+                                               or epoch + 1 == self.num_epoch or self.stop_training):
+                self.evaluator.submit(G_export, self.D, epoch+1, step)
+            self.profiler.record('epoch_end', time.time() - epoch_end_time)
+            if self.stop_training:
+                break
+
+        self.renderer.close()
+        self.checkpoints.close()
+        self.profiler.close()
+        self._collect_evaluations(block=True)
 
-        # Make and save animation
-        make_animation(self.config, epoch, self.n_c_disc,
-                       self.dim_c_cont, self.img_list)
+        if self.use_visdom:
+            self.plotter.close()
         return
 
     def test(self):
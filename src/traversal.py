@@ -0,0 +1,232 @@
+import os
+import hashlib
+import argparse
+import collections
+import torch
+import torch.nn.functional as F
+from sample import Sampler
+from checkpoint import find_checkpoint
+
+'''
+Latent Traversals and Interpolations
+
+A traversal grid is the cartesian product of axes over latent codes, one row per cell
+in row-major order (the last axis varies fastest):
+
+    ('disc', j, categories)   the j-th discrete code takes each category
+    ('cont', k, values)       the k-th continuous code takes each value
+
+Codes without an axis keep their base value (category 0, value 0).
+'''
+
+
+def make_axis(text):
+    '''
+    CLI axis: 'd0' all categories of discrete code 0, 'd0:1,3' categories 1 and 3,
+    'c1' continuous code 1 over linspace(-1, 1, 10), 'c1:-2:2:7' over linspace(-2, 2, 7)
+    '''
+    name, _, args = text.partition(':')
+    kind, index = {'d': 'disc', 'c': 'cont'}[name[0]], int(name[1:])
+    if kind == 'disc':
+        return (kind, index, tuple(int(v) for v in args.split(',')) if args else None)
+    low, high, steps = (float(v) for v in args.split(':')) if args else (-1, 1, 10)
+    return (kind, index, tuple(torch.linspace(low, high, int(steps)).tolist()))
+
+
+def grid_latents(layout, axes, noise, base_disc=None, base_cont=None):
+    '''
+    layout: LatentSampler (only its dimensions are used), axes: list of (kind, index, values),
+    values None means every category of a discrete code.
+    noise: [1, dim_z] shared by all cells or [num_cells, dim_z].
+    Returns z [num_cells, dim_latent] and the grid shape.
+    '''
+    values = [torch.arange(layout.dim_c_disc) if v is None else torch.as_tensor(v)
+              for _, _, v in axes]
+    shape = tuple(len(v) for v in values)
+    num_cells = 1
+    for size in shape:
+        num_cells *= size
+
+    disc = torch.zeros(layout.n_c_disc, dtype=torch.long) if base_disc is None \
+        else torch.as_tensor(base_disc, dtype=torch.long)
+    cont = torch.zeros(layout.dim_c_cont) if base_cont is None \
+        else torch.as_tensor(base_cont, dtype=torch.float)
+    disc = disc.expand(num_cells, layout.n_c_disc).clone()
+    cont = cont.expand(num_cells, layout.dim_c_cont).clone()
+    cell = torch.arange(num_cells)
+    stride = num_cells
+    for (kind, index, _), value, size in zip(axes, values, shape):
+        stride //= size
+        position = cell // stride % size
+        if kind == 'disc':
+            disc[:, index] = value.long()[position]
+        else:
+            cont[:, index] = value.float()[position]
+
+    z = torch.empty(num_cells, layout.dim_latent)
+    z[:, :layout.start_c_disc] = noise.expand(num_cells, layout.dim_z)
+    z[:, layout.start_c_disc:layout.start_c_cont] = F.one_hot(
+        disc, layout.dim_c_disc).view(num_cells, -1).float()
+    z[:, layout.start_c_cont:] = cont
+    return z, shape
+
+
+def slerp(start, end, t):
+    '''
+    Spherical interpolation of [..., D] tensors at fractions t [T] -> [T, ..., D],
+    linear where start and end are (anti)parallel
+    '''
+    t = t.view(-1, *([1] * start.dim()))
+    cos = (F.normalize(start, dim=-1) * F.normalize(end, dim=-1)).sum(-1, keepdim=True)
+    omega = torch.acos(cos.clamp(-1, 1))
+    sin = torch.sin(omega)
+    parallel = sin.abs() < 1e-6
+    sin = torch.where(parallel, torch.ones_like(sin), sin)
+    spherical = (torch.sin((1 - t) * omega) * start + torch.sin(t * omega) * end) / sin
+    return torch.where(parallel, torch.lerp(start, end, t), spherical)
+
+
+def interpolate_latents(layout, start, end, steps, method='slerp'):
+    '''
+    [steps, dim_latent] from latent start to end. slerp moves the Gaussian noise along
+    the sphere it concentrates on, the codes are always interpolated linearly
+    '''
+    t = torch.linspace(0, 1, steps)
+    z = torch.lerp(start, end, t.view(-1, 1))
+    if method == 'slerp':
+        z[:, :layout.start_c_disc] = slerp(
+            start[:layout.start_c_disc], end[:layout.start_c_disc], t)
+    elif method != 'linear':
+        raise ValueError(f'Unknown interpolation method {method}')
+    return z
+
+
+def file_hash(path, chunk_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class LatentExplorer(object):
+    '''Traversals and interpolations of a checkpoint's Generator, generated in batches
+
+    Results are kept in an LRU cache keyed on (checkpoint hash, latent spec), so repeated
+    exploratory queries return without running G. Specs only hold hashable values: noise
+    is given by seed, axes as tuples. Returned tensors are shared with the cache, copy
+    them before modifying them in place.
+    '''
+
+    def __init__(self, checkpoint_path, device='cpu', cache_size=64, chunk_size=4096,
+                 use_ema=True):
+        path = find_checkpoint(checkpoint_path)
+        self.sampler = Sampler(path, device, use_ema)
+        self.layout = self.sampler.latent
+        self.checkpoint_hash = file_hash(path)
+        self.use_ema = use_ema
+        self.cache_size = cache_size
+        self.chunk_size = chunk_size
+        self.cache = collections.OrderedDict()
+
+    def generate(self, z):
+        '''
+        Images [N, C, H, W] in [0, 1] on CPU for latents z [N, dim_latent], chunk by chunk
+        '''
+        inference_mode = getattr(torch, 'inference_mode', torch.no_grad)
+        with inference_mode():
+            return torch.cat([self.sampler.G(chunk.to(self.sampler.device)).cpu()
+                              for chunk in z.split(self.chunk_size)])
+
+    def noise(self, seed, num=1):
+        generator = torch.Generator()
+        generator.manual_seed(seed)
+        return torch.randn(num, self.layout.dim_z, generator=generator)
+
+    def traverse(self, axes, seed=0, per_cell_noise=False, base_disc=None, base_cont=None):
+        '''
+        Images [*grid shape, C, H, W] of the traversal grid, one noise vector for all cells
+        or one per cell (per_cell_noise)
+        '''
+        axes = tuple((kind, index, None if v is None else tuple(v)) for kind, index, v in axes)
+        key = ('traverse', axes, seed, per_cell_noise,
+               None if base_disc is None else tuple(base_disc),
+               None if base_cont is None else tuple(base_cont))
+
+        def build():
+            num_cells = 1
+            if per_cell_noise:
+                for _, _, v in axes:
+                    num_cells *= self.layout.dim_c_disc if v is None else len(v)
+            z, shape = grid_latents(self.layout, axes, self.noise(seed, num_cells),
+                                    base_disc, base_cont)
+            images = self.generate(z)
+            return images.view(shape + images.shape[1:])
+        return self._cached(key, build)
+
+    def interpolate(self, start_seed, end_seed, steps=10, method='slerp'):
+        '''
+        Images [steps, C, H, W] between the random latents drawn with two seeds
+        '''
+        key = ('interpolate', start_seed, end_seed, steps, method)
+
+        def build():
+            start, end = [self._random_latent(seed) for seed in (start_seed, end_seed)]
+            return self.generate(interpolate_latents(self.layout, start, end, steps, method))
+        return self._cached(key, build)
+
+    def _random_latent(self, seed):
+        generator = torch.Generator()
+        generator.manual_seed(seed)
+        disc = torch.randint(self.layout.dim_c_disc, (self.layout.n_c_disc,), generator=generator)
+        cont = torch.rand(self.layout.dim_c_cont, generator=generator) * 2 - 1
+        return grid_latents(self.layout, [], self.noise(seed), disc, cont)[0][0]
+
+    def _cached(self, spec, build):
+        key = (self.checkpoint_hash, self.use_ema, spec)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        value = build()
+        self.cache[key] = value
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return value
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checkpoint', type=str, required=True)
+    parser.add_argument('--out', type=str, required=True, help="PNG of the image grid")
+    parser.add_argument('--axes', type=str, nargs='*', default=['d0', 'c0'],
+                        help="Traversal axes, e.g. d0 'd1:0,2,4' 'c0:-2:2:9', the last one is a grid row")
+    parser.add_argument('--interpolate', type=str, default='',
+                        help="start_seed:end_seed, interpolate between two random latents instead")
+    parser.add_argument('--method', type=str, default='slerp', choices=['slerp', 'linear'])
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--per_cell_noise', action='store_true')
+    parser.add_argument('--raw_weights', action='store_true',
+                        help="Use the trained G weights instead of their moving average (--ema)")
+    parser.add_argument('--gpu_id', type=int, default=-1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    import torchvision.utils as vutils
+    args = get_args()
+    device = torch.device(args.gpu_id) if args.gpu_id >= 0 and torch.cuda.is_available() \
+        else torch.device('cpu')
+    explorer = LatentExplorer(args.checkpoint, device, use_ema=not args.raw_weights)
+    if args.interpolate:
+        start_seed, end_seed = (int(v) for v in args.interpolate.split(':'))
+        images = explorer.interpolate(start_seed, end_seed, args.steps, args.method)
+        nrow = args.steps
+    else:
+        axes = [make_axis(text) for text in args.axes]
+        images = explorer.traverse(axes, args.seed, args.per_cell_noise)
+        nrow = images.shape[-4] if images.dim() > 4 else len(images)
+        images = images.view(-1, *images.shape[-3:])
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    vutils.save_image(images, args.out, nrow=nrow, padding=2, normalize=True)
+    print(f'{len(images)} images written to {args.out}')
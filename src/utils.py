@@ -1,11 +1,14 @@
 import torch
+import torch.nn.functional as F
 import numpy as np
 import os
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-import torchvision.utils as vutils
+import contextlib
 import json
-from visdom import Visdom
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# matplotlib (plotting.py), visdom, torchvision and PIL are imported where they are
+# first used, importing this module only pays for torch
 
 # Custom functions for training
 
@@ -23,6 +26,40 @@ class NLL_gaussian:
         return l
 
 
+class InfoLoss(object):
+    '''
+    Mutual information loss of the Q heads for all latent codes at once.
+    Discrete codes: cross entropy of the logits [B, n_c_disc, dim_c_disc] against
+    idx [n_c_disc, B] in one log-softmax / NLL call.
+    Continuous codes: Gaussian NLL parameterized by the log-variance,
+    0.5 * ((x - mu)^2 * exp(-logvar) + logvar + log(2 pi)), no eps or log of exp needed.
+    Returns per code losses, loss_c_disc [n_c_disc] and loss_c_cont [dim_c_cont],
+    each the mean over the batch.
+    '''
+
+    def __call__(self, disc_logits, idx, c_cont, mu, logvar):
+        B, n_c_disc, dim_c_disc = disc_logits.shape
+        loss_c_disc = F.cross_entropy(
+            disc_logits.reshape(B * n_c_disc, dim_c_disc), idx.t().reshape(-1),
+            reduction='none').view(B, n_c_disc).mean(0)
+        loss_c_cont = 0.5 * ((c_cont - mu).pow(2).mul(torch.exp(-logvar))
+                             .add(logvar).mean(0) + np.log(2 * np.pi))
+        return loss_c_disc, loss_c_cont
+
+
+def autocast(device, enabled, dtype=None):
+    '''
+    Autocast context for device (bfloat16 on CPU, float16 on CUDA), a no-op when disabled
+    '''
+    if not enabled:
+        return contextlib.ExitStack()
+    if not hasattr(torch, 'autocast'):
+        raise NotImplementedError('--amp requires torch>=1.10')
+    if dtype is None:
+        dtype = torch.bfloat16 if device.type == 'cpu' else torch.float16
+    return torch.autocast(device_type=device.type, dtype=dtype)
+
+
 def weights_init_normal(m):
     classname = m.__class__.__name__
     if classname.find("Conv") != -1:
@@ -42,6 +79,10 @@ class Logger(object):
         self.log_target[split_name]['value'].append(value)
         return
 
+    def write_batch(self, split_name, values):
+        self.log_target[split_name]['value'].extend(values)
+        return
+
     def create_target(self, name, split_name, caption):
         self.log_target[split_name] = {'caption': caption,
                                        'name': name, 'value': []}
@@ -59,11 +100,39 @@ class Logger(object):
         return
 
 
+class MetricAccumulator(object):
+    '''Keeps per-step metrics as detached device tensors, reduced with one host transfer on flush'''
+
+    def __init__(self, names):
+        self.names = names
+        self.steps = []
+        self.values = []
+
+    def write(self, step, *values):
+        # Each value is a scalar or 1-D tensor, flattened in the order of self.names
+        self.steps.append(step)
+        self.values.append(
+            torch.cat([v.detach().reshape(-1) for v in values]))
+        return
+
+    def flush(self):
+        '''
+        Returns the logged steps and a dict of name -> np.array over those steps
+        '''
+        steps = self.steps
+        values = torch.stack(self.values).float().cpu().numpy()
+        self.steps = []
+        self.values = []
+        return steps, {name: values[:, i] for i, name in enumerate(self.names)}
+
+
 class VisdomPlotter(object):
     """Plots to Visdom"""
 
     def __init__(self, config):
-        self.viz = Visdom(server=config.visdom_server)
+        from visdom import Visdom
+        self.viz = Visdom(server=config.visdom_server, port=config.visdom_port,
+                          use_incoming_socket=False, raise_exceptions=True)
         self.config = config
         self.env = config.model_name
         # self.env = 'test'
@@ -113,63 +182,154 @@ class VisdomPlotter(object):
             return
 
 
-def make_animation(config, end_epoch, n_c_disc, dim_c_cont, img_list):
+class AnimationWriter(object):
+    """Appends one frame per call to a GIF on disk
 
-    font = {'family': 'serif',
-            'color':  'black',
-            'weight': 'normal',
-            'size': 16, }
+    The file is a complete, playable animation after every append, and only the
+    current frame is held in memory.
+    """
 
-    save_dir = os.path.join(
-        config.project_root, f'results/{config.model_name}/gifs')
-    os.makedirs(save_dir, exist_ok=True)
+    def __init__(self, path, duration=1000, caption_height=14):
+        self.path = path
+        self.duration = duration
+        self.caption_height = caption_height
+        os.makedirs(os.path.dirname(path), exist_ok=True)
 
-    for c_d in range(n_c_disc):
-        for c_c in range(dim_c_cont):
-            fig = plt.figure(figsize=(10, 10))
-            plt.xticks([])
-            plt.yticks([])
-            plt.xlabel(f'Continuous Code Index = {c_c+1}', fontsize=20)
-            plt.ylabel(f'Discrete Code Index = {c_d+1}', fontsize=20)
-            ims = []
-            for epoch in range(end_epoch+1):
-                im = plt.imshow(np.transpose(
-                    img_list[(epoch, c_d, c_c)].numpy(), (1, 2, 0)), animated=True)
-                title = plt.text(
-                    150, -10, f'Generated Images at Epoch: {epoch+1}', horizontalalignment='center', fontdict=font)
-                ims.append([im, title])
-                del(title)
-            anim = animation.ArtistAnimation(
-                fig, ims, interval=1000, repeat_delay=1000, blit=True)
-            anim.save(
-                f'{save_dir}/{config.model_name}-Cd_{c_d+1}-Cc_{c_c+1}.gif', dpi=80, writer='imagemagick')
-            plt.show()
+    def append(self, grid, caption=''):
+        '''
+        grid: [C, H, W] float tensor in [0, 1], e.g. from make_grid(normalize=True)
+        '''
+        frame = self._to_frame(grid, caption)
+        if not os.path.exists(self.path):
+            # First frame writes the header, global palette and loop extension.
+            # optimize=False keeps the full palette so later frames can index into it
+            frame.save(self.path, format='GIF', save_all=True, loop=0,
+                       duration=self.duration, optimize=False)
+            return
+        from PIL import GifImagePlugin
+        params = {'duration': self.duration}
+        if frame.mode == 'P':
+            params['include_color_table'] = True
+        data = b''.join(GifImagePlugin.getdata(frame, **params))
+        with open(self.path, 'r+b') as fp:
+            # Overwrite the trailer byte with the new frame, then close the file again
+            fp.seek(-1, os.SEEK_END)
+            if fp.read(1) != b';':
+                raise IOError(f'{self.path} is not a complete GIF file')
+            fp.seek(-1, os.SEEK_END)
+            fp.write(data + b';')
+        return
 
-    return
+    def _to_frame(self, grid, caption):
+        from PIL import Image, ImageDraw
+        array = (grid.clamp(0, 1) * 255).round().byte().permute(1, 2, 0).numpy()
+        if (array == array[:, :, :1]).all():
+            image = Image.fromarray(array[:, :, 0], mode='L')
+        else:
+            image = Image.fromarray(array).convert('P', palette=Image.ADAPTIVE)
+        if self.caption_height > 0:
+            canvas = Image.new(image.mode, (image.width, image.height + self.caption_height))
+            if image.mode == 'P':
+                canvas.putpalette(image.getpalette())
+            canvas.paste(image, (0, self.caption_height))
+            ImageDraw.Draw(canvas).text((2, 1), caption, fill=255)
+            image = canvas
+        return image
+
+
+def generated_data_title(config, epoch, idx_c_d, idx_c_c):
+    return f'Fixed_{config.model_name}_E-{epoch+1}_Cd-{idx_c_d}_Cc-{idx_c_c}'
 
 
-def plot_generated_data(config, generator, z, epoch, idx_c_d, idx_c_c):
-    with torch.no_grad():
-        gen_data = generator(z).detach().cpu()
-    title = f'Fixed_{config.model_name}_E-{epoch+1}_Cd-{idx_c_d}_Cc-{idx_c_c}'
-    plt.figure(figsize=(10, 10))
-    plt.title(title, fontsize=25)
-    plt.xticks([])
-    plt.yticks([])
-    plt.xlabel(f'Continuous Code Index = {idx_c_c}', fontsize=20)
-    plt.ylabel(f'Discrete Code Index = {idx_c_d}', fontsize=20)
-    plt.imshow(np.transpose(vutils.make_grid(
-        gen_data, nrow=10, padding=2, normalize=True), (1, 2, 0)))
-    result_dir = os.path.join(
-        config.project_root, 'results', config.model_name, 'images')
-    os.makedirs(result_dir, exist_ok=True)
-    plt.savefig(os.path.join(result_dir, title+'.png'))
-    plt.close('all')
-    return gen_data, title
+class ImageRenderer(object):
+    """Writes generated image grids, off the training thread for matplotlib"""
+
+    def __init__(self, config):
+        self.config = config
+        self.backend = config.render_backend
+        self.result_dir = os.path.join(
+            config.project_root, 'results', config.model_name, 'images')
+        self.pool = None
+        self.futures = []
+        if self.backend == 'matplotlib':
+            # spawn: forking a process that already runs torch threads is unsafe
+            self.pool = ProcessPoolExecutor(
+                max_workers=config.render_worker,
+                mp_context=multiprocessing.get_context('spawn'))
+
+    def render(self, gen_data, epoch, idx_c_d, idx_c_c):
+        title = generated_data_title(self.config, epoch, idx_c_d, idx_c_c)
+        if self.backend == 'matplotlib':
+            from plotting import save_generated_figure
+            self._collect(block=False)
+            self.futures.append(self.pool.submit(
+                save_generated_figure, self.config.project_root,
+                self.config.model_name, gen_data, title, idx_c_d, idx_c_c))
+        else:
+            import torchvision.utils as vutils
+            os.makedirs(self.result_dir, exist_ok=True)
+            vutils.save_image(gen_data, os.path.join(self.result_dir, title+'.png'),
+                              nrow=10, padding=2, normalize=True)
+        return title
+
+    def _collect(self, block):
+        # Surface errors of finished jobs
+        pending = []
+        for future in self.futures:
+            if block or future.done():
+                future.result()
+            else:
+                pending.append(future)
+        self.futures = pending
+
+    def close(self):
+        if self.pool is not None:
+            self._collect(block=True)
+            self.pool.shutdown()
+            self.pool = None
+        return
 
 
 # For debugging
 
+class NonFiniteChecker(object):
+    '''Forward hooks raising on NaN/Inf module outputs, active only on sampled steps'''
+
+    def __init__(self, check_step):
+        self.check_step = check_step
+        self.active = False
+        self.handles = []
+
+    def register(self, model, prefix):
+        for name, module in model.named_modules():
+            name = f'{prefix}.{name}' if name else prefix
+            self.handles.append(
+                module.register_forward_hook(self._make_hook(name)))
+        return
+
+    def _make_hook(self, name):
+        def hook(module, inputs, outputs):
+            if not self.active:
+                return
+            if torch.is_tensor(outputs):
+                outputs = (outputs,)
+            for out in outputs:
+                if torch.is_tensor(out) and not torch.isfinite(out).all():
+                    raise RuntimeError(
+                        f'Non-finite output detected in {name} ({module.__class__.__name__})')
+        return hook
+
+    def set_step(self, step):
+        self.active = (step % self.check_step == 0)
+        return
+
+    def remove(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+        return
+
+
 # Extract existing gradient dictionary from model m
 def extract_grad_dict(m):
     param_dict = {}
@@ -201,6 +361,12 @@ def compare_grad(d1, d2):
 # MISC
 
 
+def get_device(gpu_id):
+    if gpu_id >= 0 and torch.cuda.is_available():
+        return torch.device(gpu_id)
+    return torch.device('cpu')
+
+
 def save_config(config):
 
     save_dir = os.path.join(
@@ -0,0 +1,24 @@
+import argparse
+from config import parser
+from checkpoint import restore_run_config
+from models import create_models
+
+
+def test_resume_rebuilds_the_saved_models():
+    saved = parser.parse_args(['--dim_z', '32', '--n_c_disc', '2', '--dim_c_cont', '3'])
+    saved.data_shape = [1, 28, 28]
+    G_saved, D_saved = create_models(saved, saved.data_shape)
+
+    config = parser.parse_args([])
+    changed = restore_run_config(config, saved)
+    assert {name for name, _, _ in changed} == {'dim_z', 'n_c_disc', 'dim_c_cont'}
+    G, D = create_models(config, config.data_shape)
+    G.load_state_dict(G_saved.state_dict())
+    D.load_state_dict(D_saved.state_dict())
+
+
+def test_fields_missing_from_old_checkpoints_keep_their_defaults():
+    saved = argparse.Namespace(dim_z=32)
+    config = parser.parse_args([])
+    restore_run_config(config, saved)
+    assert config.dim_z == 32 and config.dataset == 'mnist'
@@ -0,0 +1,17 @@
+from config import parser
+from data_loader import dataset_dir
+
+
+def synthetic_config(root, *args):
+    return parser.parse_args(['--project_root', str(root), '--dataset', 'synthetic'] + list(args))
+
+
+def test_synthetic_dataset_dir_per_shape_and_size(tmp_path):
+    dirs = {dataset_dir(synthetic_config(tmp_path, *args)) for args in [
+        [], ['--data_dim', '32', '--data_channel', '3'], ['--synthetic_size', '100']]}
+    assert len(dirs) == 3
+
+
+def test_mnist_dataset_dir_unchanged(tmp_path):
+    config = parser.parse_args(['--project_root', str(tmp_path)])
+    assert dataset_dir(config) == str(tmp_path / 'data' / 'mnist')
@@ -0,0 +1,17 @@
+import numpy as np
+from config import parser
+from evaluation import cache_path, frechet_distance
+
+
+def test_cache_path_keyed_on_shape_and_size(tmp_path):
+    config = parser.parse_args(['--project_root', str(tmp_path)])
+    paths = {cache_path(config, np.zeros(shape, dtype=np.uint8), 'eval_classifier.pth')
+             for shape in [(10, 28, 28), (10, 1, 28, 28), (10, 3, 28, 28), (20, 28, 28)]}
+    # [N, H, W] and [N, 1, H, W] are the same images
+    assert len(paths) == 3
+
+
+def test_frechet_distance_of_identical_gaussians_is_zero():
+    features = np.random.RandomState(0).randn(500, 8)
+    mu, sigma = features.mean(0), np.cov(features, rowvar=False)
+    assert abs(frechet_distance(mu, sigma, mu, sigma)) < 1e-6
@@ -0,0 +1,53 @@
+import copy
+import pytest
+import torch
+from models.mnist import resample_steps
+from models.mnist.generator import Generator
+from models.mnist.discriminator import Discriminator
+
+
+@pytest.mark.parametrize('size, steps', [(8, 2), (12, 2), (16, 2), (28, 2), (32, 2), (64, 3)])
+def test_resample_steps(size, steps):
+    assert resample_steps((1, size, size)) == steps
+
+
+@pytest.mark.parametrize('shape', [(1, 10, 10), (1, 28, 30), (3, 6, 8)])
+def test_resample_steps_rejects_non_multiples_of_4(shape):
+    with pytest.raises(ValueError):
+        resample_steps(shape)
+
+
+@pytest.mark.parametrize('size', [8, 12, 16, 28, 32, 64])
+@pytest.mark.parametrize('channel', [1, 3])
+def test_models_build_for_shape(size, channel):
+    data_shape = (channel, size, size)
+    G = Generator(62, 1, 10, 2, data_shape, width=0.5)
+    D = Discriminator(1, 10, 2, data_shape, width=0.5)
+    images = G(torch.randn(2, G.dim_latent))
+    assert images.shape == (2,) + data_shape
+    probability, c_disc_logits, c_cont_mu, c_cont_logvar = D(images)
+    assert probability.shape == (2,)
+    assert c_disc_logits.shape == (2, 1, 10)
+    assert c_cont_mu.shape == c_cont_logvar.shape == (2, 2)
+
+
+def test_default_shape_keeps_paper_model():
+    G = Generator(62, 1, 10, 2)
+    D = Discriminator(1, 10, 2)
+    assert [name for name, _ in G.named_children()] == \
+        ['fc1', 'bn1', 'fc2', 'bn2', 'upconv3', 'bn3', 'upconv4']
+    assert G.fc2.out_features == 128 * 7 * 7
+    assert D.module_shared[-3].in_features == 128 * 7 * 7
+
+
+def test_split_forward_matches_separate_calls():
+    torch.manual_seed(0)
+    D = Discriminator(1, 10, 2)
+    D_fused = copy.deepcopy(D)
+    real, fake = torch.rand(8, 1, 28, 28), torch.rand(8, 1, 28, 28)
+    separate = torch.cat([D(real, heads='D')[0], D(fake, heads='D')[0]])
+    fused = D_fused(torch.cat((real, fake)), heads='D', num_splits=2)[0]
+    assert torch.allclose(fused, separate, atol=1e-6)
+    # BatchNorm running statistics get the same two updates
+    for buffer, fused_buffer in zip(D.buffers(), D_fused.buffers()):
+        assert torch.allclose(buffer.float(), fused_buffer.float(), atol=1e-6)
@@ -0,0 +1,123 @@
+import json
+import time
+import socket
+import argparse
+import threading
+import numpy as np
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from publisher import VisdomPublisher, replay_events
+from utils import VisdomPlotter
+
+# The stub server answers the real Visdom client
+pytest.importorskip('visdom')
+
+
+class StubVisdom(object):
+    '''Local HTTP server answering the Visdom client, requests wait while `gate` is clear'''
+
+    def __init__(self):
+        self.requests = []
+        self.gate = threading.Event()
+        self.gate.set()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+                stub.requests.append((self.path, body))
+                stub.gate.wait()
+                self.send_response(200)
+                self.end_headers()
+                # win_exists is answered false, so every plot creates its window
+                self.wfile.write(b'false' if self.path == '/win_exists' else b'win')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def lines(self):
+        # (split_name, x) of every line plot received
+        lines = []
+        for path, body in self.requests:
+            data = json.loads(body).get('data') if path == '/events' else None
+            if data and 'x' in data[0]:
+                lines.append((data[0]['name'], data[0]['x']))
+        return lines
+
+    def wait_for_request(self, timeout=10.0):
+        deadline = time.time() + timeout
+        while not self.requests and time.time() < deadline:
+            time.sleep(0.01)
+        assert self.requests, 'no request reached the stub server'
+
+    def close(self):
+        self.gate.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setenv('NO_PROXY', '127.0.0.1')
+    stub = StubVisdom()
+    yield stub
+    stub.close()
+
+
+def publisher_config(root, port):
+    return argparse.Namespace(project_root=str(root), model_name='publisher_test',
+                              visdom_server='http://127.0.0.1', visdom_port=port)
+
+
+def test_queued_line_updates_are_coalesced(tmp_path, stub):
+    stub.gate.clear()
+    publisher = VisdomPublisher(publisher_config(tmp_path, stub.port))
+    publisher.plot_line('Loss_D', 'D', 'Loss D', [0], [1.0])
+    # The worker is now blocked on the server, the next updates queue up
+    stub.wait_for_request()
+    for step in [1, 2, 3]:
+        publisher.plot_line('Loss_D', 'D', 'Loss D', [step], [1.0])
+    publisher.plot_line('Loss_G', 'G', 'Loss G', [1], [1.0])
+    assert len(publisher.events) == 2
+    stub.gate.set()
+    publisher.close()
+    assert stub.lines() == [('D', [0.0]), ('D', [1.0, 2.0, 3.0]), ('G', [1.0])]
+
+
+def test_full_queue_drops_images_without_blocking(tmp_path, stub):
+    stub.gate.clear()
+    publisher = VisdomPublisher(publisher_config(tmp_path, stub.port), max_queue=4)
+    publisher.plot_line('Loss_D', 'D', 'Loss D', [0], [1.0])
+    stub.wait_for_request()
+    publisher.plot_line('Loss_D', 'D', 'Loss D', [1], [1.0])
+    start = time.time()
+    for i in range(50):
+        publisher.plot_image_grid('Grid', np.zeros((10, 1, 8, 8), dtype=np.float32), f'{i}')
+    assert time.time() - start < 1.0
+    assert len(publisher.events) == 4
+    assert publisher.num_dropped == 47
+    # Images go first, the pending line update is kept
+    assert publisher.events[0]['type'] == 'line'
+    stub.gate.set()
+    publisher.close()
+
+
+def test_unreachable_server_falls_back_to_event_file(tmp_path, stub):
+    # Port of a closed socket, nothing listens there
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    publisher = VisdomPublisher(publisher_config(tmp_path, port))
+    publisher.plot_line('Loss_D', 'D', 'Loss D', [0, 1], [1.0, 0.5])
+    publisher.plot_image_grid('Grid', np.zeros((10, 1, 8, 8), dtype=np.float32), 'grid')
+    publisher.close()
+    with open(publisher.event_file) as fp:
+        events = [json.loads(line) for line in fp]
+    assert [event['type'] for event in events] == ['line', 'image_grid']
+
+    replay_events(publisher.event_file, VisdomPlotter(publisher_config(tmp_path, stub.port)))
+    assert stub.lines() == [('D', [0.0, 1.0])]
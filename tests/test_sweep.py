@@ -0,0 +1,23 @@
+import pytest
+from sweep import check_metric, expand_spec
+
+
+@pytest.mark.parametrize('metric', ['I', 'I_c_total', 'I_c_1'])
+def test_metric_scaled_by_swept_lambda_is_refused(metric):
+    with pytest.raises(ValueError):
+        check_metric(metric, {'lambda_cont': [0.05, 0.1]})
+
+
+@pytest.mark.parametrize('metric', ['G', 'D', 'I_d', 'I'])
+def test_unweighted_metric_is_accepted(metric):
+    check_metric(metric, {'lr_G': [1e-3, 2e-3]})
+
+
+def test_metric_scaled_by_annealed_lambda_is_refused():
+    with pytest.raises(ValueError, match='annealed'):
+        check_metric('I_d_1', ['lambda_disc'], reason='annealed')
+
+
+def test_grid_spec_expands_to_product():
+    trials = expand_spec({'params': {'lambda_cont': [0.05, 0.1], 'lr_G': [1e-3, 2e-3, 4e-3]}})
+    assert len(trials) == 6